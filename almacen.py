@@ -0,0 +1,274 @@
+"""Scenario storage shared by all sessions of the server process.
+
+Scenario payloads are interned by content: two sessions holding the same inputs (the
+defaults, a scenario loaded from the same export) reference one dict, so resident
+memory grows with distinct data instead of with the number of users. Payloads are
+read-only once interned. Results are cached the same way, keyed by content, in a
+bounded process-wide LRU (MAX_RESULTADOS), and so are the what-if response grids of
+sensibilidad.py (MAX_RESPUESTAS).
+
+Each session's saved scenarios live in an EscenariosSesion, a mapping that accounts
+the bytes it keeps resident against a budget (CALCULADORA_MEMORIA_SESION, bytes).
+Over budget, the least recently used scenarios are written to a content-addressed
+store on disk (CALCULADORA_ALMACEN) and reloaded transparently when accessed again;
+reading never evicts, so listing or batching a session's scenarios does not thrash.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import metricas
+import sensibilidad
+from escenarios import Scenario
+
+PRESUPUESTO_SESION = int(os.environ.get("CALCULADORA_MEMORIA_SESION", 256 * 1024))
+RUTA_ALMACEN = os.environ.get("CALCULADORA_ALMACEN", os.path.join(tempfile.gettempdir(), "calculadora_almacen"))
+MAX_RESULTADOS = 512
+# Cada rejilla de sensibilidad ocupa unos 300 KB
+MAX_RESPUESTAS = 64
+# Ficheros del almacén sin acceso en este tiempo se borran al arrancar el proceso
+RETENCION_ALMACEN = 7 * 24 * 3600
+
+
+class Datos(dict):
+    """Interned scenario payload (a dict that can be weakly referenced)."""
+
+    __slots__ = ("__weakref__",)
+
+
+_lock = threading.Lock()
+_internados = weakref.WeakValueDictionary()
+_resultados = OrderedDict()
+_respuestas = OrderedDict()
+
+
+def clave_contenido(d):
+    """Stable content hash of a scenario payload."""
+    canonico = json.dumps(d, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(canonico.encode("utf-8")).hexdigest()
+
+
+def internar(d, clave=None):
+    """The shared copy of payload `d`; returns (clave, datos)."""
+    clave = clave or clave_contenido(d)
+    with _lock:
+        datos = _internados.get(clave)
+        if datos is None:
+            datos = _internados[clave] = Datos(d)
+        else:
+            metricas.incrementar("escenarios_compartidos")
+    return clave, datos
+
+
+def tamano(d):
+    """Approximate resident bytes of a payload, nested lists and dicts (habitaciones, temporada) included.
+
+    Dict keys are interned strings and not counted.
+    """
+    if isinstance(d, dict):
+        return sys.getsizeof(d) + sum(tamano(valor) for valor in d.values())
+    if isinstance(d, (list, tuple)):
+        return sys.getsizeof(d) + sum(tamano(valor) for valor in d)
+    return sys.getsizeof(d)
+
+
+def _compartido(cache, maximo, contador, d, calcular):
+    """calcular(d) through the LRU `cache` keyed by the content of `d`."""
+    clave = clave_contenido(d)
+    with _lock:
+        valor = cache.get(clave)
+        if valor is not None:
+            cache.move_to_end(clave)
+            metricas.incrementar(contador)
+            return valor
+    valor = calcular(d)
+    with _lock:
+        cache[clave] = valor
+        while len(cache) > maximo:
+            cache.popitem(last=False)
+    return valor
+
+
+def resultados(d):
+    """Scenario.from_dict(d).results(), shared across sessions by content; treat as read-only."""
+    return _compartido(
+        _resultados, MAX_RESULTADOS, "resultados_compartidos", d, lambda d: Scenario.from_dict(d).results()
+    )
+
+
+def respuestas(d):
+    """sensibilidad.precalcular(d), shared across sessions by content; treat as read-only."""
+    return _compartido(_respuestas, MAX_RESPUESTAS, "respuestas_compartidas", d, sensibilidad.precalcular)
+
+
+def estadisticas():
+    """Process-wide counts of interned payloads, cached results and what-if grids."""
+    with _lock:
+        return {
+            "payloads_internados": len(_internados),
+            "resultados_en_cache": len(_resultados),
+            "respuestas_en_cache": len(_respuestas),
+        }
+
+
+class AlmacenDisco:
+    """Content-addressed JSON files, one per distinct payload."""
+
+    __slots__ = ("ruta",)
+
+    def __init__(self, ruta=RUTA_ALMACEN):
+        self.ruta = ruta
+        os.makedirs(ruta, exist_ok=True)
+
+    def _fichero(self, clave):
+        return os.path.join(self.ruta, f"{clave}.json")
+
+    def guardar(self, clave, datos):
+        fichero = self._fichero(clave)
+        if os.path.exists(fichero):
+            os.utime(fichero)
+            return
+        temporal = f"{fichero}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, fichero)
+
+    def cargar(self, clave):
+        with open(self._fichero(clave), encoding="utf-8") as f:
+            return json.load(f)
+
+    def limpiar(self, antiguedad=RETENCION_ALMACEN):
+        limite = time.time() - antiguedad
+        for nombre in os.listdir(self.ruta):
+            fichero = os.path.join(self.ruta, nombre)
+            try:
+                if os.path.getmtime(fichero) < limite:
+                    os.remove(fichero)
+            except OSError:
+                pass
+
+
+_almacen = None
+
+
+def almacen_disco():
+    """Process-wide AlmacenDisco (created, and purged of stale files, on first use)."""
+    global _almacen
+    with _lock:
+        if _almacen is None:
+            _almacen = AlmacenDisco()
+            _almacen.limpiar()
+        return _almacen
+
+
+class _Entrada:
+    __slots__ = ("clave", "timestamp", "datos", "tamano", "acceso")
+
+    def __init__(self, clave, timestamp, datos):
+        self.clave = clave
+        self.timestamp = timestamp
+        self.datos = datos
+        self.tamano = tamano(datos)
+        self.acceso = time.monotonic()
+
+
+class EscenariosSesion(MutableMapping):
+    """A session's saved_scenarios ({name: {"data": ..., "timestamp": ...}}) under a memory budget.
+
+    Values are built on access; the "data" dict is the interned payload and must not
+    be modified (save a new dict instead). Names and timestamps stay in memory
+    (metadatos), so listing the scenarios never touches the disk. Only inserting evicts;
+    a payload read back from disk is kept resident only if it fits the budget.
+    """
+
+    __slots__ = ("presupuesto", "_entradas", "_almacen", "_residentes")
+
+    def __init__(self, presupuesto=PRESUPUESTO_SESION, almacen=None):
+        self.presupuesto = presupuesto
+        self._entradas = {}
+        self._almacen = almacen
+        self._residentes = 0
+
+    def _disco(self):
+        return self._almacen or almacen_disco()
+
+    def __setitem__(self, nombre, escenario):
+        if nombre in self._entradas:
+            del self[nombre]
+        clave, datos = internar(escenario["data"])
+        entrada = self._entradas[nombre] = _Entrada(clave, escenario.get("timestamp"), datos)
+        self._residentes += entrada.tamano
+        self._ajustar(nombre)
+
+    def __getitem__(self, nombre):
+        entrada = self._entradas[nombre]
+        entrada.acceso = time.monotonic()
+        datos = entrada.datos
+        if datos is None:
+            datos = internar(self._disco().cargar(entrada.clave), entrada.clave)[1]
+            metricas.incrementar("escenarios_recuperados_disco")
+            # Sin desalojar a otros: leer no debe provocar escrituras en disco
+            if self._residentes + entrada.tamano <= self.presupuesto:
+                entrada.datos = datos
+                self._residentes += entrada.tamano
+        return {"data": datos, "timestamp": entrada.timestamp}
+
+    def __delitem__(self, nombre):
+        entrada = self._entradas.pop(nombre)
+        if entrada.datos is not None:
+            self._residentes -= entrada.tamano
+
+    def __iter__(self):
+        return iter(self._entradas)
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def metadatos(self):
+        """{name: timestamp} of every scenario, without loading any payload."""
+        return {nombre: entrada.timestamp for nombre, entrada in self._entradas.items()}
+
+    def huella(self):
+        """Hashable (name, content key) pairs: changes whenever a scenario is saved, replaced or deleted."""
+        return tuple((nombre, entrada.clave) for nombre, entrada in self._entradas.items())
+
+    def bytes_residentes(self):
+        return self._residentes
+
+    def _ajustar(self, protegido):
+        """Evict least recently used payloads to disk until the session fits its budget."""
+        if self._residentes <= self.presupuesto:
+            return
+        residentes = sorted(
+            (e.acceso, nombre) for nombre, e in self._entradas.items() if e.datos is not None and nombre != protegido
+        )
+        for _, nombre in residentes:
+            if self._residentes <= self.presupuesto:
+                break
+            entrada = self._entradas[nombre]
+            self._disco().guardar(entrada.clave, entrada.datos)
+            entrada.datos = None
+            self._residentes -= entrada.tamano
+            metricas.incrementar("escenarios_desalojados")
+
+    def memoria(self):
+        """Accounting for this session: scenario counts, resident bytes and budget."""
+        en_memoria = sum(1 for e in self._entradas.values() if e.datos is not None)
+        return {
+            "escenarios": len(self._entradas),
+            "en_memoria": en_memoria,
+            "en_disco": len(self._entradas) - en_memoria,
+            "bytes": self.bytes_residentes(),
+            "presupuesto": self.presupuesto,
+        }
+
+    def to_dict(self):
+        """Plain {name: {"data": ..., "timestamp": ...}} copy, e.g. for JSON export."""
+        return {nombre: self[nombre] for nombre in self}
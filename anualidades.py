@@ -0,0 +1,110 @@
+"""Precomputed annuity and remaining-balance factors for French-amortization mortgages.
+
+The form quantizes the TIN to 0.01 % steps and the term to whole years, so the same
+(tin, años) pairs recur across every scenario. For TIN 0.01-10.00 % and 1-40 years the
+factors come from tables built once per process; anything else (finer TIN, fractional
+terms) falls back to the exact formula.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+TIN_CENTESIMAS_MAX = 1000  # 10.00 %
+ANOS_MAX = 40
+MESES_MAX = ANOS_MAX * 12
+
+
+@lru_cache(maxsize=1)
+def tablas():
+    """Build (1 + r)^k for every table TIN and month, plus the annuity factor per (TIN, years).
+
+    Rows are TIN in hundredths of a percent minus one; the growth table has one column
+    per month 0..480 (~3.8 MB) and the annuity table one per term 1..40 years.
+    """
+    r = np.arange(1, TIN_CENTESIMAS_MAX + 1) / 100 / 100 / 12
+    crecimiento = (1 + r[:, None]) ** np.arange(MESES_MAX + 1)[None, :]
+    g_n = crecimiento[:, 12 * np.arange(1, ANOS_MAX + 1)]
+    anualidad = r[:, None] * g_n / (g_n - 1)
+    return r, crecimiento, anualidad
+
+
+def _en_tabla(tin, anos):
+    """Mask of (tin, años) pairs covered by the tables and their TIN row index."""
+    escala = tin * 100
+    centesimas = np.rint(escala)
+    dentro = (
+        (np.abs(escala - centesimas) < 1e-6)
+        & (centesimas >= 1) & (centesimas <= TIN_CENTESIMAS_MAX)
+        & (anos == np.rint(anos)) & (anos >= 1) & (anos <= ANOS_MAX)
+    )
+    return dentro, np.where(dentro, centesimas - 1, 0).astype(np.intp)
+
+
+def _anualidad_exacta(tin, anos):
+    total_cuotas = anos * 12
+    r = tin / 100 / 12
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        factor = np.where(r > 0, r / (1 - (1 + r) ** (-total_cuotas)), 1 / total_cuotas)
+    return np.where(np.isfinite(factor) & (total_cuotas > 0), factor, 0.0)
+
+
+def _saldo_exacto(tin, anos, k):
+    total_cuotas = anos * 12
+    r = tin / 100 / 12
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        g_n = (1 + r) ** total_cuotas
+        factor = np.where(r > 0, (g_n - (1 + r) ** k) / (g_n - 1), 1 - k / total_cuotas)
+    return np.where(np.isfinite(factor), factor, 0.0)
+
+
+def factor_anualidad_escalar(tin, hipoteca_anos):
+    """Scalar factor_anualidad without NumPy call overhead, for the interactive path."""
+    centesimas = round(tin * 100)
+    if (
+        abs(tin * 100 - centesimas) < 1e-6 and 1 <= centesimas <= TIN_CENTESIMAS_MAX
+        and hipoteca_anos == int(hipoteca_anos) and 1 <= hipoteca_anos <= ANOS_MAX
+    ):
+        return float(tablas()[2][centesimas - 1, int(hipoteca_anos) - 1])
+
+    total_cuotas = hipoteca_anos * 12
+    if total_cuotas <= 0:
+        return 0.0
+    if tin <= 0:
+        return 1 / total_cuotas
+    r = tin / 100 / 12
+    return r / (1 - (1 + r) ** (-total_cuotas))
+
+
+def factor_anualidad(tin, hipoteca_anos):
+    """Monthly payment per euro of principal (vectorized); 0 for non-positive terms."""
+    tin = np.asarray(tin, dtype=float)
+    anos = np.asarray(hipoteca_anos, dtype=float)
+    dentro, fila = _en_tabla(tin, anos)
+    columna = np.where(dentro, anos - 1, 0).astype(np.intp)
+    factor = tablas()[2][fila, columna]
+    if not dentro.all():
+        factor = np.where(dentro, factor, _anualidad_exacta(tin, anos))
+    return factor
+
+
+def factor_saldo(tin, hipoteca_anos, meses):
+    """Outstanding principal per euro borrowed after `meses` monthly payments (vectorized).
+
+    Pass `tin` and `hipoteca_anos` per scenario (e.g. shape (n, 1)) and `meses` as the
+    broadcast grid, so the domain check runs once per scenario. Within the table domain
+    `meses` must be whole months.
+    """
+    tin = np.asarray(tin, dtype=float)
+    anos = np.asarray(hipoteca_anos, dtype=float)
+    total_cuotas = np.maximum(anos * 12, 0)
+    k = np.clip(np.asarray(meses, dtype=float), 0, total_cuotas)
+    dentro, fila = _en_tabla(tin, anos)
+
+    crecimiento = tablas()[1]
+    g_n = crecimiento[fila, np.where(dentro, total_cuotas, 0).astype(np.intp)]
+    g_k = crecimiento[fila, np.where(dentro, k, 0).astype(np.intp)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = (g_n - g_k) / (g_n - 1)
+    if not dentro.all():
+        factor = np.where(dentro, factor, _saldo_exacto(tin, anos, k))
+    return np.where(k >= total_cuotas, 0.0, np.maximum(factor, 0.0))
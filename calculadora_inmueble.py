@@ -1,449 +1,78 @@
 import streamlit as st
-import math
-import json
-from datetime import datetime
-import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-import numpy as np
-import streamlit.components.v1 as components
+import instrumentacion
+
+# Antes de importar nada más: el tramo "importaciones" cuenta en este rerun y el primero
+# del proceso (primer_rerun) incluye la carga de los módulos
+instrumentacion.iniciar_rerun()
+
+# Solo las dependencias del formulario: pandas, Plotly y los módulos que las usan se
+# importan al mostrar los resultados por primera vez (ver "importaciones_resultados")
+with instrumentacion.medir("importaciones"):
+    import math
+    import os
+    import json
+    import uuid
+    from datetime import datetime
+    from functools import partial
+    import numpy as np
+    import streamlit.components.v1 as components
+
+    import almacen
+    import comparables
+    import fiscalidad
+    import habitaciones
+    import impuestos_compra
+    import metricas
+    import plantillas
+    import sensibilidad
+    import temporada
+    import venta
+    from plantillas import format_number
+    from calculos import validate_inputs, safe_calculate_mortgage
+    from escenarios import Scenario, ScenarioSet
 
 top_placeholder = st.empty()
 
 st.set_page_config(page_title="Calculadora de inversión inmobiliaria", layout="centered")
 
-st.markdown("""
-<style>
-.big-title { 
-font-size: 2.2em; 
-font-weight: 800; 
-text-align: center; 
-margin-bottom: 0.15em; 
-margin-top: 0.4em;
-}
-.step-header {
-font-size: 1.5em; 
-font-weight: bold; 
-color: #4CAF50;
-}
-.block-title { 
-font-size: 1.13em; 
-font-weight: bold; 
-color: #207ca5; 
-margin-bottom: 0.3em; 
-margin-top:0.2em;
-}
-.block-box { 
-border: 2px solid #e7e8fa; 
-border-radius: 10px; 
-background: #f8fafb; 
-padding: 1.1em 1.2em 0.8em 1.2em; 
-margin-bottom: 1.2em;
-}
-
-/* Mobile responsiveness */
-@media (max-width: 768px) {
-.big-title { 
-    font-size: 1.8em; 
-    line-height: 1.2;
-}
-.step-header { 
-    font-size: 1.3em; 
-}
-.block-box { 
-    padding: 0.8em 1em 0.6em 1em; 
-    margin-bottom: 1em;
-}
-/* Stack columns on mobile */
-.element-container .row-widget.stColumns {
-    flex-direction: column !important;
-}
-.element-container .row-widget.stColumns > div {
-    width: 100% !important;
-    margin-bottom: 1rem;
-}
-}
-
-/* Better button styling */
-.stButton > button {
-width: 100%;
-border-radius: 8px;
-transition: all 0.3s ease;
-}
-
-.stButton > button:hover {
-transform: translateY(-2px);
-box-shadow: 0 4px 12px rgba(0,0,0,0.15);
-}
-
-/* Improved expander styling */
-.streamlit-expanderHeader {
-font-weight: 600;
-border-radius: 8px;
-}
-
-/* Better spacing for mobile forms */
-@media (max-width: 768px) {
-.stNumberInput > div > div > input {
-    font-size: 16px; /* Prevents zoom on iOS */
-}
-.stTextInput > div > div > input {
-    font-size: 16px;
-}
-}
-</style>
-""", unsafe_allow_html=True)
-
-# Browser-local storage using Streamlit session state only
-# This ensures scenarios are saved locally per browser session and not shared across devices
+# Panel de perfil oculto: se activa con ?debug=1 en la URL y solo muestra los contadores
+# baratos; el modo detallado (tracemalloc, log JSON) queda reservado a CALCULADORA_PERFIL=1
+modo_debug = st.query_params.get("debug") == "1"
 
-# Validation functions
-def validate_inputs(precio_compra, alquiler_mes, entrada, tin, hipoteca_anos):
-    """Validate financial inputs and return error messages if any."""
-    errors = []
-    warnings = []
-
-    # Critical validations (errors)
-    if entrada > precio_compra:
-        errors.append("⚠️ La entrada no puede ser mayor al precio de compra")
-
-    if alquiler_mes * 12 < precio_compra * 0.03:
-        errors.append("⚠️ El alquiler anual parece muy bajo comparado con el precio (< 3% anual)")
-
-    if alquiler_mes * 12 > precio_compra * 0.20:
-        errors.append("⚠️ El alquiler anual parece muy alto comparado con el precio (> 20% anual)")
-
-    if tin < 0.5 or tin > 15:
-        errors.append("⚠️ El tipo de interés parece fuera del rango normal (0.5% - 15%)")
-
-    if hipoteca_anos < 5 or hipoteca_anos > 40:
-        errors.append("⚠️ Los años de hipoteca están fuera del rango típico (5-40 años)")
-
-    # Advisory validations (warnings)
-    if entrada < precio_compra * 0.15:
-        warnings.append("💡 Entrada menor al 15% puede requerir condiciones especiales del banco")
-
-    if alquiler_mes * 12 < precio_compra * 0.05:
-        warnings.append("💡 Rentabilidad bruta muy baja (< 5% anual)")
-
-    if tin > 5:
-        warnings.append("💡 Tipo de interés alto, considera negociar con otros bancos")
-
-    return errors, warnings
-
-def safe_calculate_mortgage(capital_prestamo, tin, hipoteca_anos):
-    """Safely calculate mortgage payment with error handling."""
-    try:
-        if tin <= 0:
-            return capital_prestamo / (hipoteca_anos * 12) if hipoteca_anos > 0 else 0
-        
-        tipo_interes_mensual = tin / 100 / 12
-        total_cuotas = hipoteca_anos * 12
-        
-        if total_cuotas <= 0:
-            return 0
-            
-        cuota_mensual = (
-            capital_prestamo * tipo_interes_mensual / 
-            (1 - (1 + tipo_interes_mensual) ** (-total_cuotas))
+def inyectar_estilos():
+    """Link the stylesheet (downloaded once, then cached by the browser) or inline it as fallback."""
+    if st.get_option("server.enableStaticServing"):
+        st.markdown(
+            f"<link rel='stylesheet' href='app/static/estilos.css?v={plantillas.version_estilos()}'>",
+            unsafe_allow_html=True
         )
-        return cuota_mensual
-    except (ZeroDivisionError, OverflowError, ValueError):
-        return 0
-
-def calcular_resultados(
-    precio_compra, reformas, comision_agencia, alquiler_mes, entrada, tin,
-    hipoteca_anos, irpf_marginal, valor_construccion_pct, gastos_compra, itp_iva,
-    seguro_impago, impuesto_basuras, seguro_hogar, seguro_vida,
-    comunidad, ibi, mantenimiento, vacio_pct, aplica_reduccion_60
-):
-    inversion_inicial = entrada + reformas + comision_agencia + gastos_compra + itp_iva
-
-    capital_prestamo = precio_compra - entrada
-    cuota_mensual = safe_calculate_mortgage(capital_prestamo, tin, hipoteca_anos)
-    cuota_hipoteca_anual = cuota_mensual * 12
-
-    ingresos_anuales = alquiler_mes * 12
-
-    periodos_vacio = alquiler_mes * (vacio_pct / 100) * 12
-
-    gastos_recurrentes = sum([
-        seguro_impago, impuesto_basuras, seguro_hogar, seguro_vida,
-        comunidad, ibi, mantenimiento, periodos_vacio
-    ])
-
-    gastos_anuales = gastos_recurrentes + cuota_hipoteca_anual
-
-    valor_construccion = precio_compra * valor_construccion_pct / 100
-    amortizacion_anual = valor_construccion * 0.03
-
-    # Beneficio antes de impuestos y amortización
-    beneficio_AI = ingresos_anuales - gastos_anuales
-    beneficio_AI_amort = beneficio_AI - amortizacion_anual
-
-    if aplica_reduccion_60:
-        # Aplica reducción solo si corresponde (vivienda entera)
-        deduccion_60residencia = beneficio_AI_amort * 0.6
-        base_imponible = beneficio_AI_amort * 0.4
     else:
-        deduccion_60residencia = 0
-        base_imponible = beneficio_AI_amort
-
-    irpf = max(base_imponible * (irpf_marginal / 100), 0)
-
-    beneficio_DI = beneficio_AI - irpf
-
-    rentabilidad_neta_real = beneficio_DI / inversion_inicial * 100 if inversion_inicial > 0 else 0
-
-    # For visual breakdown
-    gastos_dict = [
-        ("Seguro impago", seguro_impago),
-        ("Impuesto basuras", impuesto_basuras),
-        ("Seguro hogar", seguro_hogar),
-        ("Seguro vida", seguro_vida),
-        ("Comunidad", comunidad),
-        ("IBI", ibi),
-        ("Mantenimiento", mantenimiento),
-        ("Vacío (total)", periodos_vacio),
-        ("Cuota hipoteca anual", cuota_hipoteca_anual)
-    ]
-
-    return {
-        "inversion_inicial": inversion_inicial,
-        "cuota_mensual": cuota_mensual,
-        "cuota_hipoteca_anual": cuota_hipoteca_anual,
-        "ingresos_anuales": ingresos_anuales,
-        "gastos_recurrentes": gastos_recurrentes,
-        "gastos_dict": gastos_dict,
-        "gastos_anuales": gastos_anuales,
-        "amortizacion_anual": amortizacion_anual,
-        "beneficio_AI": beneficio_AI,
-        "beneficio_AI_amort": beneficio_AI_amort,
-        "base_imponible": base_imponible,
-        "irpf": irpf,
-        "beneficio_DI": beneficio_DI,
-        "rentabilidad_neta_real": rentabilidad_neta_real
-    }
-
-# Chart creation functions
-def create_profit_over_time_chart(data, results):
-    """Create a chart showing annual profit over the mortgage period"""
-    years = list(range(1, data['hipoteca_anos'] + 1))
-    annual_profit = [results['beneficio_DI']] * len(years)
-    cumulative_profit = np.cumsum(annual_profit)
-
-    fig = make_subplots(
-        rows=2, cols=1,
-        subplot_titles=('Beneficio Anual', 'Beneficio Acumulado'),
-        vertical_spacing=0.1
-    )
-
-    # Annual profit
-    fig.add_trace(
-        go.Scatter(
-            x=years, y=annual_profit,
-            mode='lines+markers',
-            name='Beneficio Anual',
-            line=dict(color='#2E8B57', width=3),
-            marker=dict(size=6)
-        ),
-        row=1, col=1
-    )
-
-    # Cumulative profit
-    fig.add_trace(
-        go.Scatter(
-            x=years, y=cumulative_profit,
-            mode='lines+markers',
-            name='Beneficio Acumulado',
-            line=dict(color='#1E90FF', width=3),
-            marker=dict(size=6),
-            fill='tonexty'
-        ),
-        row=2, col=1
-    )
-
-    fig.update_layout(
-        title="📈 Evolución de Beneficios a lo largo del tiempo",
-        height=500,
-        showlegend=False,
-        template="plotly_white"
-    )
-
-    fig.update_yaxes(title_text="Euros (€)", tickformat=",")
-    fig.update_xaxes(title_text="Años", row=2, col=1)
-
-    return fig
-
-def create_mortgage_breakdown_chart(data):
-    """Create a chart showing mortgage payment breakdown over time"""
-    capital_prestamo = data['precio_compra'] - data['entrada']
-    monthly_rate = data['tin'] / 100 / 12
-    total_payments = data['hipoteca_anos'] * 12
-    monthly_payment = safe_calculate_mortgage(capital_prestamo, data['tin'], data['hipoteca_anos'])
-
-    years = []
-    principal_payments = []
-    interest_payments = []
-    remaining_balance = capital_prestamo
-
-    for year in range(1, data['hipoteca_anos'] + 1):
-        annual_principal = 0
-        annual_interest = 0
-        
-        for month in range(12):
-            if remaining_balance > 0:
-                interest_payment = remaining_balance * monthly_rate
-                principal_payment = monthly_payment - interest_payment
-                
-                annual_interest += interest_payment
-                annual_principal += principal_payment
-                remaining_balance -= principal_payment
-        
-        years.append(year)
-        principal_payments.append(annual_principal)
-        interest_payments.append(annual_interest)
-
-    fig = go.Figure()
-
-    fig.add_trace(go.Bar(
-        x=years,
-        y=interest_payments,
-        name='Intereses',
-        marker_color='#FF6B6B'
-    ))
-
-    fig.add_trace(go.Bar(
-        x=years,
-        y=principal_payments,
-        name='Capital',
-        marker_color='#4ECDC4'
-    ))
-
-    fig.update_layout(
-        title="🏦 Desglose de Pagos de Hipoteca (Capital vs Intereses)",
-        xaxis_title="Años",
-        yaxis_title="Euros (€)",
-        barmode='stack',
-        template="plotly_white",
-        height=400
-    )
-
-    fig.update_yaxes(tickformat=",")
-
-    return fig
-
-def create_net_worth_chart(data, results):
-    """Create a chart showing net worth evolution over time"""
-    years = list(range(0, data['hipoteca_anos'] + 1))
-
-    # Calculate property appreciation (assuming 2% annual)
-    property_appreciation_rate = 0.02
-    property_values = [data['precio_compra'] * (1 + property_appreciation_rate) ** year for year in years]
-
-    # Calculate mortgage balance
-    capital_prestamo = data['precio_compra'] - data['entrada']
-    monthly_rate = data['tin'] / 100 / 12
-    monthly_payment = safe_calculate_mortgage(capital_prestamo, data['tin'], data['hipoteca_anos'])
-
-    mortgage_balances = [capital_prestamo]
-    remaining_balance = capital_prestamo
-
-    for year in range(1, data['hipoteca_anos'] + 1):
-        for month in range(12):
-            if remaining_balance > 0:
-                interest_payment = remaining_balance * monthly_rate
-                principal_payment = monthly_payment - interest_payment
-                remaining_balance -= principal_payment
-        mortgage_balances.append(max(0, remaining_balance))
-
-    # Calculate net worth (property value - mortgage balance)
-    net_worth = [prop_val - mortgage_bal for prop_val, mortgage_bal in zip(property_values, mortgage_balances)]
-
-    fig = go.Figure()
-
-    fig.add_trace(go.Scatter(
-        x=years, y=property_values,
-        mode='lines+markers',
-        name='Valor Propiedad',
-        line=dict(color='#32CD32', width=3),
-        marker=dict(size=6)
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=years, y=mortgage_balances,
-        mode='lines+markers',
-        name='Deuda Hipoteca',
-        line=dict(color='#FF4500', width=3),
-        marker=dict(size=6)
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=years, y=net_worth,
-        mode='lines+markers',
-        name='Patrimonio Neto',
-        line=dict(color='#1E90FF', width=4),
-        marker=dict(size=8),
-        fill='tonexty'
-    ))
-
-    fig.update_layout(
-        title="💰 Evolución del Patrimonio Neto",
-        xaxis_title="Años",
-        yaxis_title="Euros (€)",
-        template="plotly_white",
-        height=500,
-        hovermode='x unified'
-    )
-
-    fig.update_yaxes(tickformat=",")
+        st.markdown(f"<style>{plantillas.estilos_css()}</style>", unsafe_allow_html=True)
 
-    return fig
+inyectar_estilos()
 
-def create_expense_breakdown_chart(results):
-    """Create a pie chart showing expense breakdown"""
-    expenses = results['gastos_dict']
+# Per-session storage in Streamlit session state, not shared across devices.
+# Identical payloads are interned across sessions and, over the session's memory
+# budget, cold scenarios move to the server's on-disk store (almacen.py)
 
-    # Filter out zero expenses and prepare data
-    non_zero_expenses = [(name, value) for name, value in expenses if value > 0]
-
-    if not non_zero_expenses:
-        return None
-
-    names, values = zip(*non_zero_expenses)
-
-    # Custom colors for different expense types
-    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8C8', '#F7DC6F', '#BB8FCE']
-
-    fig = go.Figure(data=[go.Pie(
-        labels=names,
-        values=values,
-        hole=0.4,
-        marker=dict(colors=colors[:len(names)]),
-        textinfo='label+percent',
-        textposition='outside'
-    )])
-
-    fig.update_layout(
-        title="📊 Desglose de Gastos Anuales",
-        template="plotly_white",
-        height=500,
-        showlegend=True
-    )
-
-    return fig
-
-# Initialize session state - all data stays in browser session (local to each device/browser)
+# Initialize session state
 if "saved_scenarios" not in st.session_state:
-    # Initialize empty scenarios dict - no file loading, purely browser-local
-    st.session_state.saved_scenarios = {}
+    st.session_state.saved_scenarios = almacen.EscenariosSesion()
 if "current_scenario_name" not in st.session_state:
     st.session_state.current_scenario_name = ""
 if "show_results" not in st.session_state:
     st.session_state.show_results = False
 if "inputs" not in st.session_state:
     st.session_state.inputs = {}
+if "id_sesion" not in st.session_state:
+    st.session_state.id_sesion = uuid.uuid4().hex
+
+# Metrics exporter (only if CALCULADORA_METRICAS_PUERTO / _FICHERO are set)
+metricas.iniciar_exportador()
+metricas.registrar_sesion(
+    st.session_state.id_sesion, len(st.session_state.saved_scenarios),
+    st.session_state.saved_scenarios.bytes_residentes()
+)
 
 # Data persistence functions
 def save_scenario(name, data):
@@ -469,20 +98,22 @@ def delete_scenario(name):
         del st.session_state.saved_scenarios[name]
         st.success(f"🗑️ Escenario '{name}' eliminado de este navegador")
 
-def export_scenarios_json():
+def export_scenarios_json(escenarios):
     """Export all scenarios as JSON."""
-    return json.dumps(st.session_state.saved_scenarios, indent=2, ensure_ascii=False)
-
-def format_number(val):
-    # Formatea siempre con separador de miles y sin decimales
-    return f"{val:,.0f} €".replace(",", ".")  # Si quieres punto como separador de miles
+    return json.dumps(escenarios.to_dict(), indent=2, ensure_ascii=False)
 
 def scroll_to_section(section_id):
-    """Add JavaScript to scroll to a specific section"""
-    st.components.v1.html(f"""
+    """Request a scroll to a section; emitted once at the end of this rerun, not on every rerun"""
+    st.session_state.scroll_pendiente = section_id
+
+def emit_pending_scroll():
+    """Emit the JavaScript for a pending scroll request, if any (one iframe per request)"""
+    section_id = st.session_state.pop("scroll_pendiente", None)
+    if section_id:
+        components.html(f"""
 <script>
     setTimeout(function() {{
-        const element = document.getElementById('{section_id}');
+        const element = window.parent.document.getElementById('{section_id}');
         if (element) {{
             element.scrollIntoView({{ behavior: 'smooth', block: 'start' }});
         }}
@@ -495,6 +126,60 @@ def show_results():
     st.session_state.show_results = True
     st.rerun()
 
+def mostrar_resultado_informes(trabajo):
+    """Outcome of a finished background report job"""
+    if trabajo.error:
+        st.error(f"❌ Error al generar los informes: {trabajo.error}")
+    else:
+        st.success(f"✅ {len(trabajo.rutas)} informes guardados en `{os.path.abspath(trabajo.carpeta)}`")
+        for nombre, error in trabajo.errores.items():
+            st.warning(f"⚠️ {nombre}: {error}")
+
+@st.fragment(run_every=1.0)
+def mostrar_progreso_informes():
+    """Poll the background report job without rerunning the whole script; mounted only while it runs"""
+    trabajo = st.session_state.trabajo_informes
+    if trabajo.terminado:
+        # Un rerun completo desmonta el fragmento y deja de sondear
+        st.rerun()
+    texto = f"Generando informes... {trabajo.hechos}/{trabajo.total}"
+    st.progress(trabajo.hechos / trabajo.total if trabajo.total else 0.0, text=texto)
+
+METRICAS_SENSIBILIDAD = {
+    "beneficio_DI": ("Flujo neto año 1", "{:,.0f} €"),
+    "beneficio_total": ("Beneficio en el plazo", "{:,.0f} €"),
+    "rentabilidad_neta_real": ("Rentabilidad neta", "{:.2f}%"),
+    "cuota_mensual": ("Cuota mensual", "{:,.0f} €"),
+    "tir": (f"TIR vendiendo en el año {sensibilidad.ANOS_VENTA}", "{:.1f}%"),
+}
+
+@st.fragment
+def panel_que_pasaria(respuesta):
+    """What-if sliders answered from the precomputed grid: moving one reruns only this panel"""
+    valores = {}
+    columnas = st.columns(2)
+    for i, (palanca, eje) in enumerate(zip(sensibilidad.PALANCAS, respuesta.ejes)):
+        with columnas[i % 2]:
+            valores[palanca.campo] = st.slider(
+                palanca.etiqueta, min_value=float(eje[0]), max_value=float(eje[-1]),
+                value=respuesta.base[palanca.campo], step=palanca.paso
+            )
+    with instrumentacion.medir("consulta_sensibilidad"):
+        actual = respuesta.consultar(**valores)
+        base = respuesta.consultar()
+    for columna, (metrica, (etiqueta, formato)) in zip(st.columns(len(METRICAS_SENSIBILIDAD)), METRICAS_SENSIBILIDAD.items()):
+        with columna:
+            if math.isnan(actual[metrica]):
+                st.metric(etiqueta, "—")
+                continue
+            diferencia = actual[metrica] - base[metrica]
+            st.metric(
+                etiqueta, formato.format(actual[metrica]),
+                delta=(formato.format(diferencia) if diferencia < 0 else "+" + formato.format(diferencia))
+                if not math.isnan(diferencia) and abs(diferencia) > 1e-9 else None,
+                delta_color="inverse" if metrica == "cuota_mensual" else "normal"
+            )
+
 def reset_for_new_scenario():
     """Reset form values and scenario name for a new analysis"""
     # Clear the current scenario name
@@ -525,6 +210,7 @@ Esta herramienta te ayuda a analizar la rentabilidad y el cashflow de invertir e
 """)
 
 # Input section
+tramo_formulario = instrumentacion.iniciar_tramo("formulario")
 st.markdown('<div id="input-section"></div>', unsafe_allow_html=True)
 st.markdown("---")
 st.markdown("<div class='step-header'>Introduce los datos de tu inversión</div>", unsafe_allow_html=True)
@@ -553,10 +239,11 @@ st.markdown("</div>", unsafe_allow_html=True)
 if st.session_state.saved_scenarios:
     with st.expander("📁 Escenarios guardados", expanded=False):
         st.markdown("**Escenarios disponibles (guardados localmente en este navegador):**")
-        for name, scenario in st.session_state.saved_scenarios.items():
+        # Solo nombres y fechas: listar no carga los escenarios desalojados a disco
+        for name, timestamp in st.session_state.saved_scenarios.metadatos().items():
             col1, col2, col3 = st.columns([3, 1, 1])
             with col1:
-                st.text(f"{name} ({scenario['timestamp']})")
+                st.text(f"{name} ({timestamp})")
             with col2:
                 if st.button("📂", key=f"load_{name}", help="Cargar escenario"):
                     loaded_data = load_scenario(name)
@@ -572,7 +259,8 @@ if st.session_state.saved_scenarios:
         
         st.download_button(
             "📥 Exportar todos los escenarios (JSON)",
-            data=export_scenarios_json(),
+            # Se genera al pulsar, no en cada rerun
+            data=partial(export_scenarios_json, st.session_state.saved_scenarios),
             file_name=f"escenarios_inmuebles_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
             mime="application/json",
             help="Exporta tus escenarios guardados localmente para respaldarlos o transferirlos"
@@ -588,11 +276,15 @@ default_values = {
     'comision_agencia': 0,
     'alquiler_mes': 1100,
     'aplica_reduccion_60': True,
+    'reduccion_pct': 60.0,
     'entrada': 40000,
     'tin': 2.8,
     'hipoteca_anos': 25,
     'irpf_marginal': 25.0,
+    'otros_ingresos': None,
     'valor_construccion_pct': 30,
+    'comunidad_autonoma': None,
+    'obra_nueva': False,
     'seguro_impago': 230,
     'impuesto_basuras': 100,
     'seguro_hogar': 200,
@@ -631,14 +323,191 @@ with col2:
         help="Alquiler mensual estimado tras la reforma."
     )
 
-default_alquiler_tipo = loaded_data.get('aplica_reduccion_60', default_values['aplica_reduccion_60'])
+# Contraste de la renta con anuncios comparables (solo si hay dataset local); el índice
+# se carga la primera vez que se indica una ubicación
+if os.path.exists(comparables.RUTA_COMPARABLES):
+    with st.expander("📍 Contrastar la renta con comparables de la zona", expanded=False):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            metros = st.number_input("Superficie (m²)", min_value=15, max_value=500, value=70, key="comparables_m2")
+        with col2:
+            codigo_postal = st.text_input("Código postal", key="comparables_cp")
+        with col3:
+            coordenadas = st.text_input(
+                "Coordenadas (opcional)", key="comparables_coordenadas",
+                help="Latitud y longitud separadas por coma, p. ej. 40.4168, -3.7038. Más precisas que el código postal."
+            )
+        try:
+            latitud, longitud = (float(v) for v in coordenadas.split(","))
+        except ValueError:
+            latitud = longitud = None
+
+        con_ubicacion = bool(codigo_postal) or latitud is not None
+        estimacion = None
+        if con_ubicacion:
+            with instrumentacion.medir("comparables"):
+                indice_comparables = comparables.indice_por_defecto()
+                if indice_comparables is not None:
+                    estimacion = indice_comparables.estimar(metros, latitud, longitud, codigo_postal or None)
+        if not con_ubicacion:
+            st.caption("Indica un código postal o unas coordenadas para estimar la renta.")
+        elif estimacion is None:
+            st.caption("No hay suficientes comparables para esa ubicación.")
+        else:
+            st.info(
+                f"🏘️ Renta estimada: **{estimacion['estimado']:,.0f} €/mes** "
+                f"(banda {estimacion['bajo']:,.0f} – {estimacion['alto']:,.0f} €, {estimacion['n']} comparables)"
+            )
+            if not estimacion['bajo'] <= alquiler_mes <= estimacion['alto']:
+                st.warning("⚠️ La renta introducida está fuera de la banda habitual de los comparables")
+
+TIPOS_ALQUILER = [
+    "Vivienda entera de residencia habitual", "Habitaciones o no residencia habitual", "Temporada o vacacional"
+]
+if loaded_data.get('temporada'):
+    default_alquiler_tipo = 2
+else:
+    default_alquiler_tipo = 0 if loaded_data.get('aplica_reduccion_60', default_values['aplica_reduccion_60']) else 1
 alquiler_tipo = st.radio(
-    "¿El alquiler será de la vivienda entera o solo habitaciones?",
-    ["Vivienda entera de residencia habitual", "Habitaciones o no residencia habitual"],
-    index=0 if default_alquiler_tipo else 1,
-    help="Si alquilas solo habitaciones, la reducción del 60% en el IRPF no es aplicable por ley."
+    "¿Qué tipo de alquiler será?",
+    TIPOS_ALQUILER,
+    index=default_alquiler_tipo,
+    help="Si alquilas solo habitaciones o por temporada, la reducción del 60% en el IRPF no es aplicable por ley."
 )
-aplica_reduccion_60 = alquiler_tipo == "Vivienda entera de residencia habitual"
+aplica_reduccion_60 = alquiler_tipo == TIPOS_ALQUILER[0]
+
+if aplica_reduccion_60:
+    tramos_reduccion = fiscalidad.reducciones_disponibles()
+    default_reduccion_pct = loaded_data.get('reduccion_pct', default_values['reduccion_pct'])
+    tramo_reduccion = st.selectbox(
+        "Reducción IRPF por alquiler de vivienda",
+        tramos_reduccion,
+        index=next((i for i, (_, pct, _) in enumerate(tramos_reduccion) if pct == default_reduccion_pct), 0),
+        format_func=lambda tramo: tramo[2],
+        help="Según la Ley de Vivienda, la reducción del rendimiento neto positivo va del 50% al 90% según el contrato y la zona."
+    )
+    reduccion_pct = tramo_reduccion[1]
+else:
+    reduccion_pct = 0.0
+
+# Modelos por habitaciones y por temporada: la renta, el vacío y sus gastos de explotación
+# (campos_renta) sustituyen a la renta mensual y el % de vacío del formulario
+habitaciones_datos = None
+temporada_datos = None
+campos_renta = None
+if alquiler_tipo == TIPOS_ALQUILER[1] and st.checkbox(
+    "🛏️ Modelo por habitaciones",
+    value=bool(loaded_data.get('habitaciones')),
+    help="Renta, estancia media, vacío entre inquilinos y gastos de cada habitación. "
+         "La ocupación se simula mes a mes."
+):
+    habitaciones_editadas = st.data_editor(
+        loaded_data.get('habitaciones') or [
+            habitaciones.Habitacion(f"Habitación {i}").to_dict() for i in range(1, 4)
+        ],
+        num_rows="dynamic",
+        use_container_width=True,
+        column_config={
+            "nombre": st.column_config.TextColumn("Habitación"),
+            "renta": st.column_config.NumberColumn("Renta (€/mes)", min_value=0, step=10),
+            "estancia_media": st.column_config.NumberColumn(
+                "Estancia media (meses)", min_value=1, step=1,
+                help="Meses que se queda de media cada inquilino."
+            ),
+            "vacio_medio": st.column_config.NumberColumn(
+                "Vacío entre inquilinos (meses)", min_value=0.0, step=0.25,
+                help="Tiempo medio hasta encontrar al siguiente inquilino."
+            ),
+            "gastos": st.column_config.NumberColumn(
+                "Gastos (€/año)", min_value=0, step=10,
+                help="Suministros, limpieza y mobiliario de la habitación."
+            ),
+            "coste_rotacion": st.column_config.NumberColumn(
+                "Coste por cambio de inquilino (€)", min_value=0, step=10,
+                help="Anuncio, limpieza y comisión cada vez que entra un inquilino nuevo."
+            ),
+        },
+    )
+    # Las filas añadidas en el editor llegan sin valores: se completan con los de por defecto
+    habitaciones_datos = [
+        {campo: valor for campo, valor in fila.items() if valor is not None}
+        for fila in habitaciones_editadas if fila.get("renta") is not None
+    ]
+    try:
+        with instrumentacion.medir("habitaciones"):
+            resumen_habitaciones = habitaciones.resumen_habitaciones(habitaciones_datos)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        habitaciones_datos = None
+    else:
+        campos_renta = {
+            campo: resumen_habitaciones[campo] for campo in ("alquiler_mes", "vacio", "gastos_habitaciones")
+        }
+        alquiler_mes = campos_renta["alquiler_mes"]
+        st.info(
+            f"🛏️ Con todas alquiladas: **{alquiler_mes:,.0f} €/mes** · vacío esperado "
+            f"**{campos_renta['vacio']:.1f}%** · gastos de las habitaciones "
+            f"**{campos_renta['gastos_habitaciones']:,.0f} €/año** · "
+            f"{sum(resumen_habitaciones['rotaciones_anuales']):.1f} cambios de inquilino al año"
+        )
+        st.caption("La renta mensual y el % de vacío del formulario se sustituyen por los de las habitaciones.")
+
+# Temporada: curvas de ocupación y tarifa por mes, con limpieza y comisión de la plataforma
+if alquiler_tipo == TIPOS_ALQUILER[2]:
+    temporada_inicial = temporada.Temporada.from_dict(loaded_data.get('temporada') or {})
+    curvas = st.data_editor(
+        [
+            {"mes": mes, "ocupacion": ocupacion, "tarifa": tarifa}
+            for mes, ocupacion, tarifa in zip(temporada.MESES, temporada_inicial.ocupacion, temporada_inicial.tarifa)
+        ],
+        num_rows="fixed",
+        use_container_width=True,
+        disabled=["mes"],
+        column_config={
+            "mes": st.column_config.TextColumn("Mes"),
+            "ocupacion": st.column_config.NumberColumn(
+                "Ocupación (%)", min_value=0, max_value=100, step=5,
+                help="Porcentaje de noches reservadas. 0% = cerrado fuera de temporada."
+            ),
+            "tarifa": st.column_config.NumberColumn("Tarifa (€/noche)", min_value=0, step=5),
+        },
+    )
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        estancia_noches = st.number_input(
+            "Estancia media (noches)", min_value=1.0, max_value=365.0,
+            value=float(temporada_inicial.estancia_media), step=1.0,
+            help="Noches por reserva: fija cuántas limpiezas hay. Para media estancia, 30 o más."
+        )
+    with col2:
+        limpieza_reserva = st.number_input(
+            "Limpieza por reserva (€)", min_value=0.0, max_value=1000.0,
+            value=float(temporada_inicial.limpieza), step=5.0
+        )
+    with col3:
+        comision_pct = st.number_input(
+            "Comisión plataforma (%)", min_value=0.0, max_value=100.0,
+            value=float(temporada_inicial.comision_pct), step=0.5,
+            help="Porcentaje de los ingresos que se queda la plataforma de reservas."
+        )
+    try:
+        temporada_actual = temporada.Temporada(
+            ocupacion=[fila["ocupacion"] or 0 for fila in curvas], tarifa=[fila["tarifa"] or 0 for fila in curvas],
+            estancia_media=estancia_noches, limpieza=limpieza_reserva, comision_pct=comision_pct,
+        )
+    except ValueError as e:
+        st.error(f"❌ {e}")
+    else:
+        temporada_datos = temporada_actual.to_dict()
+        campos_renta = temporada_actual.campos_escenario()
+        alquiler_mes = campos_renta["alquiler_mes"]
+        ingresos_temporada = 12 * alquiler_mes * (1 - campos_renta["vacio"] / 100)
+        st.info(
+            f"🏖️ Ingresos brutos **{ingresos_temporada:,.0f} €/año** · vacío estacional "
+            f"**{campos_renta['vacio']:.1f}%** · limpieza **{campos_renta['gastos_limpieza']:,.0f} €/año** · "
+            f"comisión **{campos_renta['comision_plataforma']:,.0f} €/año**"
+        )
+        st.caption("La renta mensual y el % de vacío del formulario se sustituyen por los de la temporada.")
 st.markdown("</div>", unsafe_allow_html=True)
 
 # BLOQUE 2: DATOS HIPOTECA
@@ -662,67 +531,72 @@ with col2:
         value=loaded_data.get('hipoteca_anos', default_values['hipoteca_anos']), step=1,
         help="Duración del préstamo hipotecario en años (lo habitual son entre 20 y 30)."
     )
-    
-    # Validation section
-    errors, warnings = validate_inputs(precio_compra, alquiler_mes, entrada, tin, hipoteca_anos)
-    
-    if errors:
-        for error in errors:
-            st.error(error)
-    if warnings:
-        for warning in warnings:
-            st.warning(warning)
     if precio_compra > 0 and tin > 0 and hipoteca_anos > 0 and entrada < precio_compra:
-        capital_prestamo = precio_compra - entrada
-        tipo_interes_mensual = tin / 100 / 12
-        total_cuotas = hipoteca_anos * 12
-        try:
-            cuota_mensual = (
-                capital_prestamo * tipo_interes_mensual /
-                (1 - (1 + tipo_interes_mensual) ** (-total_cuotas))
-            )
-        except ZeroDivisionError:
-            cuota_mensual = 0
+        cuota_mensual = safe_calculate_mortgage(precio_compra - entrada, tin, hipoteca_anos)
     else:
         cuota_mensual = 0
 
-    st.markdown(f"""
-<div style='border-radius:10px; background:#f1f8ff; border:1.5px solid #dde4ee; padding:0.7em 1.1em; margin:0.6em 0 1.2em 0; color:#1762a6; font-size:1.07em;'>
-<b>Cuota mensual:</b> <span style='font-weight:900;font-size:1.16em;'>{cuota_mensual:,.0f} €</span>
-</div>
-""", unsafe_allow_html=True)
+    st.markdown(plantillas.CUOTA_MENSUAL.substitute(cuota=f"{cuota_mensual:,.0f} €"), unsafe_allow_html=True)
 st.markdown("</div>", unsafe_allow_html=True)
 
 # BLOQUE 3: IMPUESTOS Y GASTOS COMPRA
 st.markdown("<div class='block-box'>", unsafe_allow_html=True)
 st.markdown("<span class='block-title'>3. Impuestos y gastos de compra</span>", unsafe_allow_html=True)
+opciones_comunidad = [None] + list(impuestos_compra.COMUNIDADES_AUTONOMAS)
+default_comunidad_autonoma = loaded_data.get('comunidad_autonoma', default_values['comunidad_autonoma'])
 col1, col2 = st.columns(2)
 with col1:
-    # Calculate default percentage for gastos_compra
-    if 'gastos_compra' in loaded_data and loaded_data['gastos_compra'] > 0:
-        default_gastos_pct = loaded_data['gastos_compra'] / precio_compra * 100
-    else:
-        default_gastos_pct = 2.0
-        
-    gastos_compra_pct = st.number_input(
-        "Gastos notario, registro, tasación, gestoría (% sobre compra)", min_value=0.5, max_value=4.0, 
-        value=default_gastos_pct, step=0.1,
-        help="Normalmente entre 1% y 2% del precio de compra total."
+    comunidad_autonoma = st.selectbox(
+        "Comunidad autónoma",
+        opciones_comunidad,
+        index=opciones_comunidad.index(default_comunidad_autonoma) if default_comunidad_autonoma in opciones_comunidad else 0,
+        format_func=lambda codigo: "Manual (introducir %)" if codigo is None else impuestos_compra.COMUNIDADES_AUTONOMAS[codigo],
+        help="Si eliges la comunidad, el ITP (o IVA + AJD) y los gastos de notaría y registro se calculan automáticamente."
     )
-    gastos_compra = precio_compra * gastos_compra_pct / 100
 with col2:
-    # Calculate default percentage for ITP/IVA
-    if 'itp_iva' in loaded_data and loaded_data['itp_iva'] > 0:
-        default_itp_pct = loaded_data['itp_iva'] / precio_compra * 100
-    else:
-        default_itp_pct = 8.0
-        
-    itp_iva_pct = st.number_input(
-        "ITP o IVA (% sobre compra)", min_value=4.0, max_value=15.0, 
-        value=default_itp_pct, step=0.1,
-        help="Porcentaje de impuesto aplicable (ITP en segunda mano o IVA en obra nueva)."
+    obra_nueva = st.checkbox(
+        "Obra nueva (IVA + AJD)",
+        value=loaded_data.get('obra_nueva', default_values['obra_nueva']),
+        disabled=comunidad_autonoma is None,
+        help="La obra nueva paga IVA y AJD en lugar de ITP."
     )
-    itp_iva = precio_compra * itp_iva_pct / 100
+
+if comunidad_autonoma is not None:
+    itp_iva = float(impuestos_compra.impuestos_compra(precio_compra, comunidad_autonoma, obra_nueva)[0])
+    gastos_compra = float(impuestos_compra.gastos_notaria_registro(precio_compra)[0])
+    st.info(
+        f"{'IVA + AJD' if obra_nueva else 'ITP'}: {format_number(itp_iva)} ({itp_iva / precio_compra * 100:.2f} %) · "
+        f"Notaría, registro, tasación y gestoría: {format_number(gastos_compra)}"
+    )
+else:
+    obra_nueva = False
+    col1, col2 = st.columns(2)
+    with col1:
+        # Calculate default percentage for gastos_compra
+        if 'gastos_compra' in loaded_data and loaded_data['gastos_compra'] > 0:
+            default_gastos_pct = loaded_data['gastos_compra'] / precio_compra * 100
+        else:
+            default_gastos_pct = 2.0
+
+        gastos_compra_pct = st.number_input(
+            "Gastos notario, registro, tasación, gestoría (% sobre compra)", min_value=0.5, max_value=4.0, 
+            value=default_gastos_pct, step=0.1,
+            help="Normalmente entre 1% y 2% del precio de compra total."
+        )
+        gastos_compra = precio_compra * gastos_compra_pct / 100
+    with col2:
+        # Calculate default percentage for ITP/IVA
+        if 'itp_iva' in loaded_data and loaded_data['itp_iva'] > 0:
+            default_itp_pct = loaded_data['itp_iva'] / precio_compra * 100
+        else:
+            default_itp_pct = 8.0
+
+        itp_iva_pct = st.number_input(
+            "ITP o IVA (% sobre compra)", min_value=4.0, max_value=15.0, 
+            value=default_itp_pct, step=0.1,
+            help="Porcentaje de impuesto aplicable (ITP en segunda mano o IVA en obra nueva)."
+        )
+        itp_iva = precio_compra * itp_iva_pct / 100
 st.markdown("</div>", unsafe_allow_html=True)
 
 # BLOQUE 4: DATOS FISCALES
@@ -730,11 +604,26 @@ st.markdown("<div class='block-box'>", unsafe_allow_html=True)
 st.markdown("<span class='block-title'>4. Datos fiscales</span>", unsafe_allow_html=True)
 col1, col2 = st.columns(2)
 with col1:
+    default_otros_ingresos = loaded_data.get('otros_ingresos', default_values['otros_ingresos'])
+    modo_irpf = st.radio(
+        "Cálculo del IRPF",
+        ["Tipo marginal", "Tramos progresivos"],
+        index=0 if default_otros_ingresos is None else 1,
+        help="Con tramos progresivos, el IRPF se calcula sumando el rendimiento del alquiler a tus otros ingresos."
+    )
     irpf_marginal = st.number_input(
         "Tipo marginal IRPF (%)", min_value=0.0, max_value=55.0, 
         value=loaded_data.get('irpf_marginal', default_values['irpf_marginal']),
         help="Tu tipo marginal de IRPF. Consulta el tramo que te corresponde."
     )
+    if modo_irpf == "Tramos progresivos":
+        otros_ingresos = st.number_input(
+            "Otros ingresos anuales (base general, €)", min_value=0, max_value=1000000,
+            value=int(default_otros_ingresos or 30000), step=1000,
+            help="Base liquidable general sin el alquiler (salario neto de gastos deducibles, etc.)."
+        )
+    else:
+        otros_ingresos = None
 with col2:
     valor_construccion_pct = st.number_input(
         "Valor construcción (% sobre compra)", min_value=10, max_value=90, 
@@ -788,7 +677,8 @@ with col2:
     )
     vacio = st.number_input(
         "Periodos vacíos (%)", min_value=0.0, max_value=100.0, 
-        value=loaded_data.get('vacio', default_values['vacio']), step=0.5,
+        value=campos_renta["vacio"] if campos_renta else loaded_data.get('vacio', default_values['vacio']),
+        step=0.5, disabled=campos_renta is not None,
         help="Porcentaje estimado de meses que el piso estará vacío al año (por rotación de inquilino, reformas, etc)."
     )
 st.markdown("</div>", unsafe_allow_html=True)
@@ -796,6 +686,50 @@ st.markdown("</div>", unsafe_allow_html=True)
 # Clear loaded data after use
 if hasattr(st.session_state, 'loaded_data'):
     del st.session_state.loaded_data
+instrumentacion.cerrar_tramo(tramo_formulario)
+
+# Inputs as they will be stored and calculated (derived rent fields included)
+current_inputs = {
+    "aplica_reduccion_60": aplica_reduccion_60,
+    "reduccion_pct": reduccion_pct,
+    "precio_compra": precio_compra,
+    "reformas": reformas,
+    "comision_agencia": comision_agencia,
+    "alquiler_mes": alquiler_mes,
+    "entrada": entrada,
+    "tin": tin,
+    "hipoteca_anos": hipoteca_anos,
+    "comunidad_autonoma": comunidad_autonoma,
+    "obra_nueva": obra_nueva,
+    "gastos_compra": gastos_compra,
+    "itp_iva": itp_iva,
+    "irpf_marginal": irpf_marginal,
+    "otros_ingresos": otros_ingresos,
+    "valor_construccion_pct": valor_construccion_pct,
+    "seguro_impago": seguro_impago,
+    "impuesto_basuras": impuesto_basuras,
+    "seguro_hogar": seguro_hogar,
+    "seguro_vida": seguro_vida,
+    "comunidad": comunidad,
+    "ibi": ibi,
+    "mantenimiento": mantenimiento,
+    "vacio": vacio,
+    "gastos_habitaciones": 0,
+    "gastos_limpieza": 0,
+    "comision_plataforma": 0
+}
+current_inputs.update(campos_renta or {})
+if habitaciones_datos:
+    current_inputs["habitaciones"] = habitaciones_datos
+if temporada_datos:
+    current_inputs["temporada"] = temporada_datos
+
+# Validation section: every rule of validacion.REGLAS over all the inputs
+errors, warnings = validate_inputs(**current_inputs)
+for error in errors:
+    st.error(error)
+for warning in warnings:
+    st.warning(warning)
 
 # Single button that requires scenario name
 if st.button("📊 Calcular resultados ➡️", type="primary"):
@@ -804,50 +738,24 @@ if st.button("📊 Calcular resultados ➡️", type="primary"):
         st.error("❌ Debes introducir un nombre para el escenario antes de continuar")
         st.stop()
     
-    # Final validation before calculation
-    errors, _ = validate_inputs(precio_compra, alquiler_mes, entrada, tin, hipoteca_anos)
-    
     if errors:
         st.error("❌ Por favor, corrige los errores antes de continuar:")
         for error in errors:
             st.error(error)
     else:
-        # Prepare data for storage
-        current_inputs = {
-            "aplica_reduccion_60": aplica_reduccion_60,
-            "precio_compra": precio_compra,
-            "reformas": reformas,
-            "comision_agencia": comision_agencia,
-            "alquiler_mes": alquiler_mes,
-            "entrada": entrada,
-            "tin": tin,
-            "hipoteca_anos": hipoteca_anos,
-            "gastos_compra": gastos_compra,
-            "itp_iva": itp_iva,
-            "irpf_marginal": irpf_marginal,
-            "valor_construccion_pct": valor_construccion_pct,
-            "seguro_impago": seguro_impago,
-            "impuesto_basuras": impuesto_basuras,
-            "seguro_hogar": seguro_hogar,
-            "seguro_vida": seguro_vida,
-            "comunidad": comunidad,
-            "ibi": ibi,
-            "mantenimiento": mantenimiento,
-            "vacio": vacio
-        }
-        
-        st.session_state.inputs = current_inputs
+        # La copia compartida: la misma que guarda save_scenario
+        st.session_state.inputs = almacen.internar(current_inputs)[1]
         
         # Always save scenario before proceeding
         save_scenario(st.session_state.current_scenario_name, current_inputs)
         
         # Show results and scroll to them
         st.session_state.show_results = True
+        scroll_to_section("results-section")
         st.rerun()
 
-# Add button to scroll back to intro
-if st.button("🏠 Volver al inicio", key="scroll_to_intro"):
-    scroll_to_section("intro-section")
+# Link to scroll back to intro (plain anchor: no rerun, no iframe)
+st.markdown(plantillas.ENLACE_SECCION.substitute(seccion="intro-section", texto="🏠 Volver al inicio"), unsafe_allow_html=True)
 
 
 # Results section (only show if results are calculated)
@@ -856,112 +764,39 @@ if st.session_state.show_results and st.session_state.inputs:
     st.markdown("---")
     st.markdown("<div class='step-header'>📊 Resultados del análisis</div>", unsafe_allow_html=True)
 
-    # Auto-scroll to results
-    scroll_to_section("results-section")
+    # Dependencias pesadas: el primer rerun con resultados de cada proceso paga su carga
+    with instrumentacion.medir("importaciones_resultados"):
+        import pandas as pd
+        import estres
+        import financiacion
+        import informes
+        from graficos import (
+            PERCENTILES_BANDA, create_profit_over_time_chart, create_mortgage_breakdown_chart,
+            create_net_worth_chart, create_expense_breakdown_chart, create_comparison_chart, create_exit_chart,
+            create_financing_chart, create_rooms_chart, create_seasonal_chart
+        )
 
     d = st.session_state.inputs
-    aplica_reduccion_60 = d['aplica_reduccion_60']
 
-    res = calcular_resultados(
-        d['precio_compra'], d['reformas'], d['comision_agencia'], d['alquiler_mes'], d['entrada'],
-        d['tin'], d['hipoteca_anos'], d['irpf_marginal'], d['valor_construccion_pct'], d['gastos_compra'], d['itp_iva'],
-        d['seguro_impago'], d['impuesto_basuras'], d['seguro_hogar'], d['seguro_vida'],
-        d['comunidad'], d['ibi'], d['mantenimiento'], d['vacio'], aplica_reduccion_60
-    )
+    res = almacen.resultados(d)
 
-    # Variables para formato y desglose
-    inv = res["inversion_inicial"]
-    income = res["ingresos_anuales"]
-    expenses_list = res["gastos_dict"]
-    expenses_total = res["gastos_anuales"]
-    amort = res["amortizacion_anual"]
-    net_before_tax = res["beneficio_AI"]
-    net_before_tax_amort = net_before_tax - amort
-
-    if aplica_reduccion_60:
-        reduc_60 = net_before_tax_amort * 0.6
-        base_sujeta = net_before_tax_amort * 0.4
-    else:
-        reduc_60 = 0
-        base_sujeta = net_before_tax_amort
-
-    tax = res["irpf"]
-    net_after_tax = res["beneficio_DI"]
-    rentabilidad_neta = res["rentabilidad_neta_real"]
-
-    # --------- BLOQUE DETALLE HTML SIN SANGRÍA ---------
-    calculo_detalle = f"""
-<div style="border-radius:13px;background:#f8fbff;border:2.2px solid #dde4ee;padding:1.35em 1.3em 1.05em 1.3em; margin-bottom:1.25em; color:#1a2635; font-size:1.07em; box-shadow:0 4px 16px #dde4ee3c;">
-<b style='color:#232323;font-size:1.11em;'>Cálculo del beneficio anual después de impuestos:</b>
-<ul style="margin:0.4em 0 0.2em 1.3em;padding:0;">
-<li>= Beneficio antes de impuestos: <b>{format_number(net_before_tax)}</b></li>
-<li>- Amortización anual deducible: <b>{format_number(amort)}</b></li>
-<li>= Base imponible fiscal: <b>{format_number(net_before_tax_amort)}</b></li>"""
-
-    if aplica_reduccion_60:
-        calculo_detalle += f"""
-<li>- Reducción del 60% vivienda habitual: <b>{format_number(net_before_tax_amort)} x 60% = {format_number(reduc_60)}</b></li>
-<li>= Base sujeta a IRPF: <b>{format_number(base_sujeta)}</b></li>
-"""
-    else:
-        calculo_detalle += f"""
-<li><span style='color:#a90000; font-weight:600;'>No se aplica reducción del 60% porque el alquiler es de habitaciones o no es vivienda habitual.</span></li>
-<li>= Base sujeta a IRPF: <b>{format_number(base_sujeta)}</b></li>
-"""
-
-    calculo_detalle += f"""
-<li>x Tipo marginal IRPF: <b>{d['irpf_marginal']:.1f} %</b></li>
-<li>= IRPF estimado: <b>{format_number(tax)}</b></li>
-<li>= Beneficio anual después de impuestos: <b>{format_number(net_after_tax)}</b></li>
-</ul>
-</div>
-"""
-
-    # --- RESULTADOS PRINCIPALES ---
-    resultado_html = f"""
-<div style="border-radius:14px;background:#f9faff;border:2px solid #dde4ee;padding:1.5em 1.5em 0.6em 1.5em;margin-bottom:1.2em;">
-<div style="font-size:1.15em;font-weight:700;color:#15539c;">
-💼 <b>Total inversión inicial:</b> <span style='float:right;font-size:1.17em;color:#205520;'>{format_number(inv)}</span>
-</div>
-</div>
-<div style="border-radius:14px;background:#e8f9f2;border:2px solid #c2e3d6;padding:1.1em 1.4em 0.7em 1.4em;margin-bottom:0.9em;">
-<div style="font-weight:600;color:#1762a6;">
-📈 <b>Ingresos anuales por alquiler:</b> <span style='float:right;font-size:1.13em;color:#1762a6;'>{format_number(income)}</span>
-</div>
-</div>
-<div style="border-radius:14px;background:#fff6ee;border:2px solid #ffe2c2;padding:1.1em 1.4em 0.8em 1.4em;margin-bottom:0.7em;">
-<div style="font-weight:650;color:#232323;font-size:1.11em;margin-bottom:0.13em;">Gastos anuales desglosados:</div>
-<ul style="margin:0.3em 0 0.2em 0.7em;padding:0; color:#b35a18;">
-{''.join([f"<li>{name}: <b>{format_number(val)}</b></li>" for name, val in expenses_list])}
-</ul>
-<div style="font-weight:650;color:#b35a18;margin-top:0.6em;">Total gastos anuales: <span style="float:right;color:#b35a18;font-size:1.07em;font-weight:800;">{format_number(expenses_total)}</span></div>
-</div>
-<div style="border-radius:12px;background:#fffef4;border:2px solid #ffeabf;padding:1.1em 1.2em 0.8em 1.2em; margin-bottom:1.1em;">
-<b style='color:#9a7700;font-size:1.09em;'>Rentabilidad anual antes de impuestos:</b>
-<span style='float:right;color:#ad860a;font-weight:700;font-size:1.14em;'>{format_number(net_before_tax)}</span>
-<div style='color:#333; font-size:0.98em; margin-top:0.18em;'>Es el beneficio anual antes de impuestos y amortización.</div>
-</div>
-"""
+    # --------- BLOQUES HTML DESDE PLANTILLAS ---------
+    with instrumentacion.medir("html_resultados"):
+        resultado_html, calculo_detalle, beneficio_neto_html = plantillas.bloques_resultados(d, res)
 
     st.markdown(resultado_html, unsafe_allow_html=True)
     st.markdown(calculo_detalle, unsafe_allow_html=True)
-
-    st.markdown(f"""
-<div style="border-radius:12px;background:#f1ffec;border:2px solid #d8f8cc;padding:1.1em 1.2em 0.8em 1.2em;">
-<b style='color:#237319;font-size:1.12em;'>Beneficio anual neto:</b>
-<span style='float:right;color:#167c2d;font-weight:900;font-size:1.20em;'>{format_number(net_after_tax)}</span>
-</div>
-<div style="margin:1.1em 0 0.7em 0; color:#2c566e; font-weight:500;">
-<b>Rentabilidad neta sobre la inversión inicial:</b> {rentabilidad_neta:.2f} %
-</div>
-""", unsafe_allow_html=True)
+    st.markdown(beneficio_neto_html, unsafe_allow_html=True)
 
     # Charts section
+    tramo_graficos = instrumentacion.iniciar_tramo("graficos")
     st.markdown("---")
     st.markdown("### 📊 Análisis Visual")
 
     # Create tabs for different charts
-    tab1, tab2, tab3, tab4 = st.tabs(["💰 Patrimonio Neto", "📈 Beneficios", "🏦 Hipoteca", "📊 Gastos"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        ["💰 Patrimonio Neto", "📈 Beneficios", "🏦 Hipoteca", "📊 Gastos", "🏁 Venta"]
+    )
 
     with tab1:
         st.markdown("**Evolución del patrimonio neto a lo largo del tiempo**")
@@ -980,18 +815,68 @@ if st.session_state.show_results and st.session_state.inputs:
             
             # Show key metrics
             total_years = d['hipoteca_anos']
-            total_profit = res['beneficio_DI'] * total_years
+            total_profit = float(np.sum(res['beneficio_DI_anual']))
             col1, col2, col3 = st.columns(3)
             with col1:
                 st.metric("Beneficio Total", f"{total_profit:,.0f} €")
             with col2:
-                st.metric("Promedio Anual", f"{res['beneficio_DI']:,.0f} €")
+                st.metric("Promedio Anual", f"{total_profit / total_years:,.0f} €")
             with col3:
                 roi_total = (total_profit / res['inversion_inicial']) * 100
                 st.metric("ROI Total", f"{roi_total:.1f}%")
         except Exception as e:
             st.error(f"Error creando gráfico de beneficios: {e}")
 
+        if d.get('temporada'):
+            st.markdown("**Estacionalidad del primer año**")
+            try:
+                flujos_temporada = temporada.flujos_mensuales(
+                    res, temporada.Temporada.from_dict(d['temporada']).mensual()
+                )
+                st.plotly_chart(create_seasonal_chart(temporada.MESES, flujos_temporada), use_container_width=True)
+                meses_negativos = [mes for mes, flujo in zip(temporada.MESES, flujos_temporada["flujo"]) if flujo < 0]
+                if meses_negativos:
+                    st.caption(f"Meses con flujo negativo: {', '.join(meses_negativos)}. Conviene una reserva de liquidez.")
+            except Exception as e:
+                st.error(f"Error calculando la estacionalidad: {e}")
+
+        if d.get('habitaciones'):
+            st.markdown("**Distribución según la ocupación de las habitaciones**")
+            try:
+                ocupacion = habitaciones.simulacion_habitaciones(d['habitaciones'], d['hipoteca_anos'])
+                flujos = habitaciones.flujos_trayectorias(d, ocupacion)
+                st.plotly_chart(create_rooms_chart(flujos), use_container_width=True)
+                bajo, medio, alto = np.percentile(flujos["flujo_acumulado"][:, -1], PERCENTILES_BANDA)
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric(f"Flujo acumulado p{PERCENTILES_BANDA[0]}", f"{bajo:,.0f} €")
+                with col2:
+                    st.metric("Flujo acumulado (mediana)", f"{medio:,.0f} €")
+                with col3:
+                    st.metric(f"Flujo acumulado p{PERCENTILES_BANDA[2]}", f"{alto:,.0f} €")
+                st.caption(
+                    f"{habitaciones.N_TRAYECTORIAS:,} simulaciones de la ocupación mes a mes, al final del "
+                    f"año {d['hipoteca_anos']} (descontada la inversión inicial)"
+                )
+
+                resumen_habitaciones = habitaciones.resumen_habitaciones(d['habitaciones'])
+                filas_habitaciones = [
+                    {
+                        "Habitación": habitacion.get("nombre", "Habitación"),
+                        "Renta": f"{habitacion['renta']:,.0f} €",
+                        "Ocupación": f"{ocupada * 100:.1f}%",
+                        "Renta efectiva": f"{efectiva:,.0f} €",
+                        "Cambios al año": f"{rotaciones:.1f}",
+                    }
+                    for habitacion, ocupada, efectiva, rotaciones in zip(
+                        d['habitaciones'], resumen_habitaciones["ocupacion"],
+                        resumen_habitaciones["renta_efectiva"], resumen_habitaciones["rotaciones_anuales"]
+                    )
+                ]
+                st.dataframe(pd.DataFrame(filas_habitaciones), use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"Error simulando la ocupación de las habitaciones: {e}")
+
     with tab3:
         st.markdown("**Desglose de pagos de hipoteca: capital vs intereses**")
         try:
@@ -1022,7 +907,60 @@ if st.session_state.show_results and st.session_state.inputs:
         except Exception as e:
             st.error(f"Error creando gráfico de gastos: {e}")
 
+    with tab5:
+        st.markdown("**¿Cuándo vender? Resultado de vender al final de cada año**")
+        st.info(
+            f"💡 Revalorización del 2% anual, {venta.GASTOS_VENTA_PCT:.0f}% de gastos de venta (agencia, "
+            "plusvalía municipal...) y ganancia patrimonial tributando en la base del ahorro"
+        )
+        try:
+            salida = Scenario.from_dict(d).exit_analysis()
+            ano_optimo = int(salida["ano_optimo"])
+            col1, col2, col3 = st.columns(3)
+            if ano_optimo:
+                with col1:
+                    st.metric("Año óptimo de venta", f"{ano_optimo}")
+                with col2:
+                    st.metric("TIR en el año óptimo", f"{salida['tir'][ano_optimo - 1] * 100:.1f}%")
+                with col3:
+                    st.metric("Beneficio total", f"{salida['beneficio_total'][ano_optimo - 1]:,.0f} €")
+            st.plotly_chart(create_exit_chart(salida), use_container_width=True)
+
+            columnas_venta = {
+                "Precio venta": "precio_venta",
+                "Gastos venta": "gastos_venta",
+                "Ganancia patrimonial": "ganancia_patrimonial",
+                "Impuesto": "impuesto_ganancia",
+                "Deuda pendiente": "deuda_pendiente",
+                "Neto venta": "neto_venta",
+                "Beneficio total": "beneficio_total",
+            }
+            filas_venta = []
+            for ano in range(1, d['hipoteca_anos'] + 1):
+                fila = {"Año": ano}
+                fila.update({
+                    columna: f"{salida[clave][ano - 1]:,.0f} €" for columna, clave in columnas_venta.items()
+                })
+                tir_ano = salida["tir"][ano - 1]
+                fila["TIR"] = f"{tir_ano * 100:.1f}%" if not np.isnan(tir_ano) else "—"
+                filas_venta.append(fila)
+            st.dataframe(pd.DataFrame(filas_venta), use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"Error calculando el análisis de venta: {e}")
+
+    instrumentacion.cerrar_tramo(tramo_graficos)
+
+    # Rejilla de sensibilidad: se calcula una vez por escenario (compartida entre sesiones)
+    # y cada movimiento de un deslizador es una interpolación dentro del fragmento
+    with st.expander("🎚️ ¿Y si...? Sensibilidad instantánea", expanded=False):
+        st.caption(
+            "Mueve la renta, el tipo de interés, el vacío o el precio y mira cómo cambian los resultados "
+            "respecto al escenario calculado. El resto de datos se mantiene."
+        )
+        panel_que_pasaria(almacen.respuestas(d))
+
     # Comparison tool
+    tramo_comparacion = instrumentacion.iniciar_tramo("comparacion")
     st.markdown("---")
     st.markdown("### 📊 Herramientas adicionales")
 
@@ -1069,26 +1007,18 @@ if st.session_state.show_results and st.session_state.inputs:
                     for var in all_variables["Análisis"]:
                         selected_vars[var] = st.checkbox(var, value=True if var == "ROI 5 años" else False, key=f"analysis_{var}")
                 
-                # Generate comparison data
+                # Generate comparison data (one vectorized pass over the selected scenarios)
+                comparados = ScenarioSet.from_saved({nombre: st.session_state.saved_scenarios[nombre] for nombre in selected_scenarios})
+                resultados_lote = comparados.results()
                 comparison_data = []
-                for scenario_name in selected_scenarios:
+                for i, scenario_name in enumerate(selected_scenarios):
                     scenario_data = st.session_state.saved_scenarios[scenario_name]["data"]
-                    scenario_results = calcular_resultados(
-                        scenario_data['precio_compra'], scenario_data['reformas'], 
-                        scenario_data['comision_agencia'], scenario_data['alquiler_mes'], 
-                        scenario_data['entrada'], scenario_data['tin'], scenario_data['hipoteca_anos'], 
-                        scenario_data['irpf_marginal'], scenario_data['valor_construccion_pct'], 
-                        scenario_data['gastos_compra'], scenario_data['itp_iva'],
-                        scenario_data['seguro_impago'], scenario_data['impuesto_basuras'], 
-                        scenario_data['seguro_hogar'], scenario_data['seguro_vida'],
-                        scenario_data['comunidad'], scenario_data['ibi'], scenario_data['mantenimiento'], 
-                        scenario_data['vacio'], scenario_data['aplica_reduccion_60']
-                    )
-                    
+                    scenario_results = {clave: valor[i] for clave, valor in resultados_lote.items()}
+
                     # Calculate additional metrics
                     cash_flow_mensual = scenario_data['alquiler_mes'] - scenario_results['cuota_mensual'] - (scenario_results['gastos_recurrentes'] / 12)
                     rentabilidad_bruta = (scenario_data['alquiler_mes'] * 12 / scenario_data['precio_compra']) * 100
-                    roi_5_anos = (scenario_results['beneficio_DI'] * 5 / scenario_results['inversion_inicial']) * 100
+                    roi_5_anos = (np.sum(scenario_results['beneficio_DI_anual'][:5]) / scenario_results['inversion_inicial']) * 100
                     payback_anos = scenario_results['inversion_inicial'] / scenario_results['beneficio_DI'] if scenario_results['beneficio_DI'] > 0 else float('inf')
                     ratio_deuda_valor = ((scenario_data['precio_compra'] - scenario_data['entrada']) / scenario_data['precio_compra']) * 100
                     gastos_ingreso_ratio = (scenario_results['gastos_anuales'] / scenario_results['ingresos_anuales']) * 100
@@ -1138,6 +1068,11 @@ if st.session_state.show_results and st.session_state.inputs:
                     
                     comparison_data.append(row_data)
                 
+                st.plotly_chart(
+                    create_comparison_chart(selected_scenarios, comparados.columnas["precio_compra"], resultados_lote),
+                    use_container_width=True
+                )
+
                 if comparison_data and len(comparison_data[0]) > 1:  # More than just scenario name
                     comparison_df = pd.DataFrame(comparison_data)
                     st.dataframe(comparison_df, use_container_width=True)
@@ -1178,7 +1113,131 @@ if st.session_state.show_results and st.session_state.inputs:
                     st.info("Selecciona al menos una variable para comparar")
         else:
             st.info("Guarda más escenarios para poder compararlos")
+    instrumentacion.cerrar_tramo(tramo_comparacion)
 
+    with st.expander("🌪️ Pruebas de estrés históricas", expanded=False):
+        if st.session_state.saved_scenarios:
+            st.markdown(
+                "Repite crisis pasadas sobre todos los escenarios guardados, a partir del año de compra. "
+                "La fila **Cartera** suma todos los escenarios como si se tuvieran a la vez."
+            )
+            for choque in estres.CHOQUES_HISTORICOS:
+                st.markdown(f"- **{choque.nombre}**: {choque.descripcion}")
+            # El expander se ejecuta aunque esté cerrado: la cartera solo se reconstruye si cambian los guardados
+            huella = st.session_state.saved_scenarios.huella()
+            if st.session_state.get("cartera_estres", (None, None))[0] != huella:
+                st.session_state.cartera_estres = (huella, ScenarioSet.from_saved(st.session_state.saved_scenarios))
+            cartera = st.session_state.cartera_estres[1]
+            choques_usados, simulacion = estres.simular_choques(cartera.columnas)
+            peores = estres.peor_caso(simulacion, cartera.nombres, choques_usados)
+            for clave, titulo in (
+                ("flujo", "Peor flujo de caja anual (después de impuestos)"),
+                ("patrimonio", "Peor patrimonio neto (valor del inmueble menos deuda)"),
+            ):
+                tabla = peores[clave]
+                st.markdown(f"**{titulo}**")
+                st.dataframe(
+                    tabla.apply(
+                        lambda columna: columna if columna.name == "Peor choque"
+                        else columna.map(lambda v: f"{v:,.0f} €")
+                    ),
+                    use_container_width=True
+                )
+        else:
+            st.info("Guarda algún escenario para someterlo a las pruebas de estrés")
+
+    with st.expander("🏦 Optimizar la financiación", expanded=False):
+        st.markdown(
+            "Introduce las ofertas de los bancos y el efectivo disponible. Se evalúan todas las "
+            "combinaciones de entrada, plazo y oferta y se muestra la frontera eficiente entre "
+            "rentabilidad (TIR vendiendo en el año indicado) y flujo de caja."
+        )
+        ofertas_df = st.data_editor(
+            pd.DataFrame([{
+                "nombre": "Oferta actual", "tin": float(d['tin']), "plazo_min": 5, "plazo_max": 30,
+                "ltv_max": 80.0, "seguro_vida": float(d['seguro_vida']), "otros_vinculados": 0.0,
+            }]),
+            column_config={
+                "nombre": st.column_config.TextColumn("Banco / oferta", required=True),
+                "tin": st.column_config.NumberColumn("TIN (%)", min_value=0.0, max_value=20.0, step=0.05),
+                "plazo_min": st.column_config.NumberColumn("Plazo mín. (años)", min_value=1, max_value=40, step=1),
+                "plazo_max": st.column_config.NumberColumn("Plazo máx. (años)", min_value=1, max_value=40, step=1),
+                "ltv_max": st.column_config.NumberColumn("LTV máx. (%)", min_value=0.0, max_value=100.0),
+                "seguro_vida": st.column_config.NumberColumn("Seguro vida (€/año)", min_value=0.0),
+                "otros_vinculados": st.column_config.NumberColumn("Otros vinculados (€/año)", min_value=0.0),
+            },
+            num_rows="dynamic", use_container_width=True, hide_index=True, key="ofertas_hipoteca"
+        )
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            efectivo = st.number_input(
+                "Efectivo disponible (€)", min_value=0, value=int(res['inversion_inicial']), step=5000,
+                key="efectivo_financiacion"
+            )
+        with col2:
+            anos_venta_fin = st.number_input(
+                "Año de venta", min_value=1, max_value=50, value=financiacion.ANOS_VENTA, step=1,
+                key="anos_venta_financiacion"
+            )
+        with col3:
+            exigir_flujo = st.checkbox("Exigir flujo de caja positivo todos los años", key="flujo_positivo_financiacion")
+
+        ofertas = [
+            financiacion.OfertaHipoteca(
+                nombre=str(fila["nombre"]), tin=float(fila["tin"]),
+                plazo_min=int(fila["plazo_min"]), plazo_max=int(fila["plazo_max"]), ltv_max=float(fila["ltv_max"]),
+                seguro_vida=None if pd.isna(fila["seguro_vida"]) else float(fila["seguro_vida"]),
+                otros_vinculados=0.0 if pd.isna(fila["otros_vinculados"]) else float(fila["otros_vinculados"]),
+            )
+            for fila in ofertas_df.to_dict("records")
+            if not any(pd.isna(fila[campo]) for campo in ("nombre", "tin", "plazo_min", "plazo_max", "ltv_max"))
+        ]
+        if ofertas:
+            candidatos = financiacion.optimizar_financiacion(
+                d, ofertas, efectivo, anos_venta=int(anos_venta_fin), flujo_minimo=0.0 if exigir_flujo else None
+            )
+            if candidatos.empty:
+                st.warning("Ninguna combinación es viable con el efectivo y las condiciones indicadas")
+            else:
+                st.plotly_chart(create_financing_chart(candidatos), use_container_width=True)
+                frontera = candidatos[candidatos["pareto"]]
+                st.markdown(f"**Frontera eficiente** ({len(frontera)} de {len(candidatos)} opciones viables)")
+                st.dataframe(
+                    pd.DataFrame({
+                        "Oferta": frontera["oferta"],
+                        "Entrada": [f"{v:,.0f} €" for v in frontera["entrada"]],
+                        "Plazo": [f"{v} años" for v in frontera["hipoteca_anos"]],
+                        "Cuota mensual": [f"{v:,.0f} €" for v in frontera["cuota_mensual"]],
+                        "Inversión inicial": [f"{v:,.0f} €" for v in frontera["inversion_inicial"]],
+                        "Flujo medio anual": [f"{v:,.0f} €" for v in frontera["flujo_medio"]],
+                        "TIR": [f"{v * 100:.1f}%" for v in frontera["tir"]],
+                    }),
+                    use_container_width=True, hide_index=True
+                )
+        else:
+            st.info("Añade al menos una oferta completa")
+
+    with st.expander("📄 Informes para imprimir", expanded=False):
+        if st.session_state.saved_scenarios:
+            escenarios_informe = st.multiselect(
+                "Escenarios para los que generar informe:",
+                list(st.session_state.saved_scenarios.keys()),
+                default=list(st.session_state.saved_scenarios.keys()),
+                key="escenarios_informe"
+            )
+            trabajo = st.session_state.get("trabajo_informes")
+            en_curso = trabajo is not None and not trabajo.terminado
+            if st.button("📄 Generar informes", disabled=en_curso or not escenarios_informe, key="generar_informes"):
+                st.session_state.trabajo_informes = informes.lanzar_en_segundo_plano(
+                    {nombre: st.session_state.saved_scenarios[nombre] for nombre in escenarios_informe}
+                )
+            trabajo = st.session_state.get("trabajo_informes")
+            if trabajo is not None and trabajo.terminado:
+                mostrar_resultado_informes(trabajo)
+            elif trabajo is not None:
+                mostrar_progreso_informes()
+        else:
+            st.info("Guarda algún escenario para generar sus informes")
 
     st.markdown("---")
     st.info("Puedes volver arriba y ajustar cualquier dato para analizar otros escenarios.")
@@ -1192,3 +1251,19 @@ if st.session_state.show_results and st.session_state.inputs:
         if st.button("🏠 Volver al inicio", key="home"):
             reset_for_new_scenario()
             scroll_to_section("intro-section")
+
+emit_pending_scroll()
+
+# Hidden profiling panel (only with ?debug=1); low-overhead counters are always on
+if modo_debug:
+    import pandas as pd
+
+    with st.expander("🛠️ Perfil de ejecución", expanded=False):
+        st.markdown("**Tramos de este rerun**")
+        st.dataframe(pd.DataFrame(instrumentacion.tramos_rerun()), use_container_width=True)
+        st.markdown("**Contadores acumulados del proceso**")
+        st.dataframe(pd.DataFrame.from_dict(instrumentacion.contadores(), orient="index"), use_container_width=True)
+        st.markdown("**Memoria de esta sesión y del proceso**")
+        st.json({"sesion": st.session_state.saved_scenarios.memoria(), "proceso": almacen.estadisticas()})
+
+instrumentacion.finalizar_rerun(mostrar_resultados=st.session_state.show_results)
@@ -0,0 +1,275 @@
+"""Scenario calculations shared by the Streamlit app and batch callers."""
+import numpy as np
+
+import anualidades
+import fiscalidad
+import impuestos_compra
+import instrumentacion
+import metricas
+from validacion import validate_inputs  # noqa: F401  (re-exportada para la app y el servicio)
+
+# Amortización fiscal: 3% anual sobre el valor de construcción
+TIPO_AMORTIZACION_FISCAL = 0.03
+# Revalorización anual supuesta del inmueble en las proyecciones de patrimonio
+REVALORIZACION_ANUAL = 0.02
+# Gastos de la explotación por habitaciones (habitaciones.py) o por temporada
+# (temporada.py); deducibles como el resto de gastos del inmueble
+GASTOS_EXPLOTACION = ("gastos_habitaciones", "gastos_limpieza", "comision_plataforma")
+
+metricas.registrar_cache("tablas_anualidades", anualidades.tablas)
+metricas.registrar_cache("escala_irpf", fiscalidad.escala_irpf)
+metricas.registrar_cache("escala_ahorro", fiscalidad.escala_ahorro)
+metricas.registrar_cache("tabla_compra", impuestos_compra.tabla_compra)
+metricas.registrar_cache("tabla_aranceles", impuestos_compra.tabla_aranceles)
+
+def safe_calculate_mortgage(capital_prestamo, tin, hipoteca_anos):
+    """Safely calculate mortgage payment with error handling."""
+    try:
+        return capital_prestamo * anualidades.factor_anualidad_escalar(tin, hipoteca_anos)
+    except (ZeroDivisionError, OverflowError, ValueError):
+        return 0
+
+@instrumentacion.instrumentado("cuadro_amortizacion")
+def cuadro_amortizacion_anual(capital_prestamo, tin, hipoteca_anos, n_anos=None):
+    """Vectorized French amortization schedule aggregated by year.
+
+    Returns the monthly payment (scenarios,), the outstanding balance at the start of
+    each year and at the end of the last one (scenarios, years + 1), and the interest
+    and principal paid in each year (scenarios, years).
+    """
+    capital, tin, anos = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(capital_prestamo, dtype=float)),
+        np.atleast_1d(np.asarray(tin, dtype=float)),
+        np.atleast_1d(np.asarray(hipoteca_anos, dtype=float)),
+    )
+    n_anos = int(n_anos if n_anos is not None else max(anos.max(initial=0), 1))
+
+    cuota = capital * anualidades.factor_anualidad(tin, anos)
+
+    # Cuotas pagadas al final de cada año, limitadas al plazo del préstamo
+    total_cuotas = np.maximum(anos * 12, 0)
+    meses = np.minimum(12 * np.arange(n_anos + 1)[None, :], total_cuotas[:, None])
+    saldo = capital[:, None] * anualidades.factor_saldo(tin[:, None], anos[:, None], meses)
+    saldo[:, 0] = capital
+
+    capital_amortizado = saldo[:, :-1] - saldo[:, 1:]
+    pagado = cuota[:, None] * np.diff(meses, axis=1)
+    intereses = pagado - capital_amortizado
+
+    return cuota, saldo, intereses, capital_amortizado
+
+def campo_lote(escenarios, nombre, defecto, n):
+    """Column `nombre` of a batch as a float array of length n (`defecto` when absent)."""
+    valor = escenarios[nombre] if nombre in escenarios else defecto
+    return np.broadcast_to(np.asarray(valor, dtype=float), (n,))
+
+@instrumentacion.instrumentado("calcular_resultados_lote")
+def calcular_resultados_lote(escenarios, n_anos=None, anio_inicio=None):
+    """Vectorized calcular_resultados for a batch of scenarios.
+
+    `escenarios` maps each input key (as stored in saved scenarios) to an array-like
+    with one value per scenario; a DataFrame works too. Annual figures are arrays of
+    shape (scenarios,) and year-by-year figures (suffix `_anual`) have shape
+    (scenarios, years), covering the longest mortgage term unless `n_anos` is given.
+    For rows with a `comunidad_autonoma` code, missing or NaN `gastos_compra` and `itp_iva`
+    are derived from the regional tables (`obra_nueva` selects IVA + AJD over ITP); rows
+    with None keep the manual figures.
+    """
+    n = len(np.atleast_1d(np.asarray(escenarios["precio_compra"])))
+    metricas.incrementar("escenarios_calculados", n)
+    c = {
+        nombre: campo_lote(escenarios, nombre, 0.0, n)
+        for nombre in (
+            "precio_compra", "reformas", "comision_agencia", "alquiler_mes", "entrada", "tin",
+            "hipoteca_anos", "irpf_marginal", "valor_construccion_pct",
+            "seguro_impago", "impuesto_basuras", "seguro_hogar", "seguro_vida",
+            "comunidad", "ibi", "mantenimiento", "vacio", *GASTOS_EXPLOTACION,
+        )
+    }
+    aplica_reduccion = campo_lote(escenarios, "aplica_reduccion_60", True, n) > 0
+    reduccion_pct = np.where(aplica_reduccion, campo_lote(escenarios, "reduccion_pct", 60.0, n), 0.0)
+    otros_ingresos = campo_lote(escenarios, "otros_ingresos", np.nan, n)
+
+    c["gastos_compra"] = campo_lote(escenarios, "gastos_compra", np.nan, n)
+    c["itp_iva"] = campo_lote(escenarios, "itp_iva", np.nan, n)
+    if "comunidad_autonoma" in escenarios:
+        comunidad_autonoma = np.broadcast_to(np.asarray(escenarios["comunidad_autonoma"], dtype=object), (n,))
+        # Filas sin comunidad (None) conservan la introducción manual
+        con_comunidad = np.fromiter((isinstance(ca, str) for ca in comunidad_autonoma), dtype=bool, count=n)
+        if con_comunidad.any():
+            obra_nueva = campo_lote(escenarios, "obra_nueva", False, n) > 0
+            precio = c["precio_compra"][con_comunidad]
+            itp_iva = c["itp_iva"].copy()
+            itp_iva[con_comunidad] = np.where(
+                np.isnan(itp_iva[con_comunidad]),
+                impuestos_compra.impuestos_compra(precio, comunidad_autonoma[con_comunidad], obra_nueva[con_comunidad]),
+                itp_iva[con_comunidad],
+            )
+            gastos_compra = c["gastos_compra"].copy()
+            gastos_compra[con_comunidad] = np.where(
+                np.isnan(gastos_compra[con_comunidad]),
+                impuestos_compra.gastos_notaria_registro(precio),
+                gastos_compra[con_comunidad],
+            )
+            c["itp_iva"], c["gastos_compra"] = itp_iva, gastos_compra
+    c["gastos_compra"] = np.nan_to_num(c["gastos_compra"])
+    c["itp_iva"] = np.nan_to_num(c["itp_iva"])
+
+    inversion_inicial = (
+        c["entrada"] + c["reformas"] + c["comision_agencia"] + c["gastos_compra"] + c["itp_iva"]
+    )
+
+    capital_prestamo = c["precio_compra"] - c["entrada"]
+    cuota_mensual, saldo, intereses, capital_amortizado = cuadro_amortizacion_anual(
+        capital_prestamo, c["tin"], c["hipoteca_anos"], n_anos
+    )
+    cuota_hipoteca_anual = intereses + capital_amortizado
+
+    ingresos_anuales = c["alquiler_mes"] * 12
+    periodos_vacio = ingresos_anuales * c["vacio"] / 100
+    gastos_explotacion = sum(c[nombre] for nombre in GASTOS_EXPLOTACION)
+
+    gastos_recurrentes = (
+        c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["seguro_vida"]
+        + c["comunidad"] + c["ibi"] + c["mantenimiento"] + gastos_explotacion + periodos_vacio
+    )
+    gastos_anuales = gastos_recurrentes[:, None] + cuota_hipoteca_anual
+
+    valor_construccion = c["precio_compra"] * c["valor_construccion_pct"] / 100
+    amortizacion_anual = valor_construccion * TIPO_AMORTIZACION_FISCAL
+
+    # Beneficio antes de impuestos (caja): incluye la cuota completa de la hipoteca
+    beneficio_AI = ingresos_anuales[:, None] - gastos_anuales
+
+    # Fiscalmente solo son deducibles los intereses (no el capital) y los gastos del
+    # inmueble (también los de explotación); el seguro de vida no es un gasto del alquiler.
+    gastos_deducibles = (
+        c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["comunidad"] + c["ibi"]
+        + gastos_explotacion
+    )
+    fiscal = fiscalidad.irpf_anual(
+        ingresos=np.broadcast_to((ingresos_anuales - periodos_vacio)[:, None], intereses.shape),
+        gastos_deducibles=gastos_deducibles[:, None],
+        gastos_limitados=intereses + c["mantenimiento"][:, None],
+        amortizacion=amortizacion_anual[:, None],
+        reduccion_pct=reduccion_pct,
+        irpf_marginal=c["irpf_marginal"],
+        otros_ingresos=otros_ingresos,
+        anio_inicio=anio_inicio,
+    )
+
+    beneficio_DI = beneficio_AI - fiscal["irpf"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rentabilidad_neta_real = np.where(
+            inversion_inicial > 0, beneficio_DI[:, 0] / inversion_inicial * 100, 0.0
+        )
+
+    return {
+        "inversion_inicial": inversion_inicial,
+        "gastos_compra": c["gastos_compra"],
+        "itp_iva": c["itp_iva"],
+        "cuota_mensual": cuota_mensual,
+        "cuota_hipoteca_anual": cuota_hipoteca_anual[:, 0],
+        "ingresos_anuales": ingresos_anuales,
+        "periodos_vacio": periodos_vacio,
+        "gastos_recurrentes": gastos_recurrentes,
+        "gastos_anuales": gastos_anuales[:, 0],
+        "amortizacion_anual": amortizacion_anual,
+        "reduccion_pct": reduccion_pct,
+        "beneficio_AI": beneficio_AI[:, 0],
+        "beneficio_AI_amort": fiscal["rendimiento_neto"][:, 0],
+        "reduccion": fiscal["reduccion"][:, 0],
+        "base_imponible": fiscal["base_imponible"][:, 0],
+        "irpf": fiscal["irpf"][:, 0],
+        "beneficio_DI": beneficio_DI[:, 0],
+        "rentabilidad_neta_real": rentabilidad_neta_real,
+        "saldo_hipoteca": saldo,
+        "intereses_anual": intereses,
+        "capital_amortizado_anual": capital_amortizado,
+        "cuota_hipoteca_anual_anual": cuota_hipoteca_anual,
+        "beneficio_AI_anual": beneficio_AI,
+        "rendimiento_neto_anual": fiscal["rendimiento_neto"],
+        "base_imponible_anual": fiscal["base_imponible"],
+        "irpf_anual": fiscal["irpf"],
+        "beneficio_DI_anual": beneficio_DI,
+    }
+
+@instrumentacion.instrumentado("calcular_resultados")
+def calcular_resultados(
+    precio_compra, reformas, comision_agencia, alquiler_mes, entrada, tin,
+    hipoteca_anos, irpf_marginal, valor_construccion_pct, gastos_compra, itp_iva,
+    seguro_impago, impuesto_basuras, seguro_hogar, seguro_vida,
+    comunidad, ibi, mantenimiento, vacio_pct, aplica_reduccion_60,
+    reduccion_pct=60.0, otros_ingresos=None, comunidad_autonoma=None, obra_nueva=False,
+    gastos_habitaciones=0, gastos_limpieza=0, comision_plataforma=0
+):
+    """Single-scenario calcular_resultados_lote: floats and year arrays, plus gastos_dict.
+
+    `gastos_compra` and `itp_iva` may be None to derive them from `comunidad_autonoma`.
+    """
+    entradas = {
+        "precio_compra": precio_compra, "reformas": reformas, "comision_agencia": comision_agencia,
+        "alquiler_mes": alquiler_mes, "entrada": entrada, "tin": tin, "hipoteca_anos": hipoteca_anos,
+        "irpf_marginal": irpf_marginal, "valor_construccion_pct": valor_construccion_pct,
+        "gastos_compra": np.nan if gastos_compra is None else gastos_compra,
+        "itp_iva": np.nan if itp_iva is None else itp_iva, "seguro_impago": seguro_impago,
+        "impuesto_basuras": impuesto_basuras, "seguro_hogar": seguro_hogar, "seguro_vida": seguro_vida,
+        "comunidad": comunidad, "ibi": ibi, "mantenimiento": mantenimiento, "vacio": vacio_pct,
+        "aplica_reduccion_60": aplica_reduccion_60, "reduccion_pct": reduccion_pct,
+        "otros_ingresos": np.nan if otros_ingresos is None else otros_ingresos,
+        "gastos_habitaciones": gastos_habitaciones, "gastos_limpieza": gastos_limpieza,
+        "comision_plataforma": comision_plataforma,
+    }
+    if comunidad_autonoma is not None:
+        entradas["comunidad_autonoma"] = comunidad_autonoma
+        entradas["obra_nueva"] = obra_nueva
+    lote = calcular_resultados_lote(entradas)
+    res = {
+        clave: valor[0] if valor.ndim == 2 else float(valor[0])
+        for clave, valor in lote.items()
+    }
+
+    # For visual breakdown
+    res["gastos_dict"] = [
+        ("Seguro impago", seguro_impago),
+        ("Impuesto basuras", impuesto_basuras),
+        ("Seguro hogar", seguro_hogar),
+        ("Seguro vida", seguro_vida),
+        ("Comunidad", comunidad),
+        ("IBI", ibi),
+        ("Mantenimiento", mantenimiento),
+        *(
+            (etiqueta, importe) for etiqueta, importe in (
+                ("Gastos habitaciones", gastos_habitaciones),
+                ("Limpieza", gastos_limpieza),
+                ("Comisión plataforma", comision_plataforma),
+            ) if importe
+        ),
+        ("Vacío (total)", res["periodos_vacio"]),
+        ("Cuota hipoteca anual", res["cuota_hipoteca_anual"])
+    ]
+
+    return res
+
+@instrumentacion.instrumentado("proyeccion_lote")
+def proyeccion_lote(precio_compra, resultados, revalorizacion=REVALORIZACION_ANUAL):
+    """Year-by-year projection matrices (scenarios, years + 1) from calcular_resultados_lote output.
+
+    Column 0 is the purchase date. Returns the property value, the outstanding debt,
+    the net worth (value minus debt) and the cumulative after-tax cash flow, which
+    starts at minus the initial investment.
+    """
+    deuda = resultados["saldo_hipoteca"]
+    anos = np.arange(deuda.shape[1])
+    valor = np.asarray(precio_compra, dtype=float)[:, None] * (1 + revalorizacion) ** anos[None, :]
+    flujo = np.empty_like(deuda)
+    flujo[:, 0] = -resultados["inversion_inicial"]
+    np.cumsum(resultados["beneficio_DI_anual"], axis=1, out=flujo[:, 1:])
+    flujo[:, 1:] += flujo[:, :1]
+    return {
+        "valor_inmueble": valor,
+        "deuda": deuda,
+        "patrimonio_neto": valor - deuda,
+        "flujo_acumulado": flujo,
+    }
@@ -0,0 +1,177 @@
+"""Headless load test for the Streamlit app using streamlit.testing.v1.AppTest.
+
+Each simulated session fills the form, presses "Calcular resultados", goes through the
+result tabs, saves a second scenario and opens the comparison. Every rerun is timed and
+the run reports p50/p95/p99 latency per step and overall, throughput and memory per
+session. AppTest shares one runtime per process and is not thread-safe, so concurrent
+sessions run in separate worker processes, each driving its share of sessions in turn.
+Save the JSON report with --salida and pass it as --referencia on a later
+run to compare caching or fragment changes against that baseline.
+
+    python carga.py --sesiones 50 --concurrencia 8 --salida base.json
+    python carga.py --sesiones 50 --concurrencia 8 --referencia base.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculadora_inmueble.py")
+TIEMPO_MAXIMO_RERUN = 60
+
+
+def _rss_mb():
+    """Resident memory of this process in MB (Linux /proc, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        return 0.0
+
+
+def _boton(at, texto):
+    return next(b for b in at.button if texto in b.label)
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def simular_sesion(numero, tiempos):
+    """Drive one session through the full flow, appending (step, seconds) to `tiempos`."""
+    at = AppTest.from_file(RUTA_APP, default_timeout=TIEMPO_MAXIMO_RERUN)
+
+    def paso(nombre, accion):
+        inicio = time.perf_counter()
+        accion()
+        tiempos.append((nombre, time.perf_counter() - inicio))
+        if at.exception:
+            raise RuntimeError(f"Sesión {numero}, paso {nombre}: {at.exception[0].value}")
+
+    paso("carga_inicial", at.run)
+    paso("nombre_escenario", lambda: at.text_input[0].input(f"Carga {numero} A").run())
+    paso("precio", lambda: at.number_input[0].set_value(180000 + numero * 1000).run())
+    paso("calcular", lambda: _boton(at, "Calcular").click().run())
+
+    # Las pestañas se cambian en el navegador sin rerun: todas se renderizan en cada
+    # rerun, así que "recorrer las pestañas" es leer los gráficos de cada una.
+    paso("pestanas", lambda: [tab.markdown for tab in at.tabs])
+
+    paso("segundo_escenario", lambda: at.text_input[0].input(f"Carga {numero} B").run())
+    paso("alquiler", lambda: at.number_input[3].set_value(1200).run())
+    paso("guardar", lambda: _boton(at, "Calcular").click().run())
+    paso("comparar", lambda: at.multiselect[0].set_value(at.multiselect[0].options).run())
+    return at
+
+
+def _trabajador(numeros):
+    """Run a worker's sessions in turn, keeping them alive to measure retained memory."""
+    tiempos = []
+    vivas = []
+    # Calentamiento: imports y tablas de la app no cuentan como memoria por sesión. Es
+    # también el arranque en frío del trabajador (primera página de un proceso nuevo)
+    inicio = time.perf_counter()
+    AppTest.from_file(RUTA_APP, default_timeout=TIEMPO_MAXIMO_RERUN).run()
+    tiempos.append(("arranque_frio", time.perf_counter() - inicio))
+    # La sección de resultados importa sus dependencias al mostrarse por primera vez;
+    # se cargan aquí para que tampoco cuenten como memoria de la primera sesión
+    import estres, financiacion, graficos, informes, pandas  # noqa: E401, F401
+    rss_inicial = _rss_mb()
+    for numero in numeros:
+        vivas.append(simular_sesion(numero, tiempos))
+    return tiempos, _rss_mb() - rss_inicial
+
+
+def ejecutar(sesiones, concurrencia):
+    """Run `sesiones` simulated sessions spread over `concurrencia` worker processes."""
+    lotes = [list(range(i, sesiones, concurrencia)) for i in range(concurrencia)]
+    tiempos = []
+    crecimiento_rss = 0.0
+
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=concurrencia) as pool:
+        for tiempos_lote, rss_lote in pool.map(_trabajador, [lote for lote in lotes if lote]):
+            tiempos.extend(tiempos_lote)
+            crecimiento_rss += rss_lote
+    duracion = time.perf_counter() - inicio
+
+    reruns = [segundos for paso, segundos in tiempos if paso not in ("pestanas", "arranque_frio")]
+    por_paso = {}
+    for paso, segundos in tiempos:
+        por_paso.setdefault(paso, []).append(segundos)
+
+    def resumen(valores):
+        return {
+            "n": len(valores),
+            "p50_ms": _percentil(valores, 50) * 1000,
+            "p95_ms": _percentil(valores, 95) * 1000,
+            "p99_ms": _percentil(valores, 99) * 1000,
+            "media_ms": statistics.fmean(valores) * 1000 if valores else 0.0,
+        }
+
+    return {
+        "sesiones": sesiones,
+        "concurrencia": concurrencia,
+        "duracion_s": duracion,
+        "reruns_por_s": len(reruns) / duracion,
+        "sesiones_por_s": sesiones / duracion,
+        "mb_por_sesion": crecimiento_rss / sesiones,
+        "latencia_rerun": resumen(reruns),
+        "por_paso": {paso: resumen(valores) for paso, valores in por_paso.items()},
+    }
+
+
+def imprimir(informe, referencia=None):
+    def delta(actual, clave_ruta):
+        if referencia is None:
+            return ""
+        base = referencia
+        for clave in clave_ruta:
+            base = base.get(clave, {}) if isinstance(base, dict) else {}
+        if not isinstance(base, (int, float)) or not base:
+            return ""
+        return f"  ({(actual - base) / base * 100:+.1f}%)"
+
+    lat = informe["latencia_rerun"]
+    print(f"Sesiones: {informe['sesiones']}  concurrencia: {informe['concurrencia']}  duración: {informe['duracion_s']:.1f} s")
+    print(f"Throughput: {informe['reruns_por_s']:.1f} reruns/s{delta(informe['reruns_por_s'], ['reruns_por_s'])}, "
+          f"{informe['sesiones_por_s']:.2f} sesiones/s")
+    print(f"Memoria: {informe['mb_por_sesion']:.2f} MB/sesión{delta(informe['mb_por_sesion'], ['mb_por_sesion'])}")
+    for p in ("p50_ms", "p95_ms", "p99_ms"):
+        print(f"Rerun {p[:3]}: {lat[p]:.0f} ms{delta(lat[p], ['latencia_rerun', p])}")
+    print()
+    print(f"{'Paso':<20}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for paso, r in informe["por_paso"].items():
+        print(f"{paso:<20}{r['n']:>6}{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}{r['p99_ms']:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga headless de la calculadora")
+    parser.add_argument("--sesiones", type=int, default=20, help="Número de sesiones simuladas")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Sesiones simultáneas (procesos)")
+    parser.add_argument("--salida", help="Guardar el informe JSON en esta ruta")
+    parser.add_argument("--referencia", help="Informe JSON previo con el que comparar")
+    args = parser.parse_args()
+
+    informe = ejecutar(args.sesiones, args.concurrencia)
+    referencia = None
+    if args.referencia:
+        with open(args.referencia, encoding="utf-8") as f:
+            referencia = json.load(f)
+    imprimir(informe, referencia)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
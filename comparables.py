@@ -0,0 +1,215 @@
+"""Rent estimate from a local dataset of comparable listings.
+
+The dataset is a CSV (CALCULADORA_COMPARABLES, default datos/comparables.csv) with one
+listing per row: `alquiler` (€/month), `m2` and either `latitud`/`longitud`, a
+`codigo_postal`, or both. Listings with coordinates go into a uniform grid of
+CELDA_KM cells, searched ring by ring until the k nearest are certain. Listings are
+also indexed by postal code for queries without coordinates.
+
+Neighbours are ranked by distance plus a size penalty (ESCALA_KM_M2 km per unit of
+log size ratio), so a 60 m² flat next door beats a 150 m² one. The estimate is the
+weighted median of their €/m² times the target surface, and the band is the weighted
+p10-p90.
+
+pandas is only imported to read the CSV or build estimar_lote's DataFrame, so importing
+this module (the app's form does) stays cheap.
+"""
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+
+RUTA_COMPARABLES = os.environ.get(
+    "CALCULADORA_COMPARABLES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "comparables.csv"),
+)
+CELDA_KM = 1.0
+RADIO_MAX_KM = 25.0
+ESCALA_KM_M2 = 2.0
+K_VECINOS = 15
+MIN_VECINOS = 3
+PERCENTILES_BANDA = (10, 90)
+KM_POR_GRADO_LAT = 110.57
+KM_POR_GRADO_LON_ECUADOR = 111.32
+# Identificador único de celda: ix * _FILAS + iy
+_FILAS = 1 << 20
+
+
+def _percentiles_ponderados(valores, pesos, percentiles):
+    orden = np.argsort(valores)
+    valores, pesos = valores[orden], pesos[orden]
+    acumulado = np.cumsum(pesos) - pesos / 2
+    return np.interp(np.asarray(percentiles) / 100 * pesos.sum(), acumulado, valores)
+
+
+def _normalizar_cp(codigo_postal):
+    if codigo_postal is None or (isinstance(codigo_postal, float) and math.isnan(codigo_postal)):
+        return None
+    texto = str(codigo_postal).strip().split(".")[0]
+    return texto.zfill(5) if texto else None
+
+
+class IndiceComparables:
+    """Grid and postal-code index over a comparables dataset."""
+
+    __slots__ = (
+        "m2", "euros_m2", "x", "y", "lat0", "celda_ids", "orden", "con_coordenadas", "por_cp", "n"
+    )
+
+    def __init__(self, alquiler, m2, latitud=None, longitud=None, codigo_postal=None):
+        alquiler = np.asarray(alquiler, dtype=float)
+        m2 = np.asarray(m2, dtype=float)
+        validos = (alquiler > 0) & (m2 > 0)
+        self.m2 = m2[validos]
+        self.euros_m2 = alquiler[validos] / self.m2
+        self.n = len(self.m2)
+
+        latitud = np.full(self.n, np.nan) if latitud is None else np.asarray(latitud, dtype=float)[validos]
+        longitud = np.full(self.n, np.nan) if longitud is None else np.asarray(longitud, dtype=float)[validos]
+        self.con_coordenadas = np.isfinite(latitud) & np.isfinite(longitud)
+        self.lat0 = float(np.mean(latitud[self.con_coordenadas])) if self.con_coordenadas.any() else 40.0
+        self.x, self.y = self._proyectar(latitud, longitud)
+
+        # Rejilla: índices de los anuncios ordenados por celda, para buscar rangos con searchsorted
+        ids = self._celda(self.x, self.y)
+        con = np.flatnonzero(self.con_coordenadas)
+        self.orden = con[np.argsort(ids[con], kind="stable")]
+        self.celda_ids = ids[self.orden]
+
+        self.por_cp = {}
+        if codigo_postal is not None:
+            codigos = np.asarray(codigo_postal, dtype=object)[validos]
+            for i, codigo in enumerate(codigos):
+                codigo = _normalizar_cp(codigo)
+                if codigo:
+                    self.por_cp.setdefault(codigo, []).append(i)
+            self.por_cp = {codigo: np.array(indices) for codigo, indices in self.por_cp.items()}
+
+    @classmethod
+    def desde_dataframe(cls, df):
+        return cls(
+            df["alquiler"], df["m2"],
+            df["latitud"] if "latitud" in df else None,
+            df["longitud"] if "longitud" in df else None,
+            df["codigo_postal"] if "codigo_postal" in df else None,
+        )
+
+    @classmethod
+    def desde_csv(cls, ruta=RUTA_COMPARABLES):
+        import pandas as pd
+
+        return cls.desde_dataframe(pd.read_csv(ruta, dtype={"codigo_postal": str}))
+
+    def _proyectar(self, latitud, longitud):
+        escala_lon = KM_POR_GRADO_LON_ECUADOR * math.cos(math.radians(self.lat0))
+        return np.asarray(longitud, dtype=float) * escala_lon, np.asarray(latitud, dtype=float) * KM_POR_GRADO_LAT
+
+    def _celda(self, x, y):
+        ix = np.floor(np.nan_to_num(x) / CELDA_KM).astype(np.int64)
+        iy = np.floor(np.nan_to_num(y) / CELDA_KM).astype(np.int64)
+        return ix * _FILAS + iy
+
+    def _candidatos_anillo(self, x, y, radio):
+        ix, iy = math.floor(x / CELDA_KM), math.floor(y / CELDA_KM)
+        dx, dy = np.meshgrid(np.arange(-radio, radio + 1), np.arange(-radio, radio + 1))
+        ids = np.sort(((ix + dx) * _FILAS + (iy + dy)).ravel())
+        inicio = np.searchsorted(self.celda_ids, ids, side="left")
+        fin = np.searchsorted(self.celda_ids, ids, side="right")
+        con_datos = fin > inicio
+        if not con_datos.any():
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self.orden[a:b] for a, b in zip(inicio[con_datos], fin[con_datos])])
+
+    def _vecinos_geo(self, latitud, longitud, m2, k):
+        x, y = self._proyectar(latitud, longitud)
+        x, y = float(x), float(y)
+        radio = 0
+        while True:
+            candidatos = self._candidatos_anillo(x, y, radio)
+            if len(candidatos):
+                distancia = np.hypot(self.x[candidatos] - x, self.y[candidatos] - y)
+                efectiva = np.hypot(distancia, ESCALA_KM_M2 * np.log(self.m2[candidatos] / m2))
+                if len(candidatos) > k:
+                    mejores = np.argpartition(efectiva, k - 1)[:k]
+                else:
+                    mejores = np.arange(len(candidatos))
+                # Todo punto a distancia efectiva < radio * CELDA_KM está ya en la rejilla explorada
+                if len(mejores) >= k and efectiva[mejores].max() <= radio * CELDA_KM:
+                    return candidatos[mejores], efectiva[mejores]
+            if radio * CELDA_KM >= RADIO_MAX_KM:
+                if len(candidatos) == 0:
+                    return candidatos, np.empty(0)
+                return candidatos[mejores], efectiva[mejores]
+            radio += 1
+
+    def _vecinos_cp(self, codigo_postal, m2, k):
+        candidatos = self.por_cp.get(codigo_postal)
+        if candidatos is None:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        efectiva = ESCALA_KM_M2 * np.abs(np.log(self.m2[candidatos] / m2))
+        mejores = np.argsort(efectiva)[:k]
+        return candidatos[mejores], efectiva[mejores]
+
+    def estimar(self, m2, latitud=None, longitud=None, codigo_postal=None, k=K_VECINOS):
+        """Rent estimate for one property, or None if there are fewer than MIN_VECINOS comparables.
+
+        Returns a dict with `estimado`, `bajo` and `alto` (€/month), the number of
+        comparables `n` and the largest effective distance used `distancia_km`.
+        """
+        if not m2 or m2 <= 0:
+            return None
+        if latitud is not None and longitud is not None and self.con_coordenadas.any():
+            vecinos, distancia = self._vecinos_geo(latitud, longitud, m2, k)
+        else:
+            vecinos, distancia = self._vecinos_cp(_normalizar_cp(codigo_postal), m2, k)
+        if len(vecinos) < MIN_VECINOS:
+            return None
+
+        pesos = 1 / (distancia + 0.1)
+        bajo, mediana, alto = _percentiles_ponderados(
+            self.euros_m2[vecinos], pesos, (PERCENTILES_BANDA[0], 50, PERCENTILES_BANDA[1])
+        ) * m2
+        return {
+            "estimado": float(mediana),
+            "bajo": float(bajo),
+            "alto": float(alto),
+            "n": int(len(vecinos)),
+            "distancia_km": float(distancia.max()),
+        }
+
+    def estimar_lote(self, m2, latitud=None, longitud=None, codigo_postal=None, k=K_VECINOS):
+        """estimar for many properties; returns a DataFrame (NaN where no estimate)."""
+        import pandas as pd
+
+        m2 = np.atleast_1d(np.asarray(m2, dtype=float))
+        n = len(m2)
+        latitud = np.full(n, np.nan) if latitud is None else np.broadcast_to(np.asarray(latitud, dtype=float), (n,))
+        longitud = np.full(n, np.nan) if longitud is None else np.broadcast_to(np.asarray(longitud, dtype=float), (n,))
+        codigos = [None] * n if codigo_postal is None else list(np.broadcast_to(np.asarray(codigo_postal, dtype=object), (n,)))
+
+        filas = []
+        vacia = {"estimado": np.nan, "bajo": np.nan, "alto": np.nan, "n": 0, "distancia_km": np.nan}
+        for i in range(n):
+            con_coordenadas = np.isfinite(latitud[i]) and np.isfinite(longitud[i])
+            filas.append(self.estimar(
+                m2[i],
+                latitud[i] if con_coordenadas else None,
+                longitud[i] if con_coordenadas else None,
+                codigos[i], k
+            ) or vacia)
+        return pd.DataFrame(filas)
+
+
+@lru_cache(maxsize=2)
+def _cargar(ruta, modificado):
+    return IndiceComparables.desde_csv(ruta)
+
+
+def indice_por_defecto(ruta=RUTA_COMPARABLES):
+    """Index over the local dataset (rebuilt when the file changes), or None if it is missing."""
+    try:
+        modificado = os.path.getmtime(ruta)
+    except OSError:
+        return None
+    return _cargar(ruta, modificado)
@@ -0,0 +1,233 @@
+"""Typed scenario record and its columnar counterpart for large batches.
+
+Scenario is a slotted dataclass with one field per input of the form. ScenarioSet holds
+many scenarios as one NumPy array per field, so hundreds of thousands of them cost a
+few bytes per value instead of a dict per scenario, and ScenarioSet.results() hands the
+arrays to calcular_resultados_lote without copying. Both round-trip to the dict/JSON
+format of saved scenarios (saved_scenarios[name]["data"]); keys that are not Scenario
+fields are kept in `extra` and written back unchanged, so nothing saved is lost.
+"""
+import json
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+import numpy as np
+
+from calculos import calcular_resultados, calcular_resultados_lote
+from venta import analisis_venta
+
+
+@dataclass(slots=True)
+class Scenario:
+    """Inputs of one investment scenario, keyed as in saved scenarios."""
+
+    precio_compra: int = 200000
+    reformas: int = 15000
+    comision_agencia: int = 0
+    alquiler_mes: int = 1100
+    aplica_reduccion_60: bool = True
+    reduccion_pct: float = 60.0
+    entrada: int = 40000
+    tin: float = 2.8
+    hipoteca_anos: int = 25
+    irpf_marginal: float = 25.0
+    otros_ingresos: Optional[int] = None
+    valor_construccion_pct: int = 30
+    comunidad_autonoma: Optional[str] = None
+    obra_nueva: bool = False
+    gastos_compra: Optional[float] = None
+    itp_iva: Optional[float] = None
+    seguro_impago: int = 230
+    impuesto_basuras: int = 100
+    seguro_hogar: int = 200
+    seguro_vida: int = 100
+    comunidad: int = 240
+    ibi: int = 200
+    mantenimiento: int = 480
+    vacio: float = 5.0
+    # Gastos de explotación: habitaciones (habitaciones.py) y temporada (temporada.py)
+    gastos_habitaciones: int = 0
+    gastos_limpieza: float = 0.0
+    comision_plataforma: float = 0.0
+    # Datos de cada habitación (habitaciones.Habitacion.to_dict) del modelo por habitaciones
+    habitaciones: Optional[list] = None
+    # Curvas y tarifas del alquiler por temporada (temporada.Temporada.to_dict)
+    temporada: Optional[dict] = None
+    # Claves guardadas que no son campos: se conservan tal cual para la vuelta a dict
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, datos):
+        """Build from a saved-scenario dict; missing keys take the defaults, unknown ones go to `extra`."""
+        return cls(
+            **{campo: datos[campo] for campo in CAMPOS if campo in datos},
+            extra={clave: valor for clave, valor in datos.items() if clave not in _CAMPOS},
+        )
+
+    def to_dict(self):
+        return {**{campo: getattr(self, campo) for campo in CAMPOS}, **self.extra}
+
+    @classmethod
+    def from_json(cls, texto):
+        return cls.from_dict(json.loads(texto))
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def results(self):
+        """calcular_resultados for this scenario (scalars, year arrays and gastos_dict)."""
+        return calcular_resultados(
+            precio_compra=self.precio_compra, reformas=self.reformas, comision_agencia=self.comision_agencia,
+            alquiler_mes=self.alquiler_mes, entrada=self.entrada, tin=self.tin, hipoteca_anos=self.hipoteca_anos,
+            irpf_marginal=self.irpf_marginal, valor_construccion_pct=self.valor_construccion_pct,
+            gastos_compra=self.gastos_compra, itp_iva=self.itp_iva,
+            seguro_impago=self.seguro_impago, impuesto_basuras=self.impuesto_basuras,
+            seguro_hogar=self.seguro_hogar, seguro_vida=self.seguro_vida, comunidad=self.comunidad,
+            ibi=self.ibi, mantenimiento=self.mantenimiento, vacio_pct=self.vacio,
+            aplica_reduccion_60=self.aplica_reduccion_60, reduccion_pct=self.reduccion_pct,
+            otros_ingresos=self.otros_ingresos, comunidad_autonoma=self.comunidad_autonoma,
+            obra_nueva=self.obra_nueva, gastos_habitaciones=self.gastos_habitaciones,
+            gastos_limpieza=self.gastos_limpieza, comision_plataforma=self.comision_plataforma,
+        )
+
+    def exit_analysis(self, **kwargs):
+        """venta.analisis_venta for this scenario: one (years,) array per key, plus ano_optimo."""
+        salida = ScenarioSet.from_scenarios([self]).exit_analysis(**kwargs)
+        return {clave: valor[0] for clave, valor in salida.items()}
+
+
+CAMPOS = tuple(campo.name for campo in fields(Scenario) if campo.name != "extra")
+_CAMPOS = frozenset(CAMPOS) | {"extra"}
+CAMPOS_BOOL = ("aplica_reduccion_60", "obra_nueva")
+CAMPOS_TEXTO = ("comunidad_autonoma",)
+# Datos anidados (listas, dicts): columna de objetos, un valor por escenario
+CAMPOS_ESTRUCTURADOS = ("habitaciones", "temporada")
+# Los number_input enteros del formulario no aceptan floats: se devuelven como int
+CAMPOS_ENTEROS = tuple(campo.name for campo in fields(Scenario) if campo.type in (int, Optional[int]))
+# Opcionales numéricos: None se guarda como NaN en la columna
+CAMPOS_OPCIONALES = ("otros_ingresos", "gastos_compra", "itp_iva")
+_DEFECTOS = Scenario()
+
+
+def _tipo(campo):
+    if campo in CAMPOS_BOOL:
+        return bool
+    if campo in CAMPOS_TEXTO or campo in CAMPOS_ESTRUCTURADOS:
+        return object
+    return float
+
+
+class ScenarioSet:
+    """Columnar set of scenarios: one NumPy array per Scenario field, plus optional names.
+
+    `extras` is one Scenario.extra dict per row, or None when no row has any.
+    """
+
+    __slots__ = ("columnas", "nombres", "extras")
+
+    def __init__(self, columnas, nombres=None, extras=None):
+        n = len(next(iter(columnas.values()))) if columnas else 0
+        self.columnas = {
+            campo: _columna(campo, columnas[campo]) if campo in columnas
+            else np.full(n, _columna_defecto(campo), dtype=_tipo(campo))
+            for campo in CAMPOS
+        }
+        if any(len(columna) != n for columna in self.columnas.values()):
+            raise ValueError("Todas las columnas de un ScenarioSet deben tener la misma longitud")
+        self.nombres = list(nombres) if nombres is not None else None
+        self.extras = list(extras) if extras is not None and any(extras) else None
+        if self.extras is not None and len(self.extras) != n:
+            raise ValueError("Hace falta un extra por escenario")
+
+    @classmethod
+    def from_scenarios(cls, escenarios, nombres=None):
+        escenarios = list(escenarios)
+        return cls(
+            {campo: [_a_columna(campo, getattr(e, campo)) for e in escenarios] for campo in CAMPOS},
+            nombres,
+            [e.extra for e in escenarios],
+        )
+
+    @classmethod
+    def from_dicts(cls, datos, nombres=None):
+        datos = list(datos)
+        return cls(
+            {campo: [_a_columna(campo, d.get(campo, getattr(_DEFECTOS, campo))) for d in datos] for campo in CAMPOS},
+            nombres,
+            [{clave: valor for clave, valor in d.items() if clave not in _CAMPOS} for d in datos],
+        )
+
+    @classmethod
+    def from_saved(cls, guardados):
+        """Build from the app's saved_scenarios mapping ({name: {"data": ..., "timestamp": ...}})."""
+        return cls.from_dicts((entrada["data"] for entrada in guardados.values()), list(guardados))
+
+    @classmethod
+    def from_json(cls, texto):
+        """Inverse of to_json: a list of scenario dicts or a {name: dict} mapping."""
+        datos = json.loads(texto)
+        if isinstance(datos, dict):
+            return cls.from_dicts((d.get("data", d) for d in datos.values()), list(datos))
+        return cls.from_dicts(datos)
+
+    def __len__(self):
+        return len(self.columnas["precio_compra"])
+
+    def __getitem__(self, i):
+        return Scenario(
+            **{campo: _de_columna(campo, columna[i]) for campo, columna in self.columnas.items()},
+            extra=dict(self.extras[i]) if self.extras is not None else {},
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to_dicts(self):
+        return [escenario.to_dict() for escenario in self]
+
+    def to_json(self):
+        """Saved-scenario JSON: {name: dict} when the set has names, else a list of dicts."""
+        if self.nombres is not None:
+            return json.dumps(dict(zip(self.nombres, self.to_dicts())), ensure_ascii=False)
+        return json.dumps(self.to_dicts(), ensure_ascii=False)
+
+    def results(self, n_anos=None, anio_inicio=None):
+        """calcular_resultados_lote over the whole set (the float columns are passed as-is)."""
+        return calcular_resultados_lote(self.columnas, n_anos=n_anos, anio_inicio=anio_inicio)
+
+    def exit_analysis(self, anio_inicio=None, **kwargs):
+        """venta.analisis_venta over the whole set: sale at the end of every year of each term."""
+        return analisis_venta(self.columnas, self.results(anio_inicio=anio_inicio), anio_inicio=anio_inicio, **kwargs)
+
+
+def _columna(campo, valores):
+    if campo not in CAMPOS_ESTRUCTURADOS:
+        return np.asarray(valores, dtype=_tipo(campo))
+    # np.asarray convertiría listas de la misma longitud en una matriz: elemento a elemento
+    valores = list(valores)
+    columna = np.empty(len(valores), dtype=object)
+    for i, valor in enumerate(valores):
+        columna[i] = valor
+    return columna
+
+
+def _columna_defecto(campo):
+    return _a_columna(campo, getattr(_DEFECTOS, campo))
+
+
+def _a_columna(campo, valor):
+    if valor is None and campo in CAMPOS_OPCIONALES:
+        return np.nan
+    return valor
+
+
+def _de_columna(campo, valor):
+    if campo in CAMPOS_TEXTO or campo in CAMPOS_ESTRUCTURADOS:
+        return valor
+    if campo in CAMPOS_BOOL:
+        return bool(valor)
+    if campo in CAMPOS_OPCIONALES and np.isnan(valor):
+        return None
+    if campo in CAMPOS_ENTEROS:
+        return int(valor)
+    return float(valor)
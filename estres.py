@@ -0,0 +1,177 @@
+"""Historical stress tests replayed against many scenarios at once.
+
+A Choque is a set of per-year multipliers on the rent, the vacancy rate (`vacio`), the
+mortgage TIN and the property value (on top of REVALORIZACION_ANUAL), starting in the
+year of purchase. The last multiplier of each series persists for the remaining years,
+so a price crash that never recovers ends on its trough and a temporary shock ends on
+1.0. A TIN multiplier treats the loan as variable: each year the payment is recomputed
+on the outstanding balance and remaining term at the shocked rate.
+
+simular_choques flattens (scenarios × shocks) into one batch and walks the years once,
+so thousands of paths cost a single vectorized pass; peor_caso turns the result into
+the worst cash-flow and equity tables, with a portfolio row summing all scenarios.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import anualidades
+import fiscalidad
+import instrumentacion
+import metricas
+from calculos import GASTOS_EXPLOTACION, REVALORIZACION_ANUAL, calcular_resultados_lote, campo_lote
+
+FILA_CARTERA = "Cartera"
+
+
+@dataclass(slots=True)
+class Choque:
+    """Per-year multipliers of one shock; empty series leave the variable unchanged."""
+
+    nombre: str
+    descripcion: str = ""
+    alquiler: tuple = ()
+    vacio: tuple = ()
+    tin: tuple = ()
+    valor: tuple = ()
+
+    def trayectoria(self, variable, n_anos):
+        """Multipliers of `variable` for years 1..n_anos, extending the last one."""
+        serie = getattr(self, variable) or (1.0,)
+        serie = np.asarray(serie[:n_anos], dtype=float)
+        return np.concatenate((serie, np.full(n_anos - len(serie), serie[-1])))
+
+
+SIN_CHOQUE = Choque("Sin choque", "Hipótesis del escenario sin alteraciones")
+
+CHOQUES_HISTORICOS = (
+    Choque(
+        "Crisis inmobiliaria 2008-2013",
+        "Caída del precio de la vivienda de más de un tercio en seis años, alquileres a la baja y más vacío",
+        alquiler=(1.0, 0.97, 0.94, 0.91, 0.88, 0.86),
+        vacio=(1.5, 2.0, 2.0, 2.0, 1.5, 1.5, 1.0),
+        tin=(1.15, 0.85, 0.8, 0.9, 0.8, 0.75, 1.0),
+        valor=(0.95, 0.88, 0.83, 0.76, 0.69, 0.64),
+    ),
+    Choque(
+        "Subida del Euribor 2022-2023",
+        "Tipos variables del entorno del 0% al 4% en dieciocho meses, con alquileres al alza",
+        alquiler=(1.0, 1.03, 1.08),
+        tin=(1.0, 1.6, 1.8, 1.6, 1.3, 1.0),
+        valor=(1.0, 0.98),
+    ),
+    Choque(
+        "Vacío tipo COVID",
+        "Un año con la vivienda vacía buena parte del tiempo y rebajas temporales del alquiler",
+        alquiler=(0.9, 0.93, 0.97, 1.0),
+        vacio=(4.0, 2.0, 1.0),
+        valor=(0.97, 0.99, 1.0),
+    ),
+)
+
+
+@instrumentacion.instrumentado("simular_choques")
+def simular_choques(escenarios, choques=CHOQUES_HISTORICOS, n_anos=None, anio_inicio=None,
+                    revalorizacion=REVALORIZACION_ANUAL, incluir_base=True):
+    """Replay every shock against every scenario.
+
+    `escenarios` holds input columns as for calcular_resultados_lote (e.g.
+    ScenarioSet.columnas). Returns the list of shocks used (SIN_CHOQUE first when
+    `incluir_base`) and a dict of (scenarios, shocks, years) arrays: `flujo_anual`
+    (after-tax cash flow), `flujo_acumulado` (from minus the initial investment),
+    `deuda`, `valor_inmueble` and `patrimonio_neto`, all at the end of each year.
+    """
+    choques = ([SIN_CHOQUE] if incluir_base else []) + list(choques)
+    base = calcular_resultados_lote(escenarios, n_anos=n_anos, anio_inicio=anio_inicio)
+    n_escenarios, n_anos = base["beneficio_DI_anual"].shape
+    n_choques = len(choques)
+    metricas.incrementar("trayectorias_estres", n_escenarios * n_choques)
+
+    def por_escenario(valor):
+        # (escenarios,) -> (escenarios * choques,), escenario mayor
+        return np.repeat(np.asarray(valor, dtype=float), n_choques)
+
+    def por_choque(variable):
+        # (choques, años) -> (escenarios * choques, años)
+        return np.tile(np.stack([ch.trayectoria(variable, n_anos) for ch in choques]), (n_escenarios, 1))
+
+    c = {
+        nombre: por_escenario(campo_lote(escenarios, nombre, 0.0, n_escenarios))
+        for nombre in (
+            "precio_compra", "entrada", "alquiler_mes", "tin", "hipoteca_anos", "vacio", "seguro_impago",
+            "impuesto_basuras", "seguro_hogar", "seguro_vida", "comunidad", "ibi", "mantenimiento",
+            *GASTOS_EXPLOTACION,
+        )
+    }
+    explotacion = sum(c[nombre] for nombre in GASTOS_EXPLOTACION)
+    alquiler, vacio, tin, valor = (por_choque(v) for v in ("alquiler", "vacio", "tin", "valor"))
+
+    ingresos = c["alquiler_mes"][:, None] * 12 * alquiler
+    periodos_vacio = ingresos * np.minimum(c["vacio"][:, None] * vacio, 100.0) / 100
+    fijos = (
+        c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["seguro_vida"]
+        + c["comunidad"] + c["ibi"] + c["mantenimiento"] + explotacion
+    )
+
+    # Hipoteca: cada año se recalcula la cuota sobre el saldo y el plazo restantes
+    n = n_escenarios * n_choques
+    saldo = np.empty((n, n_anos + 1))
+    saldo[:, 0] = c["precio_compra"] - c["entrada"]
+    cuota_anual = np.zeros((n, n_anos))
+    for t in range(n_anos):
+        tin_t = c["tin"] * tin[:, t]
+        anos_restantes = np.maximum(c["hipoteca_anos"] - t, 0)
+        meses = np.minimum(anos_restantes * 12, 12)
+        cuota_anual[:, t] = saldo[:, t] * anualidades.factor_anualidad(tin_t, anos_restantes) * meses
+        saldo[:, t + 1] = np.where(
+            anos_restantes > 0, saldo[:, t] * anualidades.factor_saldo(tin_t, anos_restantes, meses), 0.0
+        )
+    capital_amortizado = saldo[:, :-1] - saldo[:, 1:]
+    intereses = cuota_anual - capital_amortizado
+
+    fiscal = fiscalidad.irpf_anual(
+        ingresos=ingresos - periodos_vacio,
+        gastos_deducibles=(
+            c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["comunidad"] + c["ibi"]
+            + explotacion
+        )[:, None],
+        gastos_limitados=intereses + c["mantenimiento"][:, None],
+        amortizacion=por_escenario(base["amortizacion_anual"])[:, None],
+        reduccion_pct=por_escenario(base["reduccion_pct"]),
+        irpf_marginal=por_escenario(campo_lote(escenarios, "irpf_marginal", 0.0, n_escenarios)),
+        otros_ingresos=por_escenario(campo_lote(escenarios, "otros_ingresos", np.nan, n_escenarios)),
+        anio_inicio=anio_inicio,
+    )
+    flujo_anual = ingresos - periodos_vacio - fijos[:, None] - cuota_anual - fiscal["irpf"]
+
+    anos = np.arange(1, n_anos + 1)
+    valor_inmueble = c["precio_compra"][:, None] * (1 + revalorizacion) ** anos[None, :] * valor
+    forma = (n_escenarios, n_choques, n_anos)
+    resultado = {
+        "flujo_anual": flujo_anual,
+        "flujo_acumulado": np.cumsum(flujo_anual, axis=1) - por_escenario(base["inversion_inicial"])[:, None],
+        "deuda": saldo[:, 1:],
+        "valor_inmueble": valor_inmueble,
+        "patrimonio_neto": valor_inmueble - saldo[:, 1:],
+    }
+    return choques, {clave: matriz.reshape(forma) for clave, matriz in resultado.items()}
+
+
+def peor_caso(simulacion, nombres, choques):
+    """Worst-case tables from simular_choques: {"flujo": DataFrame, "patrimonio": DataFrame}.
+
+    One row per scenario plus FILA_CARTERA (all scenarios held together) and one column
+    per shock with the lowest yearly cash flow and the lowest net equity over the
+    horizon; `Peor caso` and `Peor choque` give the minimum across shocks and its name.
+    """
+    nombres_choques = [choque.nombre for choque in choques]
+    tablas = {}
+    for clave, matriz in (("flujo", simulacion["flujo_anual"]), ("patrimonio", simulacion["patrimonio_neto"])):
+        # La cartera suma los escenarios año a año antes de buscar el peor año
+        minimos = np.concatenate((matriz.min(axis=2), matriz.sum(axis=0).min(axis=1)[None, :]))
+        tabla = pd.DataFrame(minimos, index=list(nombres) + [FILA_CARTERA], columns=nombres_choques)
+        tabla["Peor caso"] = minimos.min(axis=1)
+        tabla["Peor choque"] = np.asarray(nombres_choques, dtype=object)[minimos.argmin(axis=1)]
+        tablas[clave] = tabla
+    return tablas
@@ -0,0 +1,168 @@
+"""Financing-structure optimizer: down payment × term × competing mortgage offers.
+
+Each OfertaHipoteca brings its TIN, the terms the bank accepts, the maximum LTV and the
+yearly cost of the products it requires (seguro de vida and other linked products).
+Given the scenario being analysed and the cash available, every feasible combination
+of down payment, term and offer is evaluated in one calcular_resultados_lote call and
+scored by the IRR of selling after `anos_venta` years and by the average after-tax
+cash flow until then. The result carries the Pareto frontier of both objectives.
+
+Options that cannot win are dropped before evaluating: offers dominated by another
+one (same or better on every condition) and down payments below the LTV limit or
+above the cash left after purchase costs.
+"""
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import instrumentacion
+import metricas
+from escenarios import Scenario, ScenarioSet
+from venta import tir_venta
+
+PASO_ENTRADA = 5000
+PASO_PLAZO = 1
+ANOS_VENTA = 10
+
+
+@dataclass(slots=True)
+class OfertaHipoteca:
+    """Conditions of one bank offer."""
+
+    nombre: str
+    tin: float
+    plazo_min: int = 5
+    plazo_max: int = 30
+    ltv_max: float = 80.0
+    # None conserva el seguro de vida del escenario
+    seguro_vida: Optional[float] = None
+    otros_vinculados: float = 0.0
+
+    @classmethod
+    def from_dict(cls, datos):
+        return cls(**{campo.name: datos[campo.name] for campo in fields(cls) if campo.name in datos})
+
+    def coste_vinculado(self, seguro_vida_escenario):
+        """Yearly cost of the products the offer requires."""
+        seguro = seguro_vida_escenario if self.seguro_vida is None else self.seguro_vida
+        return seguro + self.otros_vinculados
+
+    def domina(self, otra, seguro_vida_escenario):
+        """True if every scenario `otra` can finance, this offer finances at least as well."""
+        propias = (
+            -self.tin, -self.coste_vinculado(seguro_vida_escenario), self.ltv_max, -self.plazo_min, self.plazo_max
+        )
+        ajenas = (
+            -otra.tin, -otra.coste_vinculado(seguro_vida_escenario), otra.ltv_max, -otra.plazo_min, otra.plazo_max
+        )
+        return all(a >= b for a, b in zip(propias, ajenas)) and propias != ajenas
+
+
+def ofertas_no_dominadas(ofertas, seguro_vida_escenario=0.0):
+    """Drop offers dominated by another one; identical offers keep the first."""
+    vivas = []
+    for i, oferta in enumerate(ofertas):
+        dominada = any(
+            otra.domina(oferta, seguro_vida_escenario) or (j < i and otra == oferta)
+            for j, otra in enumerate(ofertas) if j != i
+        )
+        if not dominada:
+            vivas.append(oferta)
+    return vivas
+
+
+def frontera_pareto(tir, flujo):
+    """Boolean mask of the points not dominated on (tir, flujo), both maximised.
+
+    Points without a finite IRR are never on the frontier.
+    """
+    tir = np.asarray(tir, dtype=float)
+    finita = np.isfinite(tir)
+    tir = np.where(finita, tir, -np.inf)
+    flujo = np.asarray(flujo, dtype=float)
+    orden = np.lexsort((-flujo, -tir))
+    mejor_flujo_previo = np.maximum.accumulate(np.concatenate(([-np.inf], flujo[orden][:-1])))
+    mascara = np.zeros(len(tir), dtype=bool)
+    mascara[orden] = flujo[orden] > mejor_flujo_previo
+    return mascara & finita
+
+
+@instrumentacion.instrumentado("optimizar_financiacion")
+def optimizar_financiacion(d, ofertas, efectivo, anos_venta=ANOS_VENTA, paso_entrada=PASO_ENTRADA,
+                           paso_plazo=PASO_PLAZO, flujo_minimo=None, anio_inicio=None):
+    """Evaluate every feasible down payment × term × offer for scenario `d`.
+
+    `ofertas` are OfertaHipoteca (or dicts) and `efectivo` the cash available for the
+    down payment plus purchase costs, reforms and fees. With `flujo_minimo`, options
+    whose after-tax cash flow falls below it in any year until the sale are discarded.
+    Returns a DataFrame with one row per feasible option (oferta, entrada,
+    hipoteca_anos, tin, cuota_mensual, inversion_inicial, flujo_medio, flujo_minimo,
+    tir, pareto) sorted by IRR; the frontier is the rows with `pareto` set. Empty when
+    nothing is feasible.
+    """
+    base = Scenario.from_dict(d)
+    ofertas = [o if isinstance(o, OfertaHipoteca) else OfertaHipoteca.from_dict(o) for o in ofertas]
+    vivas = ofertas_no_dominadas(ofertas, base.seguro_vida)
+    metricas.incrementar("ofertas_dominadas", len(ofertas) - len(vivas))
+    ofertas = vivas
+
+    # Gastos de compra fijos (no dependen de la entrada): lo que queda para la entrada
+    costes_fijos = float(base.results()["inversion_inicial"]) - base.entrada
+    entrada_max = min(efectivo - costes_fijos, base.precio_compra)
+
+    indice_oferta, entradas, plazos = [], [], []
+    for i, oferta in enumerate(ofertas):
+        # A céntimos: 200000 × (1 - 0.8) da 39999.999…, un casi duplicado del punto 40000 de la rejilla
+        entrada_min = round(base.precio_compra * (1 - oferta.ltv_max / 100), 2)
+        if entrada_min > entrada_max:
+            continue
+        oferta_entradas = np.arange(np.ceil(entrada_min / paso_entrada) * paso_entrada, entrada_max + 1, paso_entrada)
+        if not len(oferta_entradas) or oferta_entradas[0] > entrada_min:
+            oferta_entradas = np.concatenate(([entrada_min], oferta_entradas))
+        oferta_plazos = np.arange(oferta.plazo_min, oferta.plazo_max + 1, paso_plazo)
+        e, p = np.meshgrid(oferta_entradas, oferta_plazos, indexing="ij")
+        indice_oferta.append(np.full(e.size, i))
+        entradas.append(e.ravel())
+        plazos.append(p.ravel())
+    if not entradas:
+        return pd.DataFrame(columns=[
+            "oferta", "entrada", "hipoteca_anos", "tin", "cuota_mensual", "inversion_inicial",
+            "flujo_medio", "flujo_minimo", "tir", "pareto",
+        ])
+
+    indice_oferta = np.concatenate(indice_oferta)
+    n = len(indice_oferta)
+    columnas = {campo: np.repeat(columna, n) for campo, columna in ScenarioSet.from_scenarios([base]).columnas.items()}
+    columnas["entrada"] = np.concatenate(entradas)
+    columnas["hipoteca_anos"] = np.concatenate(plazos)
+    columnas["tin"] = np.array([o.tin for o in ofertas])[indice_oferta]
+    columnas["seguro_vida"] = np.array([o.coste_vinculado(base.seguro_vida) for o in ofertas])[indice_oferta]
+    candidatos = ScenarioSet(columnas)
+
+    resultados = candidatos.results(n_anos=anos_venta, anio_inicio=anio_inicio)
+    flujos = resultados["beneficio_DI_anual"][:, :anos_venta]
+    peor_flujo = flujos.min(axis=1)
+    validos = np.ones(n, dtype=bool) if flujo_minimo is None else peor_flujo >= flujo_minimo
+    tir = np.full(n, np.nan)
+    if validos.any():
+        tir[validos] = tir_venta(
+            {campo: columna[validos] for campo, columna in columnas.items()},
+            {clave: valor[validos] for clave, valor in resultados.items()},
+            anos_venta, anio_inicio=anio_inicio,
+        )
+
+    tabla = pd.DataFrame({
+        "oferta": np.array([o.nombre for o in ofertas], dtype=object)[indice_oferta],
+        "entrada": columnas["entrada"],
+        "hipoteca_anos": columnas["hipoteca_anos"].astype(int),
+        "tin": columnas["tin"],
+        "cuota_mensual": resultados["cuota_mensual"],
+        "inversion_inicial": resultados["inversion_inicial"],
+        "flujo_medio": flujos.mean(axis=1),
+        "flujo_minimo": peor_flujo,
+        "tir": tir,
+    })[validos]
+    tabla["pareto"] = frontera_pareto(tabla["tir"].to_numpy(), tabla["flujo_medio"].to_numpy())
+    return tabla.sort_values("tir", ascending=False, na_position="last").reset_index(drop=True)
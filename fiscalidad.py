@@ -0,0 +1,191 @@
+"""Spanish IRPF tables and vectorized tax engine for rental income."""
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+# Escala general IRPF (estatal + autonómica estándar), por año de entrada en vigor.
+# Cada tramo es (límite superior de la base, tipo marginal %).
+TABLAS_IRPF = {
+    2015: (
+        (12450, 19.0),
+        (20200, 24.0),
+        (35200, 30.0),
+        (60000, 37.0),
+        (float("inf"), 45.0),
+    ),
+    2021: (
+        (12450, 19.0),
+        (20200, 24.0),
+        (35200, 30.0),
+        (60000, 37.0),
+        (300000, 45.0),
+        (float("inf"), 47.0),
+    ),
+}
+
+# Escala del ahorro (ganancias patrimoniales, p. ej. la venta del inmueble), por año de entrada en vigor.
+TABLAS_AHORRO = {
+    2021: (
+        (6000, 19.0),
+        (50000, 21.0),
+        (200000, 23.0),
+        (float("inf"), 26.0),
+    ),
+    2023: (
+        (6000, 19.0),
+        (50000, 21.0),
+        (200000, 23.0),
+        (300000, 27.0),
+        (float("inf"), 28.0),
+    ),
+    2025: (
+        (6000, 19.0),
+        (50000, 21.0),
+        (200000, 23.0),
+        (300000, 27.0),
+        (float("inf"), 30.0),
+    ),
+}
+
+# Reducciones del rendimiento neto positivo por alquiler de vivienda, por año de entrada en vigor.
+# Cada tramo es (código, reducción %, descripción).
+REDUCCIONES_ALQUILER = {
+    2015: (
+        ("general", 60.0, "Vivienda habitual del inquilino (60%)"),
+    ),
+    2024: (
+        ("general", 50.0, "General (50%)"),
+        ("contrato_anterior", 60.0, "Contrato firmado antes del 26/05/2023 (60%)"),
+        ("rehabilitacion", 60.0, "Obras de rehabilitación en los 2 años anteriores (60%)"),
+        ("joven_zona_tensionada", 70.0, "Inquilino de 18 a 35 años en zona tensionada (70%)"),
+        ("rebaja_zona_tensionada", 90.0, "Rebaja de renta ≥ 5% en zona tensionada (90%)"),
+    ),
+}
+
+# Gastos de financiación y conservación: solo deducibles hasta los ingresos íntegros,
+# el exceso se arrastra a los 4 ejercicios siguientes.
+ANOS_ARRASTRE_GASTOS = 4
+
+
+def version_vigente(tablas, anio):
+    """Return the most recent table version in force for a given year."""
+    versiones = [v for v in sorted(tablas) if v <= anio]
+    return versiones[-1] if versiones else min(tablas)
+
+
+def reducciones_disponibles(anio=None):
+    """Return the rental reduction tiers (code, %, description) in force for a year."""
+    anio = anio or datetime.now().year
+    return REDUCCIONES_ALQUILER[version_vigente(REDUCCIONES_ALQUILER, anio)]
+
+
+def _compilar_escala(tramos):
+    limites_superiores = np.array([limite for limite, _ in tramos], dtype=float)
+    limites_inferiores = np.concatenate(([0.0], limites_superiores[:-1]))
+    tipos = np.array([tipo for _, tipo in tramos], dtype=float) / 100
+    cuota_tramo = (limites_superiores[:-1] - limites_inferiores[:-1]) * tipos[:-1]
+    cuota_acumulada = np.concatenate(([0.0], np.cumsum(cuota_tramo)))
+    return limites_inferiores, tipos, cuota_acumulada
+
+
+@lru_cache(maxsize=None)
+def escala_irpf(version):
+    """Precompile a bracket table into (lower limits, rates, accumulated tax) arrays."""
+    return _compilar_escala(TABLAS_IRPF[version])
+
+
+@lru_cache(maxsize=None)
+def escala_ahorro(version):
+    """escala_irpf for the savings-base scale (TABLAS_AHORRO)."""
+    return _compilar_escala(TABLAS_AHORRO[version])
+
+
+def _aplicar_escala(base, escala):
+    limites_inferiores, tipos, cuota_acumulada = escala
+    base = np.maximum(np.asarray(base, dtype=float), 0.0)
+    idx = np.searchsorted(limites_inferiores, base, side="right") - 1
+    return cuota_acumulada[idx] + (base - limites_inferiores[idx]) * tipos[idx]
+
+
+def cuota_progresiva(base, version):
+    """Vectorized tax due on a general taxable base using the bracket table of a version."""
+    return _aplicar_escala(base, escala_irpf(version))
+
+
+def cuota_ahorro(ganancia, anio=None):
+    """Vectorized tax on a capital gain taxed alone in the savings base (losses pay 0)."""
+    anio = anio or datetime.now().year
+    return _aplicar_escala(ganancia, escala_ahorro(version_vigente(TABLAS_AHORRO, anio)))
+
+
+def irpf_anual(
+    ingresos, gastos_deducibles, gastos_limitados, amortizacion,
+    reduccion_pct, irpf_marginal, otros_ingresos=None, anio_inicio=None
+):
+    """Year-by-year IRPF on rental income for a batch of scenarios.
+
+    Per-year inputs have shape (scenarios, years); per-scenario inputs have shape
+    (scenarios,). `gastos_limitados` are the interest and upkeep costs capped at the
+    year's income, with the excess carried forward. When `otros_ingresos` is NaN the
+    flat `irpf_marginal` applies; otherwise the tax is the increase in the progressive
+    scale caused by adding the rental base to the other general income.
+    """
+    ingresos = np.atleast_2d(np.asarray(ingresos, dtype=float))
+    n_escenarios, n_anos = ingresos.shape
+    gastos_deducibles = np.broadcast_to(np.asarray(gastos_deducibles, dtype=float), ingresos.shape)
+    gastos_limitados = np.broadcast_to(np.asarray(gastos_limitados, dtype=float), ingresos.shape)
+    amortizacion = np.broadcast_to(np.asarray(amortizacion, dtype=float), ingresos.shape)
+    reduccion_pct = np.broadcast_to(np.asarray(reduccion_pct, dtype=float), (n_escenarios,))
+    irpf_marginal = np.broadcast_to(np.asarray(irpf_marginal, dtype=float), (n_escenarios,))
+    if otros_ingresos is None:
+        otros_ingresos = np.nan
+    otros_ingresos = np.broadcast_to(np.asarray(otros_ingresos, dtype=float), (n_escenarios,))
+    progresivo = ~np.isnan(otros_ingresos)
+    otros = np.where(progresivo, otros_ingresos, 0.0)
+    anio_inicio = anio_inicio or datetime.now().year
+
+    limitados_deducidos = np.zeros(ingresos.shape)
+    rendimiento_neto = np.zeros(ingresos.shape)
+    reduccion = np.zeros(ingresos.shape)
+    base_imponible = np.zeros(ingresos.shape)
+    irpf = np.zeros(ingresos.shape)
+
+    # pendientes[:, k] = exceso generado hace k + 1 años que aún puede deducirse
+    pendientes = np.zeros((n_escenarios, ANOS_ARRASTRE_GASTOS))
+
+    for t in range(n_anos):
+        disponible = np.maximum(ingresos[:, t], 0.0)
+        deducido = np.zeros(n_escenarios)
+        # Los excesos de ejercicios anteriores se aplican primero, del más antiguo al más reciente
+        for k in range(ANOS_ARRASTRE_GASTOS - 1, -1, -1):
+            usado = np.minimum(pendientes[:, k], disponible)
+            pendientes[:, k] -= usado
+            disponible -= usado
+            deducido += usado
+        usado = np.minimum(gastos_limitados[:, t], disponible)
+        deducido += usado
+        pendientes[:, 1:] = pendientes[:, :-1]
+        pendientes[:, 0] = gastos_limitados[:, t] - usado
+        limitados_deducidos[:, t] = deducido
+
+        neto = ingresos[:, t] - gastos_deducibles[:, t] - deducido - amortizacion[:, t]
+        reduccion_t = np.where(neto > 0, neto * reduccion_pct / 100, 0.0)
+        base = neto - reduccion_t
+
+        version = version_vigente(TABLAS_IRPF, anio_inicio + t)
+        cuota_tramos = cuota_progresiva(otros + base, version) - cuota_progresiva(otros, version)
+        cuota_marginal = base * irpf_marginal / 100
+
+        rendimiento_neto[:, t] = neto
+        reduccion[:, t] = reduccion_t
+        base_imponible[:, t] = base
+        irpf[:, t] = np.maximum(np.where(progresivo, cuota_tramos, cuota_marginal), 0.0)
+
+    return {
+        "gastos_limitados_deducidos": limitados_deducidos,
+        "rendimiento_neto": rendimiento_neto,
+        "reduccion": reduccion,
+        "base_imponible": base_imponible,
+        "irpf": irpf,
+    }
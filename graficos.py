@@ -0,0 +1,505 @@
+"""Result chart builders and the trace helpers that keep Plotly figures light in the browser.
+
+The builders are shared by the app and the batch report generator (informes.py). Every
+chart builder passes its figure through optimizar_figura. Small figures (one
+25-year scenario) come back untouched. Above UMBRAL_WEBGL points, line traces switch to
+WebGL (Scattergl) and lose per-point markers. Above MAX_PUNTOS_FIGURA, each line trace
+is decimated server-side with min/max buckets so peaks and troughs survive. Overlays
+with more than MAX_TRAZAS_INDIVIDUALES series are aggregated into a percentile band
+with banda_percentiles instead of one trace per scenario.
+"""
+import math
+
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from calculos import REVALORIZACION_ANUAL, cuadro_amortizacion_anual, proyeccion_lote
+from instrumentacion import instrumentado
+
+UMBRAL_WEBGL = 1000
+MAX_PUNTOS_FIGURA = 20000
+MAX_TRAZAS_INDIVIDUALES = 50
+PERCENTILES_BANDA = (10, 50, 90)
+
+
+def diezmar(x, y, max_puntos):
+    """Keep the first/last point and the min and max of each bucket, in x order.
+
+    `x` must be sorted. Returns (x, y) as arrays with at most ~max_puntos points.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_puntos or max_puntos < 4:
+        return x, y
+
+    cubetas = (max_puntos - 2) // 2
+    tamano = math.ceil(n / cubetas)
+    relleno = np.pad(y, (0, cubetas * tamano - n), mode="edge").reshape(cubetas, tamano)
+    nan = np.isnan(relleno)
+    base = np.arange(cubetas)[:, None] * tamano
+    minimos = base[:, 0] + np.argmin(np.where(nan, np.inf, relleno), axis=1)
+    maximos = base[:, 0] + np.argmax(np.where(nan, -np.inf, relleno), axis=1)
+
+    indices = np.unique(np.concatenate(([0, n - 1], minimos, maximos)).clip(0, n - 1))
+    return x[indices], y[indices]
+
+
+def _puntos(traza):
+    if traza.type not in ("scatter", "scattergl") or traza.y is None:
+        return 0
+    # Las nubes de solo marcadores no van ordenadas en x: diezmar perdería puntos arbitrarios
+    if traza.mode is not None and "lines" not in traza.mode:
+        return 0
+    return len(traza.y)
+
+
+def _ligera(traza, presupuesto):
+    """WebGL copy of a line trace without markers, decimated to `presupuesto` points if given."""
+    datos = traza.to_plotly_json()
+    datos.pop("type", None)
+    if presupuesto is not None and datos.get("x") is not None and len(datos["y"]) > presupuesto:
+        datos["x"], datos["y"] = diezmar(datos["x"], datos["y"], presupuesto)
+    if datos.get("mode") and "markers" in datos["mode"]:
+        datos["mode"] = datos["mode"].replace("+markers", "").replace("markers+", "")
+    try:
+        return go.Scattergl(datos)
+    except ValueError:
+        # Propiedades sin equivalente WebGL (p. ej. line.shape='spline'): se queda en SVG
+        return go.Scatter(datos)
+
+
+def tipo_traza(total_puntos, umbral_webgl=UMBRAL_WEBGL):
+    """Trace type for a figure built with `total_puntos` line points (avoids a later rebuild)."""
+    return "scattergl" if total_puntos > umbral_webgl else "scatter"
+
+
+def optimizar_figura(fig, umbral_webgl=UMBRAL_WEBGL, max_puntos=MAX_PUNTOS_FIGURA):
+    """Return `fig`, or a lighter copy if its line traces exceed the point thresholds.
+
+    Markers-only traces are never decimated.
+    """
+    puntos = [_puntos(traza) for traza in fig.data]
+    total = sum(puntos)
+    if total <= umbral_webgl:
+        return fig
+    if total <= max_puntos and all(traza.type == "scattergl" for traza, n in zip(fig.data, puntos) if n):
+        return fig
+
+    trazas = []
+    for traza, n in zip(fig.data, puntos):
+        if not n:
+            trazas.append(traza)
+            continue
+        presupuesto = max(int(max_puntos * n / total), 4) if total > max_puntos else None
+        trazas.append(_ligera(traza, presupuesto))
+    return go.Figure(data=trazas, layout=fig.layout)
+
+
+def banda_percentiles(x, matriz, nombre, color, percentiles=PERCENTILES_BANDA):
+    """Aggregate many series (rows of `matriz`) into a shaded low-high band plus the median.
+
+    Returns three traces for fig.add_traces: lower bound, upper bound filled to it, median.
+    """
+    bajo, medio, alto = np.nanpercentile(np.asarray(matriz, dtype=float), percentiles, axis=0)
+    etiqueta_banda = f"{nombre} (p{percentiles[0]}-p{percentiles[2]})"
+    return [
+        go.Scatter(
+            x=x, y=bajo, mode="lines", line=dict(width=0, color=color),
+            showlegend=False, hoverinfo="skip", legendgroup=nombre
+        ),
+        go.Scatter(
+            x=x, y=alto, mode="lines", line=dict(width=0, color=color),
+            fill="tonexty", opacity=0.3, name=etiqueta_banda, legendgroup=nombre
+        ),
+        go.Scatter(
+            x=x, y=medio, mode="lines", line=dict(color=color, width=3),
+            name=f"{nombre} (mediana)", legendgroup=nombre
+        ),
+    ]
+
+
+# Constructores de los gráficos de resultados (app e informes)
+
+@instrumentado("grafico_beneficios")
+def create_profit_over_time_chart(data, results):
+    """Create a chart showing annual profit over the mortgage period"""
+    years = list(range(1, data['hipoteca_anos'] + 1))
+    annual_profit = results['beneficio_DI_anual'][:len(years)]
+    cumulative_profit = np.cumsum(annual_profit)
+
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=('Beneficio Anual', 'Beneficio Acumulado'),
+        vertical_spacing=0.1
+    )
+
+    # Annual profit
+    fig.add_trace(
+        go.Scatter(
+            x=years, y=annual_profit,
+            mode='lines+markers',
+            name='Beneficio Anual',
+            line=dict(color='#2E8B57', width=3),
+            marker=dict(size=6)
+        ),
+        row=1, col=1
+    )
+
+    # Cumulative profit
+    fig.add_trace(
+        go.Scatter(
+            x=years, y=cumulative_profit,
+            mode='lines+markers',
+            name='Beneficio Acumulado',
+            line=dict(color='#1E90FF', width=3),
+            marker=dict(size=6),
+            fill='tonexty'
+        ),
+        row=2, col=1
+    )
+
+    fig.update_layout(
+        title="📈 Evolución de Beneficios a lo largo del tiempo",
+        height=500,
+        showlegend=False,
+        template="plotly_white"
+    )
+
+    fig.update_yaxes(title_text="Euros (€)", tickformat=",")
+    fig.update_xaxes(title_text="Años", row=2, col=1)
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_hipoteca")
+def create_mortgage_breakdown_chart(data):
+    """Create a chart showing mortgage payment breakdown over time"""
+    capital_prestamo = data['precio_compra'] - data['entrada']
+    _, _, interest_payments, principal_payments = cuadro_amortizacion_anual(
+        capital_prestamo, data['tin'], data['hipoteca_anos']
+    )
+    years = list(range(1, data['hipoteca_anos'] + 1))
+    interest_payments = interest_payments[0]
+    principal_payments = principal_payments[0]
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Bar(
+        x=years,
+        y=interest_payments,
+        name='Intereses',
+        marker_color='#FF6B6B'
+    ))
+
+    fig.add_trace(go.Bar(
+        x=years,
+        y=principal_payments,
+        name='Capital',
+        marker_color='#4ECDC4'
+    ))
+
+    fig.update_layout(
+        title="🏦 Desglose de Pagos de Hipoteca (Capital vs Intereses)",
+        xaxis_title="Años",
+        yaxis_title="Euros (€)",
+        barmode='stack',
+        template="plotly_white",
+        height=400
+    )
+
+    fig.update_yaxes(tickformat=",")
+
+    return fig
+
+
+@instrumentado("grafico_patrimonio")
+def create_net_worth_chart(data, results):
+    """Create a chart showing net worth evolution over time"""
+    years = list(range(0, data['hipoteca_anos'] + 1))
+
+    # Calculate property appreciation
+    property_values = [data['precio_compra'] * (1 + REVALORIZACION_ANUAL) ** year for year in years]
+
+    # Calculate mortgage balance
+    capital_prestamo = data['precio_compra'] - data['entrada']
+    _, mortgage_balances, _, _ = cuadro_amortizacion_anual(capital_prestamo, data['tin'], data['hipoteca_anos'])
+    mortgage_balances = mortgage_balances[0]
+
+    # Calculate net worth (property value - mortgage balance)
+    net_worth = [prop_val - mortgage_bal for prop_val, mortgage_bal in zip(property_values, mortgage_balances)]
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatter(
+        x=years, y=property_values,
+        mode='lines+markers',
+        name='Valor Propiedad',
+        line=dict(color='#32CD32', width=3),
+        marker=dict(size=6)
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=years, y=mortgage_balances,
+        mode='lines+markers',
+        name='Deuda Hipoteca',
+        line=dict(color='#FF4500', width=3),
+        marker=dict(size=6)
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=years, y=net_worth,
+        mode='lines+markers',
+        name='Patrimonio Neto',
+        line=dict(color='#1E90FF', width=4),
+        marker=dict(size=8),
+        fill='tonexty'
+    ))
+
+    fig.update_layout(
+        title="💰 Evolución del Patrimonio Neto",
+        xaxis_title="Años",
+        yaxis_title="Euros (€)",
+        template="plotly_white",
+        height=500,
+        hovermode='x unified'
+    )
+
+    fig.update_yaxes(tickformat=",")
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_gastos")
+def create_expense_breakdown_chart(results):
+    """Create a pie chart showing expense breakdown"""
+    expenses = results['gastos_dict']
+
+    # Filter out zero expenses and prepare data
+    non_zero_expenses = [(name, value) for name, value in expenses if value > 0]
+
+    if not non_zero_expenses:
+        return None
+
+    names, values = zip(*non_zero_expenses)
+
+    # Custom colors for different expense types
+    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7', '#DDA0DD', '#98D8C8', '#F7DC6F', '#BB8FCE']
+
+    fig = go.Figure(data=[go.Pie(
+        labels=names,
+        values=values,
+        hole=0.4,
+        marker=dict(colors=colors[:len(names)]),
+        textinfo='label+percent',
+        textposition='outside'
+    )])
+
+    fig.update_layout(
+        title="📊 Desglose de Gastos Anuales",
+        template="plotly_white",
+        height=500,
+        showlegend=True
+    )
+
+    return fig
+
+
+COLORES_ESCENARIOS = (
+    '#1E90FF', '#FF6B6B', '#2E8B57', '#FFA500', '#9370DB', '#20B2AA', '#DC143C', '#8B4513', '#FF69B4', '#708090'
+)
+
+
+@instrumentado("grafico_comparacion")
+def create_comparison_chart(nombres, precio_compra, resultados):
+    """Overlay net worth, cumulative cash flow and debt of many scenarios in one figure.
+
+    Takes the output of one calcular_resultados_lote call; above
+    MAX_TRAZAS_INDIVIDUALES scenarios each panel becomes a percentile band.
+    """
+    proyeccion = proyeccion_lote(precio_compra, resultados)
+    paneles = (
+        ("patrimonio_neto", "Patrimonio neto"),
+        ("flujo_acumulado", "Flujo de caja acumulado (después de impuestos)"),
+        ("deuda", "Deuda hipotecaria pendiente"),
+    )
+    anos = np.arange(proyeccion["deuda"].shape[1])
+
+    fig = make_subplots(
+        rows=len(paneles), cols=1, shared_xaxes=True, vertical_spacing=0.06,
+        subplot_titles=[titulo for _, titulo in paneles]
+    )
+    agregado = len(nombres) > MAX_TRAZAS_INDIVIDUALES
+    tipo = tipo_traza(len(paneles) * proyeccion["deuda"].size)
+    for fila, (clave, _) in enumerate(paneles, start=1):
+        matriz = proyeccion[clave]
+        if agregado:
+            fig.add_traces(
+                banda_percentiles(anos, matriz, f"{len(nombres)} escenarios", COLORES_ESCENARIOS[0]),
+                rows=fila, cols=1
+            )
+            continue
+        # Un único add_traces por panel: add_trace por escenario valida la figura entera cada vez
+        fig.add_traces(
+            [
+                dict(
+                    type=tipo, x=anos, y=matriz[i], mode='lines', name=nombre, legendgroup=nombre,
+                    showlegend=fila == 1, line=dict(color=COLORES_ESCENARIOS[i % len(COLORES_ESCENARIOS)], width=2)
+                )
+                for i, nombre in enumerate(nombres)
+            ],
+            rows=fila, cols=1
+        )
+    if agregado:
+        for traza in fig.data[3:]:
+            traza.showlegend = False
+
+    fig.update_layout(
+        title="📊 Comparación de escenarios",
+        template="plotly_white",
+        height=800,
+        hovermode='x unified' if not agregado else 'closest'
+    )
+    fig.update_yaxes(title_text="Euros (€)", tickformat=",")
+    fig.update_xaxes(title_text="Años", row=len(paneles), col=1)
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_venta")
+def create_exit_chart(salida):
+    """Net sale proceeds and total profit for each sale year, with the IRR on a second axis.
+
+    Takes one row of venta.analisis_venta (the dict of (years,) arrays of a single scenario).
+    """
+    anos = np.arange(1, len(salida["tir"]) + 1)
+    validos = ~np.isnan(salida["tir"])
+    anos, neto, beneficio, tir = (
+        anos[validos], salida["neto_venta"][validos], salida["beneficio_total"][validos], salida["tir"][validos] * 100
+    )
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Bar(x=anos, y=neto, name='Neto de la venta', marker_color='#1E90FF'), secondary_y=False)
+    fig.add_trace(go.Bar(x=anos, y=beneficio, name='Beneficio total', marker_color='#2E8B57'), secondary_y=False)
+    fig.add_trace(
+        go.Scatter(x=anos, y=tir, mode='lines+markers', name='TIR', line=dict(color='#FF6B6B', width=3)),
+        secondary_y=True
+    )
+    if salida["ano_optimo"]:
+        fig.add_vline(
+            x=int(salida["ano_optimo"]), line_dash="dash", line_color="#FF6B6B",
+            annotation_text=f"Óptimo: año {int(salida['ano_optimo'])}"
+        )
+
+    fig.update_layout(
+        title="🏁 Resultado de vender al final de cada año",
+        barmode='group',
+        height=500,
+        template="plotly_white",
+        hovermode='x unified'
+    )
+    fig.update_xaxes(title_text="Año de venta")
+    fig.update_yaxes(title_text="Euros (€)", tickformat=",", secondary_y=False)
+    fig.update_yaxes(title_text="TIR (%)", ticksuffix="%", secondary_y=True)
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_habitaciones")
+def create_rooms_chart(flujos):
+    """Spread of the yearly and cumulative after-tax cash flow over the occupancy paths.
+
+    Takes habitaciones.flujos_trayectorias output ((paths, years) arrays).
+    """
+    anos = np.arange(1, flujos["flujo_anual"].shape[1] + 1)
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=('Flujo de caja anual', 'Flujo de caja acumulado'),
+        vertical_spacing=0.1
+    )
+    fig.add_traces(banda_percentiles(anos, flujos["flujo_anual"], "Anual", '#2E8B57'), rows=1, cols=1)
+    fig.add_traces(banda_percentiles(anos, flujos["flujo_acumulado"], "Acumulado", '#1E90FF'), rows=2, cols=1)
+    fig.add_hline(y=0, line_dash="dash", line_color="red", row=2, col=1)
+
+    fig.update_layout(
+        title="🛏️ Flujo de caja según la ocupación de las habitaciones",
+        height=600,
+        template="plotly_white",
+        hovermode='x unified'
+    )
+    fig.update_xaxes(title_text="Año", row=2, col=1)
+    fig.update_yaxes(title_text="Euros (€)", tickformat=",")
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_temporada")
+def create_seasonal_chart(meses, flujos):
+    """Monthly income, costs and after-tax cash flow of one year of a seasonal let.
+
+    Takes the month labels and one row of temporada.flujos_mensuales ((12,) arrays).
+    """
+    gastos = {
+        'Limpieza': (flujos["limpieza"], '#FFA07A'),
+        'Comisión plataforma': (flujos["comision"], '#FF6B6B'),
+        'Otros gastos': (flujos["fijos"], '#A9A9A9'),
+        'Hipoteca': (flujos["hipoteca"], '#4169E1'),
+        'IRPF': (flujos["irpf"], '#9370DB'),
+    }
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=meses, y=flujos["ingresos"], name='Ingresos', marker_color='#2E8B57', offsetgroup='ingresos'))
+    for nombre, (importe, color) in gastos.items():
+        fig.add_trace(go.Bar(x=meses, y=-importe, name=nombre, marker_color=color, offsetgroup='gastos'))
+    fig.add_trace(go.Scatter(
+        x=meses, y=flujos["flujo"], mode='lines+markers', name='Flujo neto',
+        line=dict(color='#222222', width=3)
+    ))
+    fig.add_hline(y=0, line_dash="dash", line_color="red")
+
+    fig.update_layout(
+        title="🏖️ Ingresos y gastos mes a mes (primer año)",
+        barmode='relative',
+        height=500,
+        template="plotly_white",
+        hovermode='x unified'
+    )
+    fig.update_yaxes(title_text="Euros (€)", tickformat=",")
+
+    return optimizar_figura(fig)
+
+
+@instrumentado("grafico_financiacion")
+def create_financing_chart(candidatos):
+    """IRR against average cash flow of every financing option, with the Pareto frontier.
+
+    Takes the DataFrame of financiacion.optimizar_financiacion.
+    """
+    fig = go.Figure()
+    tipo = tipo_traza(len(candidatos))
+    trazas = []
+    for i, (oferta, grupo) in enumerate(candidatos.groupby("oferta", sort=False)):
+        trazas.append(dict(
+            type=tipo, x=grupo["tir"] * 100, y=grupo["flujo_medio"], mode='markers', name=oferta,
+            marker=dict(color=COLORES_ESCENARIOS[i % len(COLORES_ESCENARIOS)], size=5, opacity=0.5),
+            customdata=np.column_stack([grupo["entrada"], grupo["hipoteca_anos"]]),
+            hovertemplate="Entrada %{customdata[0]:,.0f} €, %{customdata[1]} años<extra>" + oferta + "</extra>"
+        ))
+    frontera = candidatos[candidatos["pareto"]].sort_values("tir")
+    trazas.append(dict(
+        type='scatter', x=frontera["tir"] * 100, y=frontera["flujo_medio"], mode='lines+markers',
+        name='Frontera eficiente', line=dict(color='#1a237e', width=3), marker=dict(size=8),
+        customdata=np.column_stack([frontera["oferta"], frontera["entrada"], frontera["hipoteca_anos"]]),
+        hovertemplate="%{customdata[0]}: entrada %{customdata[1]:,.0f} €, %{customdata[2]} años<extra></extra>"
+    ))
+    fig.add_traces(trazas)
+
+    fig.update_layout(
+        title="🏦 Opciones de financiación: rentabilidad frente a flujo de caja",
+        height=500,
+        template="plotly_white"
+    )
+    fig.update_xaxes(title_text="TIR (%)", ticksuffix="%")
+    fig.update_yaxes(title_text="Flujo de caja medio anual (€)", tickformat=",")
+
+    return optimizar_figura(fig)
@@ -0,0 +1,216 @@
+"""Room-by-room rental model with a month-by-month occupancy simulation.
+
+Each Habitacion has its own rent, average tenancy (`estancia_media`, months), average
+vacancy between tenants (`vacio_medio`, months, fractions allowed), yearly running
+costs (`gastos`: suministros, limpieza, mobiliario) and a cost per tenant change
+(`coste_rotacion`: anuncio, limpieza, comisión). simular_ocupacion walks the months
+once over a (rooms, paths) state: a let room loses its tenant at the end of a month
+with probability 1 / estancia_media, and the vacancy that follows lasts an exponential
+number of months with mean vacio_medio, so part of a month can be lost. Each room
+starts let with the long-run probability estancia_media / (estancia_media + vacio_medio),
+so every year of the horizon is comparable. The simulation is seeded: the same rooms
+always give the same figures.
+
+campos_escenario turns the simulated mean into the flat scenario fields (alquiler_mes
+with every room let, vacio and gastos_habitaciones), so calcular_resultados_lote and
+everything built on it work on the expected figures. flujos_trayectorias gives the
+after-tax cash flow of every simulated path, for the income distribution.
+"""
+from dataclasses import asdict, dataclass, fields
+from functools import lru_cache
+
+import numpy as np
+
+import fiscalidad
+import instrumentacion
+import metricas
+from escenarios import ScenarioSet
+
+N_TRAYECTORIAS = 1000
+SEMILLA = 0
+# Horizonte de la simulación con la que se derivan los campos del escenario
+ANOS_RESUMEN = 10
+
+
+@dataclass(slots=True)
+class Habitacion:
+    """One room let on its own."""
+
+    nombre: str = "Habitación"
+    renta: float = 400.0
+    estancia_media: float = 10.0
+    vacio_medio: float = 0.5
+    gastos: float = 300.0
+    coste_rotacion: float = 100.0
+
+    @classmethod
+    def from_dict(cls, datos):
+        return cls(**{campo.name: datos[campo.name] for campo in fields(cls) if campo.name in datos})
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _parametros(habitaciones):
+    """(renta, estancia_media, vacio_medio, gastos, coste_rotacion) as a hashable tuple of tuples."""
+    habitaciones = [h if isinstance(h, Habitacion) else Habitacion.from_dict(h) for h in habitaciones]
+    if not habitaciones:
+        raise ValueError("El modelo por habitaciones necesita al menos una habitación")
+    for h in habitaciones:
+        if h.renta < 0 or h.gastos < 0 or h.coste_rotacion < 0:
+            raise ValueError(f"Importes negativos en «{h.nombre}»")
+        if h.estancia_media < 1:
+            raise ValueError(f"La estancia media de «{h.nombre}» debe ser de al menos un mes")
+        if h.vacio_medio < 0:
+            raise ValueError(f"El vacío medio de «{h.nombre}» no puede ser negativo")
+    return tuple(
+        tuple(float(getattr(h, campo)) for h in habitaciones)
+        for campo in ("renta", "estancia_media", "vacio_medio", "gastos", "coste_rotacion")
+    )
+
+
+@instrumentacion.instrumentado("simular_ocupacion")
+def simular_ocupacion(habitaciones, n_anos, n_trayectorias=N_TRAYECTORIAS, semilla=SEMILLA):
+    """Simulate `n_trayectorias` occupancy paths of every room over `n_anos` years.
+
+    `habitaciones` are Habitacion (or dicts). Returns a dict with, per path and year
+    (paths, years): `ingresos_anual` (rent collected), `gastos_anual` (running costs plus
+    turnover) and `rotaciones_anual` (departures over all rooms); and per room (rooms,):
+    `ocupacion` (mean fraction of the time let) and `rotaciones_anuales` (mean departures
+    per year). The months are reduced as they are walked, so memory does not grow with
+    rooms × months × paths.
+    """
+    renta, estancia, vacio, gastos, coste_rotacion = (np.array(p) for p in _parametros(habitaciones))
+    n_habitaciones, n_meses = len(renta), n_anos * 12
+    metricas.incrementar("trayectorias_ocupacion", n_trayectorias)
+    rng = np.random.default_rng(semilla)
+
+    p_salida = (1 / estancia)[:, None]
+    escala_vacio = np.broadcast_to(vacio[:, None], (n_habitaciones, n_trayectorias))
+    # Meses de vacío pendientes por habitación y trayectoria (0 = alquilada)
+    alquilada = rng.random((n_habitaciones, n_trayectorias)) < (estancia / (estancia + vacio))[:, None]
+    pendiente = np.where(alquilada, 0.0, rng.exponential(escala_vacio))
+
+    ingresos = np.zeros((n_trayectorias, n_anos))
+    costes_rotacion = np.zeros((n_trayectorias, n_anos))
+    rotaciones = np.zeros((n_trayectorias, n_anos))
+    ocupacion_habitacion = np.zeros(n_habitaciones)
+    salidas_habitacion = np.zeros(n_habitaciones)
+    for m in range(n_meses):
+        ano = m // 12
+        ocupacion = 1 - np.minimum(pendiente, 1.0)
+        pendiente = np.maximum(pendiente - 1, 0.0)
+        # Solo puede irse quien acaba el mes en la habitación
+        salidas = (pendiente == 0) & (rng.random((n_habitaciones, n_trayectorias)) < p_salida)
+        pendiente = np.where(salidas, rng.exponential(escala_vacio), pendiente)
+
+        ingresos[:, ano] += renta @ ocupacion
+        costes_rotacion[:, ano] += coste_rotacion @ salidas
+        rotaciones[:, ano] += salidas.sum(axis=0)
+        ocupacion_habitacion += ocupacion.sum(axis=1)
+        salidas_habitacion += salidas.sum(axis=1)
+
+    return {
+        "ingresos_anual": ingresos,
+        "gastos_anual": gastos.sum() + costes_rotacion,
+        "rotaciones_anual": rotaciones,
+        "ocupacion": ocupacion_habitacion / (n_meses * n_trayectorias),
+        "rotaciones_anuales": salidas_habitacion / (n_anos * n_trayectorias),
+    }
+
+
+@lru_cache(maxsize=32)
+def _simulacion(parametros, n_anos):
+    return simular_ocupacion(
+        [Habitacion(renta=r, estancia_media=e, vacio_medio=v, gastos=g, coste_rotacion=c)
+         for r, e, v, g, c in zip(*parametros)],
+        n_anos,
+    )
+
+
+metricas.registrar_cache("simulacion_habitaciones", _simulacion)
+
+
+def simulacion_habitaciones(habitaciones, n_anos):
+    """simular_ocupacion with the default paths and seed, cached by the room parameters and n_anos.
+
+    The arrays are shared between sessions: read them, do not modify them.
+    """
+    return _simulacion(_parametros(habitaciones), n_anos)
+
+
+@lru_cache(maxsize=256)
+def _resumen(parametros):
+    simulacion = _simulacion(parametros, ANOS_RESUMEN)
+    renta = np.array(parametros[0])
+    ingresos_completos = renta.sum() * 12
+    return {
+        "alquiler_mes": int(round(renta.sum())),
+        "vacio": round(float(100 * (1 - simulacion["ingresos_anual"].mean() / ingresos_completos)), 2)
+        if ingresos_completos else 0.0,
+        "gastos_habitaciones": int(round(simulacion["gastos_anual"].mean())),
+        "ocupacion": tuple(simulacion["ocupacion"].tolist()),
+        "rotaciones_anuales": tuple(simulacion["rotaciones_anuales"].tolist()),
+        "renta_efectiva": tuple((renta * simulacion["ocupacion"]).tolist()),
+    }
+
+
+metricas.registrar_cache("resumen_habitaciones", _resumen)
+
+
+def resumen_habitaciones(habitaciones):
+    """Expected figures of a set of rooms, from a simulation over ANOS_RESUMEN years.
+
+    Returns the scenario fields (see campos_escenario) plus per-room tuples:
+    `ocupacion` (fraction of the time let), `rotaciones_anuales` and `renta_efectiva`
+    (monthly rent net of vacancy). Cached by the room parameters.
+    """
+    return _resumen(_parametros(habitaciones))
+
+
+def campos_escenario(habitaciones):
+    """Scenario fields of the room model: alquiler_mes, vacio and gastos_habitaciones."""
+    resumen = resumen_habitaciones(habitaciones)
+    return {campo: resumen[campo] for campo in ("alquiler_mes", "vacio", "gastos_habitaciones")}
+
+
+@instrumentacion.instrumentado("flujos_habitaciones")
+def flujos_trayectorias(d, simulacion, anio_inicio=None):
+    """After-tax cash flow of scenario `d` on every path of simular_ocupacion.
+
+    The mortgage, fixed costs and taxes are those of `d`; the rent and the room costs
+    come from each path instead of alquiler_mes, vacio and gastos_habitaciones.
+    Returns (paths, years) arrays `flujo_anual` and `flujo_acumulado` (from minus the
+    initial investment).
+    """
+    ingresos = simulacion["ingresos_anual"]
+    n_trayectorias, n_anos = ingresos.shape
+    escenario = ScenarioSet.from_dicts([d])
+    c = {campo: float(columna[0]) for campo, columna in escenario.columnas.items() if columna.dtype != object}
+    base = escenario.results(n_anos=n_anos, anio_inicio=anio_inicio)
+
+    fijos = (
+        c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["seguro_vida"]
+        + c["comunidad"] + c["ibi"] + c["mantenimiento"]
+    )
+    fiscal = fiscalidad.irpf_anual(
+        ingresos=ingresos,
+        gastos_deducibles=(
+            c["seguro_impago"] + c["impuesto_basuras"] + c["seguro_hogar"] + c["comunidad"] + c["ibi"]
+            + simulacion["gastos_anual"]
+        ),
+        gastos_limitados=base["intereses_anual"] + c["mantenimiento"],
+        amortizacion=base["amortizacion_anual"][0],
+        reduccion_pct=base["reduccion_pct"][0],
+        irpf_marginal=c["irpf_marginal"],
+        otros_ingresos=c["otros_ingresos"],
+        anio_inicio=anio_inicio,
+    )
+    flujo_anual = (
+        ingresos - fijos - simulacion["gastos_anual"] - base["cuota_hipoteca_anual_anual"] - fiscal["irpf"]
+    )
+    return {
+        "flujo_anual": flujo_anual,
+        "flujo_acumulado": np.cumsum(flujo_anual, axis=1) - base["inversion_inicial"][0],
+    }
+
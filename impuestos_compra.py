@@ -0,0 +1,160 @@
+"""Regional purchase-tax (ITP, IVA/AJD) and notary/registry fee tables for Spain."""
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from fiscalidad import version_vigente
+
+INF = float("inf")
+
+COMUNIDADES_AUTONOMAS = {
+    "andalucia": "Andalucía",
+    "aragon": "Aragón",
+    "asturias": "Asturias",
+    "baleares": "Illes Balears",
+    "canarias": "Canarias",
+    "cantabria": "Cantabria",
+    "castilla_la_mancha": "Castilla-La Mancha",
+    "castilla_y_leon": "Castilla y León",
+    "cataluna": "Cataluña",
+    "extremadura": "Extremadura",
+    "galicia": "Galicia",
+    "madrid": "Comunidad de Madrid",
+    "murcia": "Región de Murcia",
+    "navarra": "Navarra",
+    "pais_vasco": "País Vasco",
+    "la_rioja": "La Rioja",
+    "valencia": "Comunitat Valenciana",
+    "ceuta": "Ceuta",
+    "melilla": "Melilla",
+}
+
+# Tablas por año de entrada en vigor. Para cada comunidad:
+#   itp: tramos (límite superior del precio, tipo %) aplicados por tramos sobre el precio
+#   itp_reducido: tipo % para compradores con derecho a tipo reducido (jóvenes, familia numerosa...)
+#   ajd: actos jurídicos documentados % en obra nueva
+#   iva: IVA (IGIC en Canarias) % en obra nueva
+TABLAS_COMPRA = {
+    2024: {
+        "andalucia": {"itp": ((INF, 7.0),), "itp_reducido": 3.5, "ajd": 1.2, "iva": 10.0},
+        "aragon": {"itp": ((400000, 8.0), (450000, 8.5), (500000, 9.0), (750000, 9.5), (INF, 10.0)), "itp_reducido": 3.0, "ajd": 1.5, "iva": 10.0},
+        "asturias": {"itp": ((300000, 8.0), (500000, 9.0), (INF, 10.0)), "itp_reducido": 3.0, "ajd": 1.2, "iva": 10.0},
+        "baleares": {"itp": ((400000, 8.0), (600000, 9.0), (1000000, 10.0), (2000000, 12.0), (INF, 13.0)), "itp_reducido": 5.0, "ajd": 1.2, "iva": 10.0},
+        "canarias": {"itp": ((INF, 6.5),), "itp_reducido": 5.0, "ajd": 0.75, "iva": 6.5},
+        "cantabria": {"itp": ((INF, 9.0),), "itp_reducido": 5.0, "ajd": 1.5, "iva": 10.0},
+        "castilla_la_mancha": {"itp": ((INF, 9.0),), "itp_reducido": 6.0, "ajd": 1.25, "iva": 10.0},
+        "castilla_y_leon": {"itp": ((250000, 8.0), (INF, 10.0)), "itp_reducido": 4.0, "ajd": 1.5, "iva": 10.0},
+        "cataluna": {"itp": ((1000000, 10.0), (INF, 11.0)), "itp_reducido": 5.0, "ajd": 1.5, "iva": 10.0},
+        "extremadura": {"itp": ((360000, 8.0), (600000, 10.0), (INF, 11.0)), "itp_reducido": 4.0, "ajd": 1.5, "iva": 10.0},
+        "galicia": {"itp": ((INF, 7.0),), "itp_reducido": 3.0, "ajd": 1.5, "iva": 10.0},
+        "madrid": {"itp": ((INF, 6.0),), "itp_reducido": 4.0, "ajd": 0.75, "iva": 10.0},
+        "murcia": {"itp": ((INF, 7.75),), "itp_reducido": 3.0, "ajd": 1.5, "iva": 10.0},
+        "navarra": {"itp": ((INF, 6.0),), "itp_reducido": 5.0, "ajd": 0.5, "iva": 10.0},
+        "pais_vasco": {"itp": ((INF, 4.0),), "itp_reducido": 2.5, "ajd": 0.5, "iva": 10.0},
+        "la_rioja": {"itp": ((INF, 7.0),), "itp_reducido": 5.0, "ajd": 1.0, "iva": 10.0},
+        "valencia": {"itp": ((1000000, 10.0), (INF, 11.0)), "itp_reducido": 8.0, "ajd": 1.5, "iva": 10.0},
+        "ceuta": {"itp": ((INF, 3.0),), "itp_reducido": 3.0, "ajd": 0.25, "iva": 0.5},
+        "melilla": {"itp": ((INF, 3.0),), "itp_reducido": 3.0, "ajd": 0.25, "iva": 0.5},
+    },
+}
+
+# Aranceles de notario (RD 1426/1989) y registro (RD 1427/1989): importe fijo del primer
+# tramo y tramos (límite superior del precio, tipo por mil) sobre el exceso.
+ARANCELES = {
+    1989: {
+        "notario": (90.15, ((6010.12, 0.0), (30050.61, 4.5), (60101.21, 1.5), (150253.03, 1.0), (601012.10, 0.5), (6010121.04, 0.3), (INF, 0.2))),
+        "registro": (24.04, ((6010.12, 0.0), (30050.61, 1.75), (60101.21, 1.25), (150253.03, 0.75), (601012.10, 0.3), (INF, 0.2))),
+    },
+}
+
+# Copias y folios de la escritura, gestoría y tasación (importes medios)
+GASTOS_FIJOS_COMPRA = {
+    2024: {"copias_notario": 250.0, "gestoria": 400.0, "tasacion": 400.0},
+}
+
+
+def _compilar_tramos(tramos_por_fila):
+    """Pad per-row bracket tuples into (rows, brackets) lower-limit, width and rate arrays."""
+    n_tramos = max(len(tramos) for tramos in tramos_por_fila)
+    inferiores = np.full((len(tramos_por_fila), n_tramos), INF)
+    anchos = np.zeros((len(tramos_por_fila), n_tramos))
+    tipos = np.zeros((len(tramos_por_fila), n_tramos))
+    for fila, tramos in enumerate(tramos_por_fila):
+        inferior = 0.0
+        for columna, (superior, tipo) in enumerate(tramos):
+            inferiores[fila, columna] = inferior
+            anchos[fila, columna] = superior - inferior
+            tipos[fila, columna] = tipo
+            inferior = superior
+    return inferiores, anchos, tipos
+
+
+def _aplicar_tramos(base, inferiores, anchos, tipos):
+    """Tax each slice of `base` falling in a bracket at that bracket's rate."""
+    with np.errstate(invalid="ignore"):
+        en_tramo = np.clip(base[:, None] - inferiores, 0.0, anchos)
+    return np.nansum(en_tramo * tipos, axis=1)
+
+
+@lru_cache(maxsize=None)
+def tabla_compra(version):
+    """Compile a regional table version into arrays indexed by community position."""
+    tabla = TABLAS_COMPRA[version]
+    codigos = tuple(tabla)
+    return {
+        "indice": {codigo: i for i, codigo in enumerate(codigos)},
+        "itp": _compilar_tramos([tabla[codigo]["itp"] for codigo in codigos]),
+        "itp_reducido": np.array([tabla[codigo]["itp_reducido"] for codigo in codigos]),
+        "ajd": np.array([tabla[codigo]["ajd"] for codigo in codigos]),
+        "iva": np.array([tabla[codigo]["iva"] for codigo in codigos]),
+    }
+
+
+@lru_cache(maxsize=None)
+def tabla_aranceles(version):
+    """Compile the notary and registry fee scales of a version into arrays."""
+    return {
+        nombre: (fijo, _compilar_tramos([tramos]))
+        for nombre, (fijo, tramos) in ARANCELES[version].items()
+    }
+
+
+def indices_comunidad(comunidad, version):
+    """Map community codes (scalar or array) to row indices of the compiled table."""
+    indice = tabla_compra(version)["indice"]
+    codigos = np.atleast_1d(np.asarray(comunidad, dtype=object))
+    try:
+        return np.fromiter((indice[codigo] for codigo in codigos), dtype=np.intp, count=len(codigos))
+    except KeyError as e:
+        raise ValueError(f"Comunidad autónoma desconocida: {e.args[0]}") from None
+
+
+def impuestos_compra(precio, comunidad, obra_nueva=False, tipo_reducido=False, anio=None):
+    """Purchase taxes in euros: ITP on second-hand homes, IVA + AJD on new builds."""
+    version = version_vigente(TABLAS_COMPRA, anio or datetime.now().year)
+    tabla = tabla_compra(version)
+    idx = indices_comunidad(comunidad, version)
+    precio = np.broadcast_to(np.asarray(precio, dtype=float), idx.shape)
+    obra_nueva = np.broadcast_to(np.asarray(obra_nueva, dtype=bool), idx.shape)
+    tipo_reducido = np.broadcast_to(np.asarray(tipo_reducido, dtype=bool), idx.shape)
+
+    inferiores, anchos, tipos = (arr[idx] for arr in tabla["itp"])
+    itp = np.where(
+        tipo_reducido,
+        precio * tabla["itp_reducido"][idx] / 100,
+        _aplicar_tramos(precio, inferiores, anchos, tipos) / 100,
+    )
+    iva_ajd = precio * (tabla["iva"][idx] + tabla["ajd"][idx]) / 100
+    return np.where(obra_nueva, iva_ajd, itp)
+
+
+def gastos_notaria_registro(precio, anio=None):
+    """Notary, registry, agency and valuation costs in euros for a purchase price."""
+    anio = anio or datetime.now().year
+    precio = np.atleast_1d(np.asarray(precio, dtype=float))
+    total = np.zeros(precio.shape)
+    for fijo, (inferiores, anchos, tipos) in tabla_aranceles(version_vigente(ARANCELES, anio)).values():
+        total += fijo + _aplicar_tramos(precio, inferiores, anchos, tipos) / 1000
+    total += sum(GASTOS_FIJOS_COMPRA[version_vigente(GASTOS_FIJOS_COMPRA, anio)].values())
+    return total
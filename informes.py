@@ -0,0 +1,285 @@
+"""Batch generator of printable HTML reports, one per saved scenario.
+
+Each report carries the scenario inputs, the results and after-tax breakdown blocks and
+the four result charts. Reports are rendered in a process pool (Plotly serialization is
+CPU-bound and would otherwise compete with the app for the GIL) and written to a
+timestamped folder with an index page. The app launches the same command line in a
+child process with lanzar_en_segundo_plano; by hand, pass the JSON exported from the app:
+
+    python informes.py escenarios.json --salida informes --trabajadores 4
+"""
+import argparse
+import html
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from plotly.offline import get_plotlyjs
+
+import plantillas
+import validacion
+from escenarios import Scenario, ScenarioSet
+from graficos import (
+    create_profit_over_time_chart, create_mortgage_breakdown_chart, create_net_worth_chart,
+    create_expense_breakdown_chart
+)
+
+CARPETA_INFORMES = os.environ.get("CALCULADORA_INFORMES", "informes")
+FICHERO_PLOTLY = "plotly.min.js"
+
+ETIQUETAS_DATOS = {
+    "precio_compra": "Precio de compra",
+    "reformas": "Reformas",
+    "comision_agencia": "Comisión agencia",
+    "gastos_compra": "Notaría, registro y gestoría",
+    "itp_iva": "ITP / IVA",
+    "comunidad_autonoma": "Comunidad autónoma",
+    "alquiler_mes": "Alquiler mensual",
+    "vacio": "Periodos vacío (%)",
+    "entrada": "Entrada",
+    "tin": "TIN (%)",
+    "hipoteca_anos": "Años hipoteca",
+    "irpf_marginal": "IRPF marginal (%)",
+    "otros_ingresos": "Otros ingresos anuales",
+    "reduccion_pct": "Reducción por alquiler (%)",
+    "valor_construccion_pct": "Valor construcción (%)",
+    "seguro_impago": "Seguro impago",
+    "impuesto_basuras": "Impuesto basuras",
+    "seguro_hogar": "Seguro hogar",
+    "seguro_vida": "Seguro vida",
+    "comunidad": "Comunidad",
+    "ibi": "IBI",
+    "mantenimiento": "Mantenimiento",
+    "gastos_habitaciones": "Gastos habitaciones",
+    "gastos_limpieza": "Limpieza",
+    "comision_plataforma": "Comisión plataforma",
+}
+CAMPOS_EUROS = {
+    "precio_compra", "reformas", "comision_agencia", "gastos_compra", "itp_iva", "alquiler_mes", "entrada",
+    "otros_ingresos", "seguro_impago", "impuesto_basuras", "seguro_hogar", "seguro_vida", "comunidad", "ibi",
+    "mantenimiento", "gastos_habitaciones", "gastos_limpieza", "comision_plataforma",
+}
+
+ESTILOS_INFORME = """
+body { font-family: sans-serif; max-width: 900px; margin: 2em auto; color: #222; }
+h1 { color: #1a237e; margin-bottom: 0; }
+.generado { color: #777; font-size: 0.9em; margin-bottom: 1.5em; }
+table.datos { border-collapse: collapse; width: 100%; margin-bottom: 1em; }
+table.datos th, table.datos td { border-bottom: 1px solid #ddd; padding: 4px 8px; text-align: left; }
+table.datos td { text-align: right; }
+.grafico { page-break-inside: avoid; break-inside: avoid; margin-bottom: 1em; }
+@media print { body { margin: 0; max-width: none; } h2 { page-break-after: avoid; } }
+"""
+
+
+def _slug(nombre):
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", nombre).strip("_") or "escenario"
+
+
+def _valor_dato(campo, valor):
+    if valor is None:
+        return "—"
+    if isinstance(valor, bool):
+        return "Sí" if valor else "No"
+    if campo in CAMPOS_EUROS:
+        return plantillas.format_number(valor)
+    return str(valor)
+
+
+def renderizar_informe(nombre, d):
+    """Full HTML document for one scenario (expects plotly.min.js next to it)."""
+    res = Scenario.from_dict(d).results()
+    resultado_html, calculo_detalle, beneficio_neto_html = plantillas.bloques_resultados(d, res)
+
+    figuras = [
+        create_net_worth_chart(d, res),
+        create_profit_over_time_chart(d, res),
+        create_mortgage_breakdown_chart(d),
+        create_expense_breakdown_chart(res),
+    ]
+    graficos_html = "".join(
+        plantillas.GRAFICO_INFORME.substitute(grafico=fig.to_html(full_html=False, include_plotlyjs=False))
+        for fig in figuras if fig is not None
+    )
+
+    filas = "".join(
+        plantillas.FILA_DATO.substitute(campo=etiqueta, valor=_valor_dato(campo, d.get(campo)))
+        for campo, etiqueta in ETIQUETAS_DATOS.items() if campo in d
+    )
+    return plantillas.INFORME.substitute(
+        titulo=f"Informe de inversión: {html.escape(nombre)}",
+        fecha=datetime.now().strftime("%Y-%m-%d %H:%M"),
+        estilos=plantillas.estilos_css(),
+        estilos_informe=ESTILOS_INFORME,
+        plotly_js=FICHERO_PLOTLY,
+        filas_datos=filas,
+        resultados=resultado_html,
+        detalle=calculo_detalle,
+        beneficio_neto=beneficio_neto_html,
+        graficos=graficos_html,
+    )
+
+
+def escribir_informe(nombre, d, ruta):
+    """Render one report to `ruta` (worker entry point); returns the path."""
+    documento = renderizar_informe(nombre, d)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(documento)
+    return ruta
+
+
+def _preparar_carpeta(carpeta):
+    destino = os.path.join(carpeta, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(destino, exist_ok=True)
+    with open(os.path.join(destino, FICHERO_PLOTLY), "w", encoding="utf-8") as f:
+        f.write(get_plotlyjs())
+    return destino
+
+
+def _escribir_indice(destino, rutas, errores):
+    enlaces = "".join(
+        f"<li><a href='{os.path.basename(ruta)}'>{html.escape(nombre)}</a></li>" for nombre, ruta in sorted(rutas.items())
+    )
+    fallos = "".join(f"<li>{html.escape(nombre)}: {html.escape(error)}</li>" for nombre, error in sorted(errores.items()))
+    with open(os.path.join(destino, "index.html"), "w", encoding="utf-8") as f:
+        f.write(
+            f"<!DOCTYPE html><html lang='es'><head><meta charset='utf-8'><title>Informes</title></head>"
+            f"<body><h1>Informes ({len(rutas)})</h1><ul>{enlaces}</ul>"
+            + (f"<h2>Errores ({len(errores)})</h2><ul>{fallos}</ul>" if errores else "")
+            + "</body></html>"
+        )
+
+
+def generar_informes(escenarios, carpeta=CARPETA_INFORMES, trabajadores=None, procesos=True, progreso=None):
+    """Write one report per scenario in a pool; returns (folder, {name: path}, {name: error}).
+
+    `escenarios` maps names to input dicts (or to the app's {"data": ..., "timestamp": ...}
+    entries). `progreso(hechos, total, nombre)` is called as each report finishes; a failing
+    scenario is recorded in the errors and does not stop the others; scenarios breaking
+    a validacion INVALIDO rule are reported without rendering.
+    """
+    destino = _preparar_carpeta(carpeta)
+    datos = {nombre: entrada.get("data", entrada) for nombre, entrada in escenarios.items()}
+    revision = validacion.validar_lote(ScenarioSet.from_dicts(datos.values()).columnas)
+    invalidos = revision.invalidos
+    trabajos = {}
+    rutas, errores = {}, {}
+    usados = set()
+    for i, (nombre, d) in enumerate(datos.items()):
+        if invalidos[i]:
+            errores[nombre] = "; ".join(revision.mensajes(i)[0])
+            continue
+        slug = _slug(nombre)
+        while slug in usados:
+            slug += "_"
+        usados.add(slug)
+        trabajos[nombre] = (d, os.path.join(destino, f"{slug}.html"))
+
+    pool = ProcessPoolExecutor(trabajadores) if procesos else ThreadPoolExecutor(trabajadores)
+
+    with pool:
+        futuros = {pool.submit(escribir_informe, nombre, d, ruta): nombre for nombre, (d, ruta) in trabajos.items()}
+        # Los escenarios inválidos cuentan como ya procesados
+        for hechos, futuro in enumerate(as_completed(futuros), start=len(errores) + 1):
+            nombre = futuros[futuro]
+            try:
+                rutas[nombre] = futuro.result()
+            except Exception as e:
+                errores[nombre] = f"{type(e).__name__}: {e}"
+            if progreso:
+                progreso(hechos, len(datos), nombre)
+
+    _escribir_indice(destino, rutas, errores)
+    return destino, rutas, errores
+
+
+class TrabajoInformes:
+    """Progress of a background report job, polled by the app."""
+
+    __slots__ = ("total", "hechos", "ultimo", "carpeta", "rutas", "errores", "error", "terminado")
+
+    def __init__(self, total):
+        self.total = total
+        self.hechos = 0
+        self.ultimo = None
+        self.carpeta = None
+        self.rutas = {}
+        self.errores = {}
+        self.error = None
+        self.terminado = False
+
+
+def lanzar_en_segundo_plano(escenarios, carpeta=CARPETA_INFORMES, trabajadores=None):
+    """Run this module's CLI in a child process and return a TrabajoInformes tracking it.
+
+    A separate interpreter keeps the process pool away from the Streamlit server: its
+    workers would otherwise re-import the app script as their __main__.
+    """
+    trabajo = TrabajoInformes(len(escenarios))
+    with tempfile.NamedTemporaryFile("w", suffix=".json", encoding="utf-8", delete=False) as f:
+        json.dump(escenarios, f, ensure_ascii=False)
+    comando = [sys.executable, os.path.abspath(__file__), f.name, "--salida", carpeta, "--progreso-json"]
+    if trabajadores:
+        comando += ["--trabajadores", str(trabajadores)]
+
+    def seguir():
+        try:
+            with tempfile.TemporaryFile("w+", encoding="utf-8") as errores_proceso:
+                proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=errores_proceso, text=True)
+                for linea in proceso.stdout:
+                    evento = json.loads(linea)
+                    if "hechos" in evento:
+                        trabajo.hechos, trabajo.ultimo = evento["hechos"], evento["nombre"]
+                    else:
+                        trabajo.carpeta, trabajo.rutas, trabajo.errores = evento["carpeta"], evento["rutas"], evento["errores"]
+                if proceso.wait() != 0:
+                    errores_proceso.seek(0)
+                    ultimas = errores_proceso.read().strip().splitlines()
+                    trabajo.error = ultimas[-1] if ultimas else f"código de salida {proceso.returncode}"
+        except (OSError, ValueError) as e:
+            trabajo.error = f"{type(e).__name__}: {e}"
+        finally:
+            os.unlink(f.name)
+            trabajo.terminado = True
+
+    threading.Thread(target=seguir, name="informes", daemon=True).start()
+    return trabajo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un informe HTML imprimible por escenario")
+    parser.add_argument("escenarios", help="JSON de escenarios exportado desde la app")
+    parser.add_argument("--salida", default=CARPETA_INFORMES, help="Carpeta de salida")
+    parser.add_argument("--trabajadores", type=int, default=None, help="Procesos en paralelo")
+    parser.add_argument("--hilos", action="store_true", help="Usar hilos en lugar de procesos")
+    parser.add_argument("--progreso-json", action="store_true", help="Progreso como líneas JSON (para la app)")
+    args = parser.parse_args()
+
+    with open(args.escenarios, encoding="utf-8") as f:
+        escenarios = json.load(f)
+
+    def progreso(hechos, total, nombre):
+        if args.progreso_json:
+            print(json.dumps({"hechos": hechos, "total": total, "nombre": nombre}, ensure_ascii=False), flush=True)
+        else:
+            print(f"[{hechos}/{total}] {nombre}", flush=True)
+
+    destino, rutas, errores = generar_informes(
+        escenarios, args.salida, args.trabajadores, procesos=not args.hilos, progreso=progreso
+    )
+    if args.progreso_json:
+        print(json.dumps({"carpeta": destino, "rutas": rutas, "errores": errores}, ensure_ascii=False), flush=True)
+        return
+    print(f"{len(rutas)} informes en {destino}")
+    for nombre, error in errores.items():
+        print(f"Error en {nombre}: {error}")
+
+
+if __name__ == "__main__":
+    main()
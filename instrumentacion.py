@@ -0,0 +1,176 @@
+"""Timing spans and allocation counters for each Streamlit rerun.
+
+Call counts and total time per span are always collected (a perf_counter pair and a
+dict update). The first rerun of each process is also recorded as `primer_rerun`, the
+cold-start cost a new server worker pays before its first page, measured from the
+import of this module so the app's top-level imports count. Allocated-block counts
+per span and the structured JSON log are only enabled in detailed mode, via
+CALCULADORA_PERFIL=1 or per rerun with iniciar_rerun(detallado=True). tracemalloc slows
+down every session of the process, so byte counts are only traced when the process
+starts with CALCULADORA_PERFIL=1.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+PERFIL_DETALLADO = os.environ.get("CALCULADORA_PERFIL", "") == "1"
+RUTA_LOG_PERFIL = os.environ.get("CALCULADORA_PERFIL_LOG", "perfil_reruns.jsonl")
+
+logger = logging.getLogger("calculadora.perfil")
+
+# Streamlit runs each session's script in its own thread
+_estado = threading.local()
+_lock = threading.Lock()
+_totales = {}
+_observadores = []
+_primer_rerun_pendiente = True
+# El primer rerun se mide desde la carga de este módulo: la primera línea de la app
+_carga_modulo = time.perf_counter()
+
+
+def registrar_observador(funcion):
+    """Call funcion(nombre, segundos) every time a span or a rerun finishes."""
+    if funcion not in _observadores:
+        _observadores.append(funcion)
+
+
+def _notificar(nombre, segundos):
+    for observador in _observadores:
+        observador(nombre, segundos)
+
+
+def iniciar_rerun(detallado=None):
+    """Start collecting spans for the rerun running in this thread."""
+    _estado.tramos = []
+    _estado.pila = []
+    _estado.detallado = PERFIL_DETALLADO if detallado is None else detallado
+    _estado.inicio = time.perf_counter()
+    # tracemalloc afecta a todas las sesiones del proceso: solo con CALCULADORA_PERFIL=1
+    if PERFIL_DETALLADO and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def iniciar_tramo(nombre):
+    """Open a span; returns a token to pass to cerrar_tramo."""
+    pila = getattr(_estado, "pila", None)
+    padre = pila[-1] if pila else None
+    if pila is not None:
+        pila.append(nombre)
+    if getattr(_estado, "detallado", False):
+        memoria = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        return nombre, padre, time.perf_counter(), sys.getallocatedblocks(), memoria
+    return nombre, padre, time.perf_counter(), None, None
+
+
+def cerrar_tramo(token):
+    """Close a span opened with iniciar_tramo and record it."""
+    nombre, padre, inicio, bloques, memoria = token
+    segundos = time.perf_counter() - inicio
+    with _lock:
+        total = _totales.setdefault(nombre, [0, 0.0])
+        total[0] += 1
+        total[1] += segundos
+    _notificar(nombre, segundos)
+
+    tramos = getattr(_estado, "tramos", None)
+    if tramos is None:
+        return
+    if _estado.pila and _estado.pila[-1] == nombre:
+        _estado.pila.pop()
+    tramo = {"tramo": nombre, "padre": padre, "ms": segundos * 1000}
+    if bloques is not None:
+        tramo["bloques"] = sys.getallocatedblocks() - bloques
+        if tracemalloc.is_tracing():
+            tramo["bytes"] = tracemalloc.get_traced_memory()[0] - memoria
+    tramos.append(tramo)
+
+
+@contextmanager
+def medir(nombre):
+    """Context manager recording a span around a block."""
+    token = iniciar_tramo(nombre)
+    try:
+        yield
+    finally:
+        cerrar_tramo(token)
+
+
+def instrumentado(nombre):
+    """Decorator recording a span around every call of a function."""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            token = iniciar_tramo(nombre)
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                cerrar_tramo(token)
+        return envoltura
+    return decorador
+
+
+def tramos_rerun():
+    """Spans recorded so far in the current rerun."""
+    return list(getattr(_estado, "tramos", []))
+
+
+def contadores():
+    """Snapshot of the always-on counters: calls, total and mean milliseconds per span."""
+    with _lock:
+        return {
+            nombre: {"llamadas": llamadas, "ms_total": segundos * 1000, "ms_medio": segundos * 1000 / llamadas}
+            for nombre, (llamadas, segundos) in _totales.items()
+        }
+
+
+def _configurar_log():
+    if not logger.handlers:
+        manejador = logging.FileHandler(RUTA_LOG_PERFIL, encoding="utf-8")
+        manejador.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(manejador)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def finalizar_rerun(**contexto):
+    """Close the current rerun, update the rerun counter and log it in detailed mode."""
+    inicio = getattr(_estado, "inicio", None)
+    if inicio is None:
+        return None
+    global _primer_rerun_pendiente
+    fin = time.perf_counter()
+    segundos = fin - inicio
+    with _lock:
+        total = _totales.setdefault("rerun", [0, 0.0])
+        total[0] += 1
+        total[1] += segundos
+        primer_rerun, _primer_rerun_pendiente = _primer_rerun_pendiente, False
+    _notificar("rerun", segundos)
+    if primer_rerun:
+        # Arranque en frío del proceso: el primer rerun carga la app y sus dependencias,
+        # desde la importación de este módulo (antes de iniciar_rerun)
+        arranque = fin - min(inicio, _carga_modulo)
+        with _lock:
+            _totales["primer_rerun"] = [1, arranque]
+        _notificar("primer_rerun", arranque)
+        contexto["primer_rerun"] = True
+        contexto["ms_arranque"] = arranque * 1000
+
+    registro = {
+        "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+        "ms": segundos * 1000,
+        "tramos": tramos_rerun(),
+        **contexto,
+    }
+    if _estado.detallado:
+        _configurar_log()
+        logger.info(json.dumps(registro, ensure_ascii=False))
+    _estado.inicio = None
+    return registro
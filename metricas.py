@@ -0,0 +1,224 @@
+"""Process-wide metrics exported in Prometheus text format.
+
+Rerun and span latencies arrive through the instrumentacion observer hook. The
+exporter is opt-in: CALCULADORA_METRICAS_PUERTO serves /metrics over HTTP on
+localhost and CALCULADORA_METRICAS_FICHERO rewrites a text file every few seconds,
+for node_exporter's textfile collector or plain tailing.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import instrumentacion
+
+PREFIJO = "calculadora"
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+VENTANA_SESION_ACTIVA = 300
+INTERVALO_FICHERO = 15
+
+logger = logging.getLogger("calculadora.metricas")
+
+_lock = threading.Lock()
+_histogramas = {}
+_contadores = {}
+_caches = {}
+_sesiones = {}
+_exportador_http = False
+_exportador_fichero = False
+
+
+class Histograma:
+    """Cumulative-bucket latency histogram."""
+
+    __slots__ = ("cubetas", "conteos", "suma", "total")
+
+    def __init__(self, cubetas=CUBETAS_SEGUNDOS):
+        self.cubetas = cubetas
+        self.conteos = [0] * len(cubetas)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        indice = bisect.bisect_left(self.cubetas, valor)
+        if indice < len(self.conteos):
+            self.conteos[indice] += 1
+        self.suma += valor
+        self.total += 1
+
+
+def observar_latencia(nombre, segundos):
+    """Record a finished span or rerun (instrumentacion observer)."""
+    with _lock:
+        histograma = _histogramas.get(nombre)
+        if histograma is None:
+            histograma = _histogramas[nombre] = Histograma()
+        histograma.observar(segundos)
+
+
+def incrementar(nombre, cantidad=1):
+    """Increase a named counter."""
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+
+
+def registrar_cache(nombre, funcion):
+    """Expose hit/miss statistics of an lru_cache-decorated function."""
+    _caches[nombre] = funcion
+
+
+def _purgar_sesiones(ahora):
+    # Llamar con _lock tomado
+    limite = ahora - VENTANA_SESION_ACTIVA
+    for id_sesion in [i for i, (visto, *_) in _sesiones.items() if visto < limite]:
+        del _sesiones[id_sesion]
+
+
+def registrar_sesion(id_sesion, escenarios_guardados, bytes_residentes=0):
+    """Mark a session as active and record the size of its scenario store.
+
+    Sessions idle for VENTANA_SESION_ACTIVA are dropped here too, so the registry stays
+    bounded when nothing exports it.
+    """
+    ahora = time.time()
+    with _lock:
+        _purgar_sesiones(ahora)
+        _sesiones[id_sesion] = (ahora, escenarios_guardados, bytes_residentes)
+
+
+def _sesiones_activas():
+    with _lock:
+        _purgar_sesiones(time.time())
+        return list(_sesiones.values())
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def exportar_prometheus():
+    """Render all metrics in Prometheus text exposition format (version 0.0.4)."""
+    lineas = []
+
+    with _lock:
+        histogramas = {
+            nombre: (h.cubetas, list(h.conteos), h.suma, h.total) for nombre, h in _histogramas.items()
+        }
+        contadores = dict(_contadores)
+
+    def histograma(metrica, etiquetas, datos):
+        cubetas, conteos, suma, total = datos
+        acumulado = 0
+        for limite, conteo in zip(cubetas, conteos):
+            acumulado += conteo
+            lineas.append(f'{metrica}_bucket{{{etiquetas}le="{limite}"}} {acumulado}')
+        lineas.append(f'{metrica}_bucket{{{etiquetas}le="+Inf"}} {total}')
+        sufijo = f"{{{etiquetas.rstrip(',')}}}" if etiquetas else ""
+        lineas.append(f"{metrica}_sum{sufijo} {suma}")
+        lineas.append(f"{metrica}_count{sufijo} {total}")
+
+    metrica = f"{PREFIJO}_rerun_segundos"
+    lineas.append(f"# HELP {metrica} Duración de cada rerun completo del script.")
+    lineas.append(f"# TYPE {metrica} histogram")
+    if "rerun" in histogramas:
+        histograma(metrica, "", histogramas["rerun"])
+
+    metrica = f"{PREFIJO}_tramo_segundos"
+    lineas.append(f"# HELP {metrica} Duración de cada tramo instrumentado (cálculos, gráficos, HTML).")
+    lineas.append(f"# TYPE {metrica} histogram")
+    for nombre, datos in sorted(histogramas.items()):
+        if nombre != "rerun":
+            histograma(metrica, f'tramo="{_escapar(nombre)}",', datos)
+
+    metrica = f"{PREFIJO}_eventos_total"
+    lineas.append(f"# HELP {metrica} Contadores de eventos (escenarios calculados, etc.).")
+    lineas.append(f"# TYPE {metrica} counter")
+    for nombre, valor in sorted(contadores.items()):
+        lineas.append(f'{metrica}{{evento="{_escapar(nombre)}"}} {valor}')
+
+    lineas.append(f"# HELP {PREFIJO}_cache_consultas_total Consultas a cachés en memoria por resultado.")
+    lineas.append(f"# TYPE {PREFIJO}_cache_consultas_total counter")
+    lineas.append(f"# HELP {PREFIJO}_cache_ratio_aciertos Proporción de aciertos de cada caché.")
+    lineas.append(f"# TYPE {PREFIJO}_cache_ratio_aciertos gauge")
+    for nombre, funcion in sorted(_caches.items()):
+        info = funcion.cache_info()
+        consultas = info.hits + info.misses
+        etiqueta = _escapar(nombre)
+        lineas.append(f'{PREFIJO}_cache_consultas_total{{cache="{etiqueta}",resultado="acierto"}} {info.hits}')
+        lineas.append(f'{PREFIJO}_cache_consultas_total{{cache="{etiqueta}",resultado="fallo"}} {info.misses}')
+        lineas.append(f'{PREFIJO}_cache_ratio_aciertos{{cache="{etiqueta}"}} {info.hits / consultas if consultas else 0}')
+
+    sesiones = _sesiones_activas()
+    escenarios = [n for _, n, _ in sesiones]
+    residentes = [b for _, _, b in sesiones]
+    lineas.append(f"# HELP {PREFIJO}_sesiones_activas Sesiones con actividad en los últimos {VENTANA_SESION_ACTIVA} s.")
+    lineas.append(f"# TYPE {PREFIJO}_sesiones_activas gauge")
+    lineas.append(f"{PREFIJO}_sesiones_activas {len(sesiones)}")
+    lineas.append(f"# HELP {PREFIJO}_escenarios_guardados Escenarios guardados en las sesiones activas.")
+    lineas.append(f"# TYPE {PREFIJO}_escenarios_guardados gauge")
+    lineas.append(f'{PREFIJO}_escenarios_guardados{{agregado="total"}} {sum(escenarios)}')
+    lineas.append(f'{PREFIJO}_escenarios_guardados{{agregado="max_sesion"}} {max(escenarios, default=0)}')
+    lineas.append(f"# HELP {PREFIJO}_memoria_sesiones_bytes Bytes de escenarios residentes en memoria por las sesiones activas.")
+    lineas.append(f"# TYPE {PREFIJO}_memoria_sesiones_bytes gauge")
+    lineas.append(f'{PREFIJO}_memoria_sesiones_bytes{{agregado="total"}} {sum(residentes)}')
+    lineas.append(f'{PREFIJO}_memoria_sesiones_bytes{{agregado="max_sesion"}} {max(residentes, default=0)}')
+
+    return "\n".join(lineas) + "\n"
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _escribir_fichero(ruta):
+    while True:
+        temporal = f"{ruta}.tmp"
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                f.write(exportar_prometheus())
+            os.replace(temporal, ruta)
+        except Exception:
+            # Un fallo puntual (disco lleno, carpeta borrada) no debe parar el hilo
+            logger.exception("No se pudieron escribir las métricas en %s", ruta)
+        time.sleep(INTERVALO_FICHERO)
+
+
+def iniciar_exportador(puerto=None, fichero=None):
+    """Start the HTTP and/or file exporters once per process (no-op if neither is configured).
+
+    Each exporter starts on its own: a busy port does not stop the file exporter, and
+    the port is tried again on the next call.
+    """
+    global _exportador_http, _exportador_fichero
+    puerto = puerto or os.environ.get("CALCULADORA_METRICAS_PUERTO")
+    fichero = fichero or os.environ.get("CALCULADORA_METRICAS_FICHERO")
+    with _lock:
+        if fichero and not _exportador_fichero:
+            threading.Thread(target=_escribir_fichero, args=(fichero,), name="metricas-fichero", daemon=True).start()
+            _exportador_fichero = True
+        if puerto and not _exportador_http:
+            try:
+                servidor = ThreadingHTTPServer(("127.0.0.1", int(puerto)), _ManejadorMetricas)
+            except OSError as e:
+                # Puerto ocupado: la app sigue sin exportador HTTP y se reintenta en el próximo rerun
+                logger.error("No se pudo abrir el exportador de métricas en el puerto %s: %s", puerto, e)
+                return
+            threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+            _exportador_http = True
+
+
+instrumentacion.registrar_observador(observar_latencia)
@@ -0,0 +1,167 @@
+"""Precompiled HTML templates for the result blocks.
+
+Styling lives in static/estilos.css as classes, so the HTML sent on every rerun only
+carries the figures. Templates are compacted to a single line once at import.
+"""
+import hashlib
+import os
+import re
+from functools import lru_cache
+from string import Template
+
+RUTA_ESTILOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "estilos.css")
+
+
+def format_number(val):
+    # Formatea siempre con separador de miles y sin decimales
+    return f"{val:,.0f} €".replace(",", ".")  # Si quieres punto como separador de miles
+
+
+def _compilar(html):
+    return Template(re.sub(r">\s*\n\s*", ">", html.strip()))
+
+
+@lru_cache(maxsize=1)
+def estilos_css():
+    """Contents of the stylesheet, read once per process."""
+    with open(RUTA_ESTILOS, encoding="utf-8") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=1)
+def version_estilos():
+    """Short content hash used to bust the browser cache when the stylesheet changes."""
+    return hashlib.sha1(estilos_css().encode("utf-8")).hexdigest()[:10]
+
+
+CUOTA_MENSUAL = _compilar("""
+<div class='caja-cuota'><b>Cuota mensual:</b> <span class='importe'>$cuota</span></div>
+""")
+
+RESULTADOS = _compilar("""
+<div class='caja caja-inversion'>
+💼 <b>Total inversión inicial:</b> <span class='importe'>$inversion</span>
+</div>
+<div class='caja caja-ingresos'>
+📈 <b>Ingresos anuales por alquiler:</b> <span class='importe'>$ingresos</span>
+</div>
+<div class='caja caja-gastos'>
+<div class='titulo'>Gastos anuales desglosados:</div>
+<ul>$lineas_gastos</ul>
+<div class='total'>Total gastos anuales: <span class='importe'>$gastos_total</span></div>
+</div>
+<div class='caja caja-rentabilidad'>
+<span class='titulo'>Rentabilidad anual antes de impuestos:</span>
+<span class='importe'>$beneficio_antes</span>
+<div class='nota'>Es el beneficio anual antes de impuestos y amortización.</div>
+</div>
+""")
+
+LINEA_GASTO = _compilar("<li>$nombre: <b>$importe</b></li>")
+
+DETALLE = _compilar("""
+<div class='caja caja-detalle'>
+<span class='titulo'>Cálculo del beneficio después de impuestos (primer año):</span>
+<ul>
+<li>= Beneficio antes de impuestos: <b>$beneficio_antes</b></li>
+<li>+ Capital de hipoteca amortizado y gastos no deducibles: <b>$no_deducibles</b></li>
+<li>- Amortización anual deducible: <b>$amortizacion</b></li>
+<li>= Rendimiento neto fiscal: <b>$rendimiento_neto</b></li>
+$linea_reduccion
+<li>= Base sujeta a IRPF: <b>$base_sujeta</b></li>
+$linea_irpf
+<li>= IRPF estimado: <b>$irpf</b></li>
+<li>= Beneficio anual después de impuestos: <b>$beneficio_despues</b></li>
+</ul>
+<div class='nota'>Solo los intereses de la hipoteca son deducibles; al bajar cada año, el IRPF de los años siguientes cambia (ver gráfico de beneficios).</div>
+</div>
+""")
+
+LINEA_REDUCCION = _compilar("<li>- Reducción del $porcentaje% por alquiler de vivienda: <b>$reduccion</b></li>")
+LINEA_SIN_REDUCCION = (
+    "<li><span class='aviso-rojo'>No se aplica reducción porque el alquiler es de habitaciones "
+    "o no es vivienda habitual.</span></li>"
+)
+LINEA_IRPF_MARGINAL = _compilar("<li>x Tipo marginal IRPF: <b>$tipo %</b></li>")
+LINEA_IRPF_TRAMOS = _compilar("<li>x Tramos progresivos IRPF sobre otros ingresos de <b>$otros_ingresos</b></li>")
+
+BENEFICIO_NETO = _compilar("""
+<div class='caja caja-neto'>
+<span class='titulo'>Beneficio anual neto:</span>
+<span class='importe'>$beneficio_neto</span>
+</div>
+<div class='rentabilidad-neta'><b>Rentabilidad neta sobre la inversión inicial:</b> $rentabilidad %</div>
+""")
+
+ENLACE_SECCION = _compilar("<a class='enlace-boton' href='#$seccion' target='_self'>$texto</a>")
+
+INFORME = _compilar("""
+<!DOCTYPE html>
+<html lang='es'>
+<head>
+<meta charset='utf-8'>
+<title>$titulo</title>
+<style>$estilos</style>
+<style>$estilos_informe</style>
+<script src='$plotly_js'></script>
+</head>
+<body>
+<h1>$titulo</h1>
+<div class='generado'>Generado el $fecha</div>
+<h2>Datos del escenario</h2>
+<table class='datos'>$filas_datos</table>
+<h2>Resultados</h2>
+$resultados
+$detalle
+$beneficio_neto
+<h2>Gráficos</h2>
+$graficos
+</body>
+</html>
+""")
+
+FILA_DATO = _compilar("<tr><th>$campo</th><td>$valor</td></tr>")
+GRAFICO_INFORME = _compilar("<div class='grafico'>$grafico</div>")
+
+
+def bloques_resultados(d, res):
+    """HTML for the main results, the after-tax breakdown and the net profit box."""
+    if d['aplica_reduccion_60']:
+        linea_reduccion = LINEA_REDUCCION.substitute(
+            porcentaje=f"{res['reduccion_pct']:.0f}", reduccion=format_number(res['reduccion'])
+        )
+    else:
+        linea_reduccion = LINEA_SIN_REDUCCION
+
+    if d.get('otros_ingresos') is None:
+        linea_irpf = LINEA_IRPF_MARGINAL.substitute(tipo=f"{d['irpf_marginal']:.1f}")
+    else:
+        linea_irpf = LINEA_IRPF_TRAMOS.substitute(otros_ingresos=format_number(d['otros_ingresos']))
+
+    no_deducibles = res["beneficio_AI_amort"] + res["amortizacion_anual"] - res["beneficio_AI"]
+    calculo_detalle = DETALLE.substitute(
+        beneficio_antes=format_number(res["beneficio_AI"]),
+        no_deducibles=format_number(no_deducibles),
+        amortizacion=format_number(res["amortizacion_anual"]),
+        rendimiento_neto=format_number(res["beneficio_AI_amort"]),
+        linea_reduccion=linea_reduccion,
+        base_sujeta=format_number(res["base_imponible"]),
+        linea_irpf=linea_irpf,
+        irpf=format_number(res["irpf"]),
+        beneficio_despues=format_number(res["beneficio_DI"]),
+    )
+
+    resultado_html = RESULTADOS.substitute(
+        inversion=format_number(res["inversion_inicial"]),
+        ingresos=format_number(res["ingresos_anuales"]),
+        lineas_gastos="".join(
+            LINEA_GASTO.substitute(nombre=name, importe=format_number(val)) for name, val in res["gastos_dict"]
+        ),
+        gastos_total=format_number(res["gastos_anuales"]),
+        beneficio_antes=format_number(res["beneficio_AI"]),
+    )
+
+    beneficio_neto = BENEFICIO_NETO.substitute(
+        beneficio_neto=format_number(res["beneficio_DI"]), rentabilidad=f"{res['rentabilidad_neta_real']:.2f}"
+    )
+    return resultado_html, calculo_detalle, beneficio_neto
@@ -0,0 +1,103 @@
+"""Precomputed response curves for the what-if sliders.
+
+precalcular evaluates a scenario over a grid of its four levers (PALANCAS: rent, TIN,
+vacancy and purchase price) in one calcular_resultados_lote call and keeps the
+METRICAS at every node. The grid crosses all levers, so interactions (a higher TIN
+on a dearer flat) are covered, not only one lever at a time. Each axis also contains
+the scenario's own value, so the untouched sliders reproduce its results exactly.
+
+Respuesta.consultar answers a slider move by multilinear interpolation between the
+2^4 surrounding nodes: microseconds of array work instead of a full recalculation.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+import instrumentacion
+from calculos import calcular_resultados_lote
+from escenarios import ScenarioSet
+from venta import tir_venta
+
+PUNTOS = 9
+ANOS_VENTA = 10
+METRICAS = ("beneficio_DI", "beneficio_total", "rentabilidad_neta_real", "cuota_mensual", "tir")
+
+
+@dataclass(frozen=True, slots=True)
+class Palanca:
+    """One slider: `rango(valor)` gives its (min, max) around the scenario's value."""
+
+    campo: str
+    etiqueta: str
+    paso: float
+    rango: Callable
+
+
+PALANCAS = (
+    Palanca("alquiler_mes", "Renta mensual (€)", 10.0, lambda v: (0.7 * v, 1.3 * v)),
+    Palanca("tin", "TIN (%)", 0.05, lambda v: (max(0.0, v - 2), v + 3)),
+    Palanca("vacio", "Periodos vacíos (%)", 0.5, lambda v: (0.0, min(100.0, max(25.0, 2 * v)))),
+    Palanca("precio_compra", "Precio de compra (€)", 1000.0, lambda v: (0.8 * v, 1.2 * v)),
+)
+
+
+@dataclass(slots=True)
+class Respuesta:
+    """Metric tables over the lever grid: `valores[metrica][i, j, k, l]` at `ejes[0][i]`, ..."""
+
+    base: dict
+    ejes: tuple
+    valores: dict
+
+    def consultar(self, **palancas):
+        """Interpolated METRICAS with some levers moved (the rest at the scenario's value)."""
+        indices, pesos = [], []
+        for palanca, eje in zip(PALANCAS, self.ejes):
+            x = min(max(palancas.get(palanca.campo, self.base[palanca.campo]), eje[0]), eje[-1])
+            i = min(int(np.searchsorted(eje, x, side="right")) - 1, len(eje) - 2)
+            ancho = eje[i + 1] - eje[i]
+            indices.append(i)
+            pesos.append((x - eje[i]) / ancho if ancho > 0 else 0.0)
+        esquinas = tuple(slice(i, i + 2) for i in indices)
+        salida = {}
+        for metrica, tabla in self.valores.items():
+            bloque = tabla[esquinas]
+            for t in pesos:
+                bloque = bloque[0] * (1 - t) + bloque[1] * t
+            salida[metrica] = float(bloque)
+        return salida
+
+
+def _eje(palanca, valor, puntos):
+    minimo, maximo = palanca.rango(valor)
+    return np.unique(np.append(np.linspace(minimo, maximo, puntos), valor))
+
+
+@instrumentacion.instrumentado("curvas_respuesta")
+def precalcular(d, puntos=PUNTOS, anio_inicio=None):
+    """Respuesta of scenario `d` over a grid of `puntos` (plus its own value) per lever.
+
+    METRICAS: first-year after-tax cash flow, its sum over the mortgage term, net
+    yield (%), monthly payment and the IRR (%) of selling after ANOS_VENTA years.
+    """
+    columnas = ScenarioSet.from_dicts([d]).columnas
+    base = {palanca.campo: float(columnas[palanca.campo][0]) for palanca in PALANCAS}
+    ejes = tuple(_eje(palanca, base[palanca.campo], puntos) for palanca in PALANCAS)
+    malla = np.meshgrid(*ejes, indexing="ij")
+    forma = malla[0].shape
+    n = malla[0].size
+
+    lote = {campo: np.repeat(columna, n) for campo, columna in columnas.items()}
+    for palanca, valores in zip(PALANCAS, malla):
+        lote[palanca.campo] = valores.ravel()
+    hipoteca_anos = int(columnas["hipoteca_anos"][0])
+    res = calcular_resultados_lote(lote, n_anos=max(hipoteca_anos, ANOS_VENTA), anio_inicio=anio_inicio)
+    valores = {
+        "beneficio_DI": res["beneficio_DI"],
+        "beneficio_total": res["beneficio_DI_anual"][:, :hipoteca_anos].sum(axis=1),
+        "rentabilidad_neta_real": res["rentabilidad_neta_real"],
+        "cuota_mensual": res["cuota_mensual"],
+        "tir": tir_venta(lote, res, ANOS_VENTA, anio_inicio=anio_inicio) * 100,
+    }
+    return Respuesta(base, ejes, {metrica: valores[metrica].reshape(forma) for metrica in METRICAS})
@@ -0,0 +1,510 @@
+"""Local HTTP/JSON scoring service for tools that want the numbers without the UI.
+
+An asyncio front end (stdlib only, HTTP/1.1 with keep-alive) accepts single-scenario
+requests and coalesces concurrent ones into micro-batches for calcular_resultados_lote,
+which runs in a worker thread so the event loop keeps accepting connections. The
+queue is bounded: when it is full the service answers 503 with Retry-After instead of
+buffering without limit.
+
+    POST /calcular[?anual=1]  scenario dict (saved-scenario keys) -> results and rule codes
+                              ("temporada": curves and fees instead of alquiler_mes and vacio)
+    POST /validar             scenario dict or list of them -> rule codes, errores, avisos
+    POST /amortizacion        capital, tin, hipoteca_anos -> yearly schedule
+    POST /comparables         m2 and latitud/longitud or codigo_postal -> rent estimate and band
+    GET  /estadisticas        latency percentiles, throughput, batch sizes
+    GET  /metrics             Prometheus text (metricas.py)
+
+    python servicio.py --puerto 8765
+    python servicio.py --bench 5000 --concurrencia 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+
+import comparables
+import metricas
+import temporada
+import validacion
+from calculos import calcular_resultados_lote, cuadro_amortizacion_anual
+
+HOST = "127.0.0.1"
+PUERTO = int(os.environ.get("CALCULADORA_SERVICIO_PUERTO", 8765))
+MAX_COLA = 2048
+MAX_LOTE = 256
+VENTANA_LOTE = 0.002
+MAX_CUERPO = 1024 * 1024
+MUESTRAS_LATENCIA = 10000
+
+REQUERIDOS = ("precio_compra", "alquiler_mes", "entrada", "tin", "hipoteca_anos")
+# Ausentes o null: se derivan (gastos de compra con comunidad) o se usa el tipo marginal
+OPCIONALES_NAN = ("gastos_compra", "itp_iva", "otros_ingresos")
+TEXTO = ("comunidad_autonoma",)
+RUTAS = ("/calcular", "/validar", "/amortizacion", "/comparables", "/estadisticas", "/metrics")
+
+
+class ErrorPeticion(Exception):
+    """Client error answered with a 4xx status."""
+
+    def __init__(self, mensaje, estado=HTTPStatus.BAD_REQUEST):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _escenario(cuerpo):
+    """Check a /calcular body and normalize it to floats (strings for TEXTO keys)."""
+    if not isinstance(cuerpo, dict):
+        raise ErrorPeticion("El cuerpo debe ser un objeto JSON con los datos del escenario")
+    requeridos = [clave for clave in REQUERIDOS if clave != "alquiler_mes" or "temporada" not in cuerpo]
+    faltan = [clave for clave in requeridos if cuerpo.get(clave) is None]
+    if faltan:
+        raise ErrorPeticion(f"Faltan campos obligatorios: {', '.join(faltan)}")
+    escenario = {}
+    for clave, valor in cuerpo.items():
+        if clave == "temporada":
+            try:
+                escenario[clave] = temporada.Temporada.from_dict(valor)
+            except (AttributeError, TypeError, ValueError) as e:
+                raise ErrorPeticion(f"Temporada no válida: {e}") from None
+        elif clave in TEXTO:
+            if valor is not None:
+                escenario[clave] = valor
+        elif valor is None and clave in OPCIONALES_NAN:
+            escenario[clave] = np.nan
+        else:
+            try:
+                escenario[clave] = float(valor)
+            except (TypeError, ValueError):
+                raise ErrorPeticion(f"Valor no numérico en '{clave}': {valor!r}") from None
+    _comprobar_plazo(escenario["hipoteca_anos"])
+    return escenario
+
+
+def _comprobar_plazo(hipoteca_anos):
+    """Refuse a term outside the valid range before it reaches the single compute thread."""
+    if not validacion.HIPOTECA_ANOS_MIN <= hipoteca_anos <= validacion.HIPOTECA_ANOS_MAX:
+        raise ErrorPeticion(validacion.MENSAJES["hipoteca_anos_fuera_rango"], HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
+def _a_json(resultado, fila, codigos, anual):
+    salida = {
+        clave: (valor[fila].tolist() if valor.ndim == 2 else float(valor[fila]))
+        for clave, valor in resultado.items()
+        if anual or valor.ndim == 1
+    }
+    salida["validacion"] = codigos
+    return salida
+
+
+def _expandir_temporadas(escenarios):
+    """Replace the "temporada" of every scenario carrying one by its scenario fields, in one batch."""
+    indices = [i for i, e in enumerate(escenarios) if "temporada" in e]
+    if not indices:
+        return escenarios
+    temporadas = [
+        e if isinstance(e, temporada.Temporada) else temporada.Temporada.from_dict(e)
+        for e in (escenarios[i]["temporada"] for i in indices)
+    ]
+    campos = temporada.campos_lote(
+        [t.ocupacion for t in temporadas], [t.tarifa for t in temporadas],
+        [t.estancia_media for t in temporadas], [t.limpieza for t in temporadas],
+        [t.comision_pct for t in temporadas],
+    )
+    expandidos = list(escenarios)
+    for fila, i in enumerate(indices):
+        expandidos[i] = {clave: valor for clave, valor in escenarios[i].items() if clave != "temporada"}
+        expandidos[i].update({clave: float(columna[fila]) for clave, columna in campos.items()})
+    return expandidos
+
+
+def _columnas(escenarios):
+    """Scenario dicts to columns over the union of their keys (NaN where absent or null)."""
+    claves = set().union(*escenarios)
+    return {
+        clave: np.array(
+            [e.get(clave) for e in escenarios] if clave in TEXTO else [e.get(clave, np.nan) for e in escenarios],
+            dtype=object if clave in TEXTO else float,
+        )
+        for clave in claves
+    }
+
+
+def calcular_lote(escenarios):
+    """Evaluate a list of normalized scenarios; returns one result (or exception) each.
+
+    The batch is validated first: rows breaking an INVALIDO rule get a ValueError with
+    their messages, the others carry the codes of the ERROR and AVISO rules they break.
+    Scenarios are grouped by the set of keys they carry and their mortgage term, so each
+    group keeps the same defaults and yearly arrays it would get alone. If a group
+    fails, its scenarios are retried one by one to isolate the culprit. Seasonal lets
+    ("temporada") are turned into their scenario fields first, all in one
+    temporada.campos_lote call.
+    """
+    # Las reglas de renta de las filas por temporada usan la renta media ponderada
+    temporadas = [e.get("temporada") for e in escenarios]
+    escenarios = _expandir_temporadas(escenarios)
+    revision = validacion.validar_lote({**_columnas(escenarios), "temporada": temporadas})
+    invalidos = revision.invalidos
+    codigos = revision.codigos_filas()
+    salida = [None] * len(escenarios)
+    grupos = {}
+    for i, escenario in enumerate(escenarios):
+        if invalidos[i]:
+            salida[i] = ValueError("; ".join(revision.mensajes(i)[0]))
+        else:
+            # El plazo fija cuántos años devuelve el lote: cada fila, los de su propio plazo
+            grupos.setdefault((frozenset(escenario), escenario["hipoteca_anos"]), []).append(i)
+
+    for (claves, _), indices in grupos.items():
+        columnas = {
+            clave: np.array(
+                [escenarios[i][clave] for i in indices], dtype=object if clave in TEXTO else float
+            )
+            for clave in claves
+        }
+        try:
+            resultado = calcular_resultados_lote(columnas)
+            for fila, i in enumerate(indices):
+                salida[i] = (resultado, fila, codigos[i])
+        except Exception:
+            for i in indices:
+                try:
+                    salida[i] = (
+                        calcular_resultados_lote({c: [v] for c, v in escenarios[i].items()}), 0, codigos[i]
+                    )
+                except Exception as e:
+                    salida[i] = e
+    return salida
+
+
+class Estadisticas:
+    """Request latencies per endpoint, throughput and batch sizes."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.latencias = {}
+        self.peticiones = 0
+        self.recientes = deque()
+        self.rechazadas = 0
+        self.lotes = 0
+        self.escenarios_en_lotes = 0
+        self.lote_maximo = 0
+
+    def registrar(self, ruta, segundos):
+        ahora = time.perf_counter()
+        self.latencias.setdefault(ruta, deque(maxlen=MUESTRAS_LATENCIA)).append(segundos)
+        self.peticiones += 1
+        self.recientes.append(ahora)
+        while self.recientes and self.recientes[0] < ahora - 60:
+            self.recientes.popleft()
+        metricas.observar_latencia(f"servicio{ruta.replace('/', '_')}", segundos)
+
+    def registrar_lote(self, tamano):
+        self.lotes += 1
+        self.escenarios_en_lotes += tamano
+        self.lote_maximo = max(self.lote_maximo, tamano)
+        metricas.incrementar("servicio_lotes")
+        metricas.incrementar("servicio_escenarios_en_lote", tamano)
+
+    def resumen(self, en_cola):
+        duracion = time.perf_counter() - self.inicio
+        return {
+            "peticiones": self.peticiones,
+            "rechazadas": self.rechazadas,
+            "en_cola": en_cola,
+            "peticiones_por_s": self.peticiones / duracion if duracion else 0.0,
+            "peticiones_por_s_ultimo_minuto": len(self.recientes) / min(duracion, 60) if duracion else 0.0,
+            "lotes": self.lotes,
+            "tamano_medio_lote": self.escenarios_en_lotes / self.lotes if self.lotes else 0.0,
+            "tamano_maximo_lote": self.lote_maximo,
+            "latencia_ms": {
+                ruta: {
+                    f"p{p}": float(np.percentile(valores, p)) * 1000 for p in (50, 95, 99)
+                }
+                for ruta, valores in self.latencias.items() if valores
+            },
+        }
+
+
+class Servicio:
+    """HTTP front end plus the micro-batching loop."""
+
+    def __init__(self, max_cola=MAX_COLA, max_lote=MAX_LOTE, ventana=VENTANA_LOTE):
+        self.cola = asyncio.Queue(maxsize=max_cola)
+        self.max_lote = max_lote
+        self.ventana = ventana
+        self.estadisticas = Estadisticas()
+        # Un único hilo de cálculo: mientras calcula, la cola acumula el siguiente lote
+        self.ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="servicio-lote")
+
+    async def agrupar(self):
+        """Take queued scenarios in micro-batches and resolve their futures."""
+        bucle = asyncio.get_running_loop()
+        while True:
+            lote = [await self.cola.get()]
+            limite = bucle.time() + self.ventana
+            while len(lote) < self.max_lote:
+                espera = limite - bucle.time()
+                if espera <= 0 and self.cola.empty():
+                    break
+                try:
+                    lote.append(self.cola.get_nowait() if espera <= 0 else await asyncio.wait_for(self.cola.get(), espera))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+
+            self.estadisticas.registrar_lote(len(lote))
+            try:
+                salida = await self._en_ejecutor(calcular_lote, [e for e, _ in lote])
+            except Exception as e:
+                salida = [e] * len(lote)
+            for (_, futuro), resultado in zip(lote, salida):
+                if not futuro.done():
+                    futuro.set_result(resultado)
+
+    async def calcular(self, cuerpo, anual):
+        escenario = _escenario(cuerpo)
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self.cola.put_nowait((escenario, futuro))
+        except asyncio.QueueFull:
+            self.estadisticas.rechazadas += 1
+            raise ErrorPeticion("Servicio saturado, reintenta en un momento", HTTPStatus.SERVICE_UNAVAILABLE) from None
+        resultado = await futuro
+        if isinstance(resultado, Exception):
+            raise ErrorPeticion(f"No se pudo calcular el escenario: {resultado}", HTTPStatus.UNPROCESSABLE_ENTITY)
+        return _a_json(*resultado, anual)
+
+    async def _en_ejecutor(self, funcion, *args):
+        # Todo el cálculo pasa por el hilo del servicio: el bucle solo atiende conexiones
+        return await asyncio.get_running_loop().run_in_executor(self.ejecutor, funcion, *args)
+
+    async def validar(self, cuerpo):
+        return await self._en_ejecutor(self._validar, cuerpo)
+
+    @staticmethod
+    def _validar(cuerpo):
+        """Rule codes and messages for one scenario, or codes per row (messages only for flagged rows) for a list."""
+        filas = cuerpo if isinstance(cuerpo, list) else [cuerpo]
+        if not filas or not all(isinstance(fila, dict) for fila in filas):
+            raise ErrorPeticion("El cuerpo debe ser un escenario o una lista de escenarios")
+        try:
+            revision = validacion.validar_lote(
+                {**_columnas(_expandir_temporadas(filas)), "temporada": [fila.get("temporada") for fila in filas]}
+            )
+        except (AttributeError, TypeError, ValueError):
+            raise ErrorPeticion("Los campos deben ser numéricos y la temporada tener 12 meses") from None
+
+        def fila_json(i):
+            errores, avisos = revision.mensajes(i)
+            return {"codigos": revision.codigos(i), "errores": errores, "avisos": avisos}
+
+        if not isinstance(cuerpo, list):
+            return fila_json(0)
+        marcadas = revision.errores | revision.avisos
+        return {
+            "filas": [
+                fila_json(i) if marcadas[i] else {"codigos": [], "errores": [], "avisos": []} for i in range(len(filas))
+            ],
+            "invalidas": int(revision.invalidos.sum()),
+            "con_errores": int(revision.errores.sum()),
+            "con_avisos": int(revision.avisos.sum()),
+            "resumen": revision.resumen(),
+        }
+
+    async def amortizacion(self, cuerpo):
+        try:
+            capital, tin, hipoteca_anos = (float(cuerpo[campo]) for campo in ("capital", "tin", "hipoteca_anos"))
+        except KeyError as e:
+            raise ErrorPeticion(f"Falta el campo {e.args[0]}") from None
+        except (TypeError, ValueError):
+            raise ErrorPeticion("Los campos deben ser numéricos") from None
+        _comprobar_plazo(hipoteca_anos)
+        return await self._en_ejecutor(self._amortizacion, capital, tin, hipoteca_anos)
+
+    @staticmethod
+    def _amortizacion(capital, tin, hipoteca_anos):
+        cuota, saldo, intereses, capital = cuadro_amortizacion_anual(capital, tin, hipoteca_anos)
+        return {
+            "cuota_mensual": float(cuota[0]),
+            "saldo": saldo[0].tolist(),
+            "intereses": intereses[0].tolist(),
+            "capital_amortizado": capital[0].tolist(),
+        }
+
+    async def comparables(self, cuerpo):
+        # Cargar e indexar el CSV y estimar bloquearía el bucle y los micro-lotes en curso
+        return await self._en_ejecutor(self._estimar_comparables, cuerpo)
+
+    @staticmethod
+    def _estimar_comparables(cuerpo):
+        indice = comparables.indice_por_defecto()
+        if indice is None:
+            raise ErrorPeticion("No hay dataset de comparables", HTTPStatus.SERVICE_UNAVAILABLE)
+        try:
+            estimacion = indice.estimar(
+                float(cuerpo["m2"]), cuerpo.get("latitud"), cuerpo.get("longitud"), cuerpo.get("codigo_postal")
+            )
+        except KeyError as e:
+            raise ErrorPeticion(f"Falta el campo {e.args[0]}") from None
+        except (TypeError, ValueError):
+            raise ErrorPeticion("Los campos deben ser numéricos") from None
+        if estimacion is None:
+            raise ErrorPeticion("No hay suficientes comparables para esa ubicación", HTTPStatus.UNPROCESSABLE_ENTITY)
+        return estimacion
+
+    async def despachar(self, metodo, ruta, parametros, cuerpo):
+        if metodo == "GET" and ruta == "/estadisticas":
+            return HTTPStatus.OK, "application/json", self.estadisticas.resumen(self.cola.qsize())
+        if metodo == "GET" and ruta == "/metrics":
+            return HTTPStatus.OK, "text/plain; version=0.0.4; charset=utf-8", metricas.exportar_prometheus()
+        if ruta not in RUTAS:
+            raise ErrorPeticion(f"Ruta desconocida: {ruta}", HTTPStatus.NOT_FOUND)
+        if metodo != "POST":
+            raise ErrorPeticion(f"Método {metodo} no permitido en {ruta}", HTTPStatus.METHOD_NOT_ALLOWED)
+        try:
+            datos = json.loads(cuerpo or b"{}")
+        except ValueError:
+            raise ErrorPeticion("El cuerpo no es JSON válido") from None
+        if ruta == "/calcular":
+            return HTTPStatus.OK, "application/json", await self.calcular(datos, parametros.get("anual") == "1")
+        if ruta == "/validar":
+            return HTTPStatus.OK, "application/json", await self.validar(datos)
+        if not isinstance(datos, dict):
+            raise ErrorPeticion("El cuerpo debe ser un objeto JSON")
+        if ruta == "/comparables":
+            return HTTPStatus.OK, "application/json", await self.comparables(datos)
+        return HTTPStatus.OK, "application/json", await self.amortizacion(datos)
+
+    async def atender(self, lector, escritor):
+        """Serve one connection (keep-alive) until the client closes it."""
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                inicio = time.perf_counter()
+                try:
+                    metodo, objetivo, version = linea.decode("latin-1").split()
+                except ValueError:
+                    break
+                cabeceras = {}
+                while (cabecera := await lector.readline()) not in (b"\r\n", b"\n", b""):
+                    nombre, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+
+                ruta, _, consulta = objetivo.partition("?")
+                parametros = dict(p.partition("=")[::2] for p in consulta.split("&") if p)
+                # Si el cuerpo no llega a leerse, la conexión queda desalineada y se cierra
+                cuerpo_leido = False
+                try:
+                    try:
+                        longitud = int(cabeceras.get("content-length", 0) or 0)
+                    except ValueError:
+                        raise ErrorPeticion("Content-Length no válido") from None
+                    if longitud < 0:
+                        raise ErrorPeticion("Content-Length no válido")
+                    if longitud > MAX_CUERPO:
+                        raise ErrorPeticion("Cuerpo demasiado grande", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    cuerpo = await lector.readexactly(longitud) if longitud else b""
+                    cuerpo_leido = True
+                    estado, tipo, contenido = await self.despachar(metodo, ruta, parametros, cuerpo)
+                except ErrorPeticion as e:
+                    estado, tipo, contenido = e.estado, "application/json", {"error": str(e)}
+
+                mantener = (
+                    cuerpo_leido and version == "HTTP/1.1" and cabeceras.get("connection", "").lower() != "close"
+                )
+                datos = (contenido if isinstance(contenido, str) else json.dumps(contenido, ensure_ascii=False)).encode("utf-8")
+                extra = "Retry-After: 1\r\n" if estado == HTTPStatus.SERVICE_UNAVAILABLE else ""
+                escritor.write(
+                    f"HTTP/1.1 {estado.value} {estado.phrase}\r\nContent-Type: {tipo}\r\n"
+                    f"Content-Length: {len(datos)}\r\n{extra}"
+                    f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n".encode("latin-1") + datos
+                )
+                await escritor.drain()
+                self.estadisticas.registrar(ruta if ruta in RUTAS else "/otras", time.perf_counter() - inicio)
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+    async def iniciar(self, host=HOST, puerto=PUERTO):
+        """Start the batching task and the TCP server; returns the asyncio server."""
+        self.tarea_lotes = asyncio.create_task(self.agrupar())
+        return await asyncio.start_server(self.atender, host, puerto)
+
+
+async def _servir(host, puerto):
+    servicio = Servicio()
+    servidor = await servicio.iniciar(host, puerto)
+    print(f"Servicio de cálculo en http://{host}:{puerto}", flush=True)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+async def _bench(peticiones, concurrencia, host, puerto):
+    """Fire `peticiones` /calcular requests from `concurrencia` keep-alive clients."""
+    servicio = Servicio()
+    servidor = await servicio.iniciar(host, puerto)
+    cuerpo = json.dumps({
+        "precio_compra": 200000, "reformas": 15000, "alquiler_mes": 1100, "entrada": 40000, "tin": 2.8,
+        "hipoteca_anos": 25, "irpf_marginal": 25, "valor_construccion_pct": 30, "gastos_compra": 4000,
+        "itp_iva": 16000, "ibi": 200, "comunidad": 240, "mantenimiento": 480, "vacio": 5,
+    }).encode("utf-8")
+    peticion = (
+        f"POST /calcular HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n\r\n"
+    ).encode("latin-1") + cuerpo
+    latencias, estados = [], {}
+
+    async def cliente(n):
+        lector, escritor = await asyncio.open_connection(host, puerto)
+        for _ in range(n):
+            inicio = time.perf_counter()
+            escritor.write(peticion)
+            await escritor.drain()
+            estado = int((await lector.readline()).split()[1])
+            longitud = 0
+            while (cabecera := await lector.readline()) != b"\r\n":
+                if cabecera.lower().startswith(b"content-length:"):
+                    longitud = int(cabecera.split(b":")[1])
+            await lector.readexactly(longitud)
+            latencias.append(time.perf_counter() - inicio)
+            estados[estado] = estados.get(estado, 0) + 1
+        escritor.close()
+
+    inicio = time.perf_counter()
+    reparto = [peticiones // concurrencia + (i < peticiones % concurrencia) for i in range(concurrencia)]
+    await asyncio.gather(*(cliente(n) for n in reparto if n))
+    duracion = time.perf_counter() - inicio
+    servidor.close()
+
+    resumen = servicio.estadisticas.resumen(servicio.cola.qsize())
+    print(f"{peticiones} peticiones, {concurrencia} clientes: {peticiones / duracion:.0f} peticiones/s, estados {estados}")
+    print("Latencia cliente: " + ", ".join(f"p{p} {np.percentile(latencias, p) * 1000:.1f} ms" for p in (50, 95, 99)))
+    print(f"Lotes: {resumen['lotes']}, tamaño medio {resumen['tamano_medio_lote']:.1f}, máximo {resumen['tamano_maximo_lote']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de cálculo de escenarios")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--bench", type=int, metavar="PETICIONES", help="Medir latencia y throughput y salir")
+    parser.add_argument("--concurrencia", type=int, default=32, help="Clientes simultáneos para --bench")
+    args = parser.parse_args()
+    if args.bench:
+        asyncio.run(_bench(args.bench, args.concurrencia, args.host, args.puerto))
+    else:
+        asyncio.run(_servir(args.host, args.puerto))
+
+
+if __name__ == "__main__":
+    main()
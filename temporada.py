@@ -0,0 +1,160 @@
+"""Seasonal and mid-term lets: income from monthly occupancy and nightly-rate curves.
+
+A Temporada gives, for each calendar month, the share of nights booked (`ocupacion`,
+%) and the nightly rate (`tarifa`, €), plus the average booking length
+(`estancia_media`, nights), the cleaning cost per booking (`limpieza`) and the
+platform commission on the gross income (`comision_pct`). Months at 0% occupancy
+are the closed season.
+
+Everything works on (scenarios, 12) arrays. campos_lote turns a batch of curves into
+the flat scenario fields, so calcular_resultados_lote and everything built on it need
+no separate income path: alquiler_mes is the income with every night booked spread
+over twelve months, vacio the share of it lost to unbooked nights (the seasonal
+vacancy), and gastos_limpieza / comision_plataforma the yearly fees. flujos_mensuales
+splits a year of results back into months.
+"""
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+import instrumentacion
+import metricas
+
+DIAS_MES = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+MESES = ("Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic")
+
+
+@dataclass(slots=True)
+class Temporada:
+    """Monthly curves and fees of one seasonal let (defaults: a coastal flat)."""
+
+    ocupacion: tuple = (20, 25, 35, 50, 60, 75, 90, 95, 70, 45, 25, 25)
+    tarifa: tuple = (60, 60, 65, 75, 85, 100, 130, 140, 95, 75, 60, 65)
+    estancia_media: float = 4.0
+    limpieza: float = 40.0
+    comision_pct: float = 15.0
+
+    def __post_init__(self):
+        self.ocupacion = tuple(float(v) for v in self.ocupacion)
+        self.tarifa = tuple(float(v) for v in self.tarifa)
+        if len(self.ocupacion) != 12 or len(self.tarifa) != 12:
+            raise ValueError("Las curvas de ocupación y tarifa deben tener un valor por mes (12)")
+        if any(not 0 <= v <= 100 for v in self.ocupacion):
+            raise ValueError("La ocupación mensual debe estar entre 0 y 100%")
+        if any(v < 0 for v in self.tarifa) or self.limpieza < 0:
+            raise ValueError("Las tarifas y la limpieza no pueden ser negativas")
+        if self.estancia_media < 1:
+            raise ValueError("La estancia media debe ser de al menos una noche")
+        if not 0 <= self.comision_pct <= 100:
+            raise ValueError("La comisión de la plataforma debe estar entre 0 y 100%")
+
+    @classmethod
+    def from_dict(cls, datos):
+        return cls(**{campo.name: datos[campo.name] for campo in fields(cls) if campo.name in datos})
+
+    def to_dict(self):
+        return {
+            "ocupacion": list(self.ocupacion), "tarifa": list(self.tarifa), "estancia_media": self.estancia_media,
+            "limpieza": self.limpieza, "comision_pct": self.comision_pct,
+        }
+
+    def campos_escenario(self):
+        """Scenario fields of this let, with alquiler_mes as an int (as the form stores it)."""
+        campos = {clave: float(valor[0]) for clave, valor in campos_lote(*self._columnas()).items()}
+        campos["alquiler_mes"] = int(campos["alquiler_mes"])
+        return campos
+
+    def mensual(self):
+        """mensual() for this let: one (12,) array per key."""
+        return {clave: valor[0] for clave, valor in mensual(*self._columnas()).items()}
+
+    def _columnas(self):
+        return (
+            np.array([self.ocupacion]), np.array([self.tarifa]), self.estancia_media, self.limpieza, self.comision_pct
+        )
+
+
+def _lote(ocupacion, tarifa, estancia_media, limpieza, comision_pct):
+    ocupacion = np.atleast_2d(np.asarray(ocupacion, dtype=float))
+    tarifa = np.atleast_2d(np.asarray(tarifa, dtype=float))
+    ocupacion, tarifa = np.broadcast_arrays(ocupacion, tarifa)
+    n = ocupacion.shape[0]
+    estancia_media, limpieza, comision_pct = (
+        np.broadcast_to(np.asarray(valor, dtype=float), (n,)) for valor in (estancia_media, limpieza, comision_pct)
+    )
+    return ocupacion, tarifa, estancia_media, limpieza, comision_pct
+
+
+def mensual(ocupacion, tarifa, estancia_media, limpieza, comision_pct):
+    """Monthly figures of a batch of lets as (scenarios, 12) arrays.
+
+    `ocupacion` and `tarifa` are (scenarios, 12); the other arguments are per scenario
+    (or scalars). Returns `noches` booked, gross `ingresos`, `reservas`, `limpieza` and
+    `comision` for each month.
+    """
+    ocupacion, tarifa, estancia_media, limpieza, comision_pct = _lote(
+        ocupacion, tarifa, estancia_media, limpieza, comision_pct
+    )
+    noches = DIAS_MES * ocupacion / 100
+    ingresos = noches * tarifa
+    reservas = noches / estancia_media[:, None]
+    return {
+        "noches": noches,
+        "ingresos": ingresos,
+        "reservas": reservas,
+        "limpieza": reservas * limpieza[:, None],
+        "comision": ingresos * comision_pct[:, None] / 100,
+    }
+
+
+@instrumentacion.instrumentado("campos_temporada")
+def campos_lote(ocupacion, tarifa, estancia_media, limpieza, comision_pct):
+    """Scenario columns of a batch of lets: alquiler_mes, vacio, gastos_limpieza, comision_plataforma.
+
+    alquiler_mes is rounded up to whole euros and vacio measured against it, so
+    12 × alquiler_mes × (1 - vacio / 100) is exactly the income of the booked nights.
+    """
+    ocupacion, tarifa, estancia_media, limpieza, comision_pct = _lote(
+        ocupacion, tarifa, estancia_media, limpieza, comision_pct
+    )
+    metricas.incrementar("temporadas_calculadas", len(tarifa))
+    meses = mensual(ocupacion, tarifa, estancia_media, limpieza, comision_pct)
+    alquiler_mes = np.ceil((DIAS_MES * tarifa).sum(axis=1) / 12)
+    ingresos = meses["ingresos"].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vacio = np.where(alquiler_mes > 0, 100 * (1 - ingresos / (12 * alquiler_mes)), 0.0)
+    return {
+        "alquiler_mes": alquiler_mes,
+        "vacio": vacio,
+        "gastos_limpieza": meses["limpieza"].sum(axis=1),
+        "comision_plataforma": meses["comision"].sum(axis=1),
+    }
+
+
+def flujos_mensuales(resultados, meses, ano=0):
+    """Split year `ano` of calcular_resultados_lote output into months.
+
+    `meses` is mensual() for the same scenarios. Income, cleaning and commission follow
+    the curves; the other running costs, the mortgage payment and the IRPF of the year
+    are spread evenly. Returns (scenarios, 12) arrays `ingresos`, `limpieza`,
+    `comision`, `fijos`, `hipoteca`, `irpf` and `flujo`; `flujo` adds up to the
+    year's beneficio_DI. A single scenario (calcular_resultados and Temporada.mensual)
+    gives (12,) arrays.
+    """
+    limpieza, comision = meses["limpieza"], meses["comision"]
+    fijos = np.asarray(
+        resultados["gastos_recurrentes"] - resultados["periodos_vacio"] - limpieza.sum(axis=-1) - comision.sum(axis=-1)
+    )
+    uniforme = np.ones(12) / 12
+    salida = {
+        "ingresos": meses["ingresos"],
+        "limpieza": limpieza,
+        "comision": comision,
+        "fijos": fijos[..., None] * uniforme,
+        "hipoteca": np.asarray(resultados["cuota_hipoteca_anual_anual"])[..., ano, None] * uniforme,
+        "irpf": np.asarray(resultados["irpf_anual"])[..., ano, None] * uniforme,
+    }
+    salida["flujo"] = (
+        salida["ingresos"] - limpieza - comision - salida["fijos"] - salida["hipoteca"] - salida["irpf"]
+    )
+    return salida
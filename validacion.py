@@ -0,0 +1,229 @@
+"""Batch validation of scenario inputs as boolean masks.
+
+Every rule is a vectorized condition over the input columns plus a code and a level:
+INVALIDO (the value cannot be computed with: negative amounts, percentages outside
+0-100, unknown community, mortgage terms outside 5-40 years), ERROR (implausible inputs the form refuses) and AVISO
+(advice). validar_lote evaluates all rules over a whole table at once and returns a
+Validacion holding one mask per rule; messages are only built for the rows someone
+asks about, so bulk imports and the scoring service can drop or flag rows without
+formatting a string per row.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from impuestos_compra import COMUNIDADES_AUTONOMAS
+from temporada import Temporada
+
+INVALIDO = "invalido"
+ERROR = "error"
+AVISO = "aviso"
+
+HIPOTECA_ANOS_MIN = 5
+HIPOTECA_ANOS_MAX = 40
+
+REQUERIDOS = ("precio_compra", "alquiler_mes", "entrada", "tin", "hipoteca_anos")
+IMPORTES = (
+    "reformas", "comision_agencia", "gastos_compra", "itp_iva", "otros_ingresos", "seguro_impago",
+    "impuesto_basuras", "seguro_hogar", "seguro_vida", "comunidad", "ibi", "mantenimiento", "gastos_habitaciones",
+    "gastos_limpieza", "comision_plataforma",
+)
+PORCENTAJES = ("vacio", "irpf_marginal", "reduccion_pct", "valor_construccion_pct")
+ETIQUETAS = {
+    "precio_compra": "Precio de compra",
+    "alquiler_mes": "Alquiler mensual",
+    "entrada": "Entrada",
+    "tin": "TIN",
+    "hipoteca_anos": "Años de hipoteca",
+    "reformas": "Reformas",
+    "comision_agencia": "Comisión agencia",
+    "gastos_compra": "Notaría, registro y gestoría",
+    "itp_iva": "ITP / IVA",
+    "otros_ingresos": "Otros ingresos anuales",
+    "seguro_impago": "Seguro impago",
+    "impuesto_basuras": "Impuesto basuras",
+    "seguro_hogar": "Seguro hogar",
+    "seguro_vida": "Seguro vida",
+    "comunidad": "Comunidad",
+    "ibi": "IBI",
+    "mantenimiento": "Mantenimiento",
+    "gastos_habitaciones": "Gastos habitaciones",
+    "gastos_limpieza": "Limpieza",
+    "comision_plataforma": "Comisión plataforma",
+    "vacio": "Periodos vacío (%)",
+    "irpf_marginal": "IRPF marginal (%)",
+    "reduccion_pct": "Reducción por alquiler (%)",
+    "valor_construccion_pct": "Valor construcción (%)",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Regla:
+    """One validation rule: `condicion(columnas)` is True on the rows that break it."""
+
+    codigo: str
+    nivel: str
+    condicion: Callable
+
+
+def _comunidad_desconocida(c):
+    return np.fromiter(
+        (isinstance(ca, str) and ca not in COMUNIDADES_AUTONOMAS for ca in c["comunidad_autonoma"]),
+        dtype=bool, count=len(c["comunidad_autonoma"]),
+    )
+
+
+# El orden de las reglas ERROR y AVISO es el de los mensajes que muestra el formulario
+REGLAS = (
+    *(Regla(f"{campo}_falta", INVALIDO, lambda c, campo=campo: np.isnan(c[campo])) for campo in REQUERIDOS),
+    Regla("precio_compra_no_positivo", INVALIDO, lambda c: c["precio_compra"] <= 0),
+    Regla("hipoteca_anos_no_positivo", INVALIDO, lambda c: c["hipoteca_anos"] <= 0),
+    # Un plazo desorbitado (1e6 años) bloquearía el cálculo año a año: no se calcula
+    Regla(
+        "hipoteca_anos_fuera_rango", INVALIDO,
+        lambda c: (c["hipoteca_anos"] < HIPOTECA_ANOS_MIN) | (c["hipoteca_anos"] > HIPOTECA_ANOS_MAX)
+    ),
+    *(Regla(f"{campo}_negativo", INVALIDO, lambda c, campo=campo: c[campo] < 0)
+      for campo in ("alquiler_mes", "entrada", "tin") + IMPORTES),
+    *(Regla(f"{campo}_fuera_rango", INVALIDO, lambda c, campo=campo: (c[campo] < 0) | (c[campo] > 100))
+      for campo in PORCENTAJES),
+    Regla("comunidad_autonoma_desconocida", INVALIDO, _comunidad_desconocida),
+    Regla("entrada_mayor_precio", ERROR, lambda c: c["entrada"] > c["precio_compra"]),
+    Regla("alquiler_bajo", ERROR, lambda c: c["alquiler_mes"] * 12 < c["precio_compra"] * 0.03),
+    # En temporada alquiler_mes es la renta con todas las noches reservadas: se usa la media ponderada
+    Regla("alquiler_alto", ERROR, lambda c: c["alquiler_medio"] * 12 > c["precio_compra"] * 0.20),
+    Regla("tin_fuera_rango", ERROR, lambda c: (c["tin"] < 0.5) | (c["tin"] > 15)),
+    Regla("entrada_baja", AVISO, lambda c: c["entrada"] < c["precio_compra"] * 0.15),
+    Regla("rentabilidad_bruta_baja", AVISO, lambda c: c["alquiler_mes"] * 12 < c["precio_compra"] * 0.05),
+    Regla("tin_alto", AVISO, lambda c: c["tin"] > 5),
+    Regla("vacio_alto", AVISO, lambda c: c["vacio"] > 25),
+    Regla(
+        "valor_construccion_atipico", AVISO,
+        lambda c: (c["valor_construccion_pct"] < 10) | (c["valor_construccion_pct"] > 80)
+    ),
+)
+
+MENSAJES = {
+    **{f"{campo}_falta": f"⚠️ Falta un dato obligatorio: {ETIQUETAS[campo]}" for campo in REQUERIDOS},
+    "precio_compra_no_positivo": "⚠️ El precio de compra debe ser mayor que cero",
+    "hipoteca_anos_no_positivo": "⚠️ Los años de hipoteca deben ser mayores que cero",
+    **{
+        f"{campo}_negativo": f"⚠️ Valor negativo en «{ETIQUETAS[campo]}»"
+        for campo in ("alquiler_mes", "entrada", "tin") + IMPORTES
+    },
+    **{f"{campo}_fuera_rango": f"⚠️ «{ETIQUETAS[campo]}» debe estar entre 0 y 100" for campo in PORCENTAJES},
+    "comunidad_autonoma_desconocida": "⚠️ Comunidad autónoma desconocida",
+    "entrada_mayor_precio": "⚠️ La entrada no puede ser mayor al precio de compra",
+    "alquiler_bajo": "⚠️ El alquiler anual parece muy bajo comparado con el precio (< 3% anual)",
+    "alquiler_alto": "⚠️ El alquiler anual parece muy alto comparado con el precio (> 20% anual)",
+    "tin_fuera_rango": "⚠️ El tipo de interés parece fuera del rango normal (0.5% - 15%)",
+    "hipoteca_anos_fuera_rango": f"⚠️ Los años de hipoteca deben estar entre {HIPOTECA_ANOS_MIN} y {HIPOTECA_ANOS_MAX}",
+    "entrada_baja": "💡 Entrada menor al 15% puede requerir condiciones especiales del banco",
+    "rentabilidad_bruta_baja": "💡 Rentabilidad bruta muy baja (< 5% anual)",
+    "tin_alto": "💡 Tipo de interés alto, considera negociar con otros bancos",
+    "vacio_alto": "💡 Periodos de vacío muy altos (> 25% del año)",
+    "valor_construccion_atipico": "💡 El valor de construcción suele estar entre el 10% y el 80% del total",
+}
+
+
+class Validacion:
+    """Rule masks of a validated batch: `matriz[r, i]` is True when row i breaks REGLAS[r]."""
+
+    __slots__ = ("matriz", "_niveles")
+
+    def __init__(self, matriz):
+        self.matriz = matriz
+        self._niveles = np.array([regla.nivel for regla in REGLAS])
+
+    def __len__(self):
+        return self.matriz.shape[1]
+
+    def _nivel(self, *niveles):
+        return self.matriz[np.isin(self._niveles, niveles)].any(axis=0)
+
+    @property
+    def invalidos(self):
+        """Rows that cannot be computed."""
+        return self._nivel(INVALIDO)
+
+    @property
+    def errores(self):
+        """Rows the form would refuse (invalid or implausible)."""
+        return self._nivel(INVALIDO, ERROR)
+
+    @property
+    def avisos(self):
+        return self._nivel(AVISO)
+
+    def mascara(self, codigo):
+        return self.matriz[_POSICION[codigo]]
+
+    def codigos(self, i):
+        """Codes of the rules row i breaks, in REGLAS order."""
+        return [REGLAS[r].codigo for r in np.flatnonzero(self.matriz[:, i])]
+
+    def codigos_filas(self):
+        """codigos for every row in one pass (empty lists for clean rows)."""
+        filas = [[] for _ in range(len(self))]
+        for i, r in zip(*np.nonzero(self.matriz.T)):
+            filas[i].append(REGLAS[r].codigo)
+        return filas
+
+    def mensajes(self, i, mensajes=None):
+        """(errores, avisos) message lists of row i; `mensajes` overrides MENSAJES (e.g. other language)."""
+        mensajes = mensajes or MENSAJES
+        errores, avisos = [], []
+        for r in np.flatnonzero(self.matriz[:, i]):
+            (avisos if REGLAS[r].nivel == AVISO else errores).append(mensajes[REGLAS[r].codigo])
+        return errores, avisos
+
+    def resumen(self):
+        """{code: rows breaking it} for the rules broken at least once."""
+        cuentas = self.matriz.sum(axis=1)
+        return {REGLAS[r].codigo: int(cuentas[r]) for r in np.flatnonzero(cuentas)}
+
+
+_POSICION = {regla.codigo: r for r, regla in enumerate(REGLAS)}
+
+
+def validar_lote(escenarios):
+    """Evaluate every rule over a batch of scenarios.
+
+    `escenarios` maps input keys to array-likes as for calcular_resultados_lote (a
+    ScenarioSet's columns or a DataFrame work too). Missing required columns count as
+    missing values; other missing columns, and NaN in optional fields, break no rule.
+    Rows whose "temporada" is a curve dict or a Temporada are seasonal lets: their rent
+    rules use the occupancy-weighted rent alquiler_mes × (1 - vacio / 100) that
+    temporada.campos_lote produces, not the rent with every night booked.
+    """
+    n = len(np.atleast_1d(np.asarray(escenarios["precio_compra"])))
+    c = {
+        campo: np.broadcast_to(
+            np.asarray(escenarios[campo], dtype=float) if campo in escenarios else np.nan, (n,)
+        )
+        for campo in REQUERIDOS + IMPORTES + PORCENTAJES
+    }
+    c["comunidad_autonoma"] = np.broadcast_to(
+        np.asarray(escenarios["comunidad_autonoma"], dtype=object) if "comunidad_autonoma" in escenarios else None,
+        (n,),
+    )
+    con_temporada = np.fromiter(
+        (isinstance(t, (dict, Temporada)) for t in escenarios["temporada"]), dtype=bool, count=n
+    ) if "temporada" in escenarios else np.zeros(n, dtype=bool)
+    c["alquiler_medio"] = np.where(
+        con_temporada, c["alquiler_mes"] * (1 - np.nan_to_num(c["vacio"]) / 100), c["alquiler_mes"]
+    )
+    matriz = np.empty((len(REGLAS), n), dtype=bool)
+    for r, regla in enumerate(REGLAS):
+        matriz[r] = regla.condicion(c)
+    return Validacion(matriz)
+
+
+def validate_inputs(precio_compra, alquiler_mes, entrada, tin, hipoteca_anos, **otros):
+    """Validate financial inputs and return error messages if any."""
+    validacion = validar_lote({
+        "precio_compra": [precio_compra], "alquiler_mes": [alquiler_mes], "entrada": [entrada], "tin": [tin],
+        "hipoteca_anos": [hipoteca_anos], **{campo: [valor] for campo, valor in otros.items()},
+    })
+    return validacion.mensajes(0)
@@ -0,0 +1,133 @@
+"""Exit analysis: selling the property at the end of every possible holding year.
+
+For each sale year 1..hipoteca_anos the model takes the appreciated sale price,
+subtracts selling costs, taxes the ganancia patrimonial in the savings base (the
+amortization deducted while renting is added back to the gain, since it lowered the
+acquisition value), pays off the outstanding mortgage and returns the net proceeds and
+the IRR of the whole investment. All scenarios and horizons are computed as
+(scenarios, years) matrices in one pass.
+"""
+import numpy as np
+
+import fiscalidad
+import instrumentacion
+from calculos import REVALORIZACION_ANUAL
+
+# Comisión de la agencia, plusvalía municipal, certificado energético y cancelación registral
+GASTOS_VENTA_PCT = 5.0
+TIR_MIN = -0.99
+TIR_MAX = 1.0
+ITERACIONES_TIR = 40
+
+
+def tir_lote(inversion, flujos, finales, horizontes):
+    """IRR of many cash-flow series sharing one outlay per scenario, by vectorized bisection.
+
+    `inversion` (scenarios,) is paid at t=0, `flujos` (scenarios, years) are the yearly
+    flows and `finales` (scenarios, horizons) the extra flow in the last year of each
+    horizon; horizon h (1-based, `horizontes`) uses flows 1..h. Returns (scenarios,
+    horizons), NaN where the NPV does not change sign between TIR_MIN and TIR_MAX.
+    """
+    flujos = np.asarray(flujos, dtype=float)
+    horizontes = np.asarray(horizontes)
+    # Con los horizontes ordenados, los que siguen abiertos en el año t son una cola contigua
+    orden = np.argsort(horizontes, kind="stable")
+    horizontes, finales = horizontes[orden], np.asarray(finales, dtype=float)[:, orden]
+    abiertos = np.searchsorted(horizontes, np.arange(horizontes[-1] + 2), side="left")
+
+    def van(r):
+        # Recorre los años acumulando el flujo descontado de cada horizonte: memoria
+        # O(escenarios × horizontes), sin tensor (escenarios, horizontes, años)
+        v = 1 / (1 + r)
+        descuento = np.ones_like(r)
+        total = np.repeat(-inversion[:, None], r.shape[1], axis=1)
+        for t in range(1, horizontes[-1] + 1):
+            i, j = abiertos[t], abiertos[t + 1]
+            descuento[:, i:] *= v[:, i:]
+            total[:, i:] += flujos[:, t - 1, None] * descuento[:, i:]
+            total[:, i:j] += finales[:, i:j] * descuento[:, i:j]
+        return total
+
+    forma = finales.shape
+    bajo = np.full(forma, TIR_MIN)
+    alto = np.full(forma, TIR_MAX)
+    van_bajo = van(bajo)
+    valido = np.sign(van_bajo) != np.sign(van(alto))
+    for _ in range(ITERACIONES_TIR):
+        medio = (bajo + alto) / 2
+        van_medio = van(medio)
+        mismo_signo = np.sign(van_medio) == np.sign(van_bajo)
+        bajo = np.where(mismo_signo, medio, bajo)
+        van_bajo = np.where(mismo_signo, van_medio, van_bajo)
+        alto = np.where(mismo_signo, alto, medio)
+    tir = np.empty(forma)
+    tir[:, orden] = np.where(valido, (bajo + alto) / 2, np.nan)
+    return tir
+
+
+def _venta(escenarios, resultados, horizontes, revalorizacion, gastos_venta_pct, anio_inicio):
+    """Sale price, costs, gain, tax and net proceeds for sales at the end of each horizon."""
+    precio = np.asarray(escenarios["precio_compra"], dtype=float)
+    precio_venta = precio[:, None] * (1 + revalorizacion) ** horizontes[None, :]
+    gastos_venta = precio_venta * gastos_venta_pct / 100
+
+    # Valor de adquisición: precio, gastos e impuestos de compra, reformas y comisión;
+    # menos la amortización deducida durante el alquiler
+    valor_adquisicion = (
+        precio + resultados["gastos_compra"] + resultados["itp_iva"]
+        + np.asarray(escenarios["reformas"], dtype=float) + np.asarray(escenarios["comision_agencia"], dtype=float)
+    )
+    amortizacion_acumulada = resultados["amortizacion_anual"][:, None] * horizontes[None, :]
+    ganancia = precio_venta - gastos_venta - (valor_adquisicion[:, None] - amortizacion_acumulada)
+    impuesto = fiscalidad.cuota_ahorro(ganancia, anio_inicio)
+
+    deuda = resultados["saldo_hipoteca"][:, horizontes]
+    return {
+        "precio_venta": precio_venta,
+        "gastos_venta": gastos_venta,
+        "ganancia_patrimonial": ganancia,
+        "impuesto_ganancia": impuesto,
+        "deuda_pendiente": deuda,
+        "neto_venta": precio_venta - gastos_venta - deuda - impuesto,
+    }
+
+
+@instrumentacion.instrumentado("analisis_venta")
+def analisis_venta(escenarios, resultados, revalorizacion=REVALORIZACION_ANUAL, gastos_venta_pct=GASTOS_VENTA_PCT,
+                   anio_inicio=None):
+    """Sale at the end of each year 1..hipoteca_anos for a batch of scenarios.
+
+    `escenarios` holds the input columns (e.g. ScenarioSet.columnas) and `resultados`
+    the matching calcular_resultados_lote output. Matrices have shape (scenarios,
+    years); years past a scenario's own mortgage term are NaN. `ano_optimo` is the
+    1-based sale year with the highest IRR.
+    """
+    plazo = np.asarray(escenarios["hipoteca_anos"], dtype=float)
+    n_anos = resultados["saldo_hipoteca"].shape[1] - 1
+    horizontes = np.arange(1, n_anos + 1)
+    dentro = horizontes[None, :] <= plazo[:, None]
+
+    salida = _venta(escenarios, resultados, horizontes, revalorizacion, gastos_venta_pct, anio_inicio)
+    flujos = resultados["beneficio_DI_anual"]
+    salida["flujo_acumulado"] = np.cumsum(flujos, axis=1)
+    salida["beneficio_total"] = (
+        salida["flujo_acumulado"] + salida["neto_venta"] - resultados["inversion_inicial"][:, None]
+    )
+    salida["tir"] = tir_lote(resultados["inversion_inicial"], flujos, salida["neto_venta"], horizontes)
+    salida = {clave: np.where(dentro, valor, np.nan) for clave, valor in salida.items()}
+
+    tir_valida = np.where(np.isnan(salida["tir"]), -np.inf, salida["tir"])
+    salida["ano_optimo"] = np.where(np.isfinite(tir_valida).any(axis=1), np.argmax(tir_valida, axis=1) + 1, 0)
+    return salida
+
+
+def tir_venta(escenarios, resultados, ano_venta, revalorizacion=REVALORIZACION_ANUAL,
+              gastos_venta_pct=GASTOS_VENTA_PCT, anio_inicio=None):
+    """IRR (scenarios,) of selling at the end of year `ano_venta`, even past the mortgage term.
+
+    `resultados` must cover at least `ano_venta` years (calcular_resultados_lote n_anos).
+    """
+    horizontes = np.array([ano_venta])
+    neto = _venta(escenarios, resultados, horizontes, revalorizacion, gastos_venta_pct, anio_inicio)["neto_venta"]
+    flujos = resultados["beneficio_DI_anual"][:, :ano_venta]
+    return tir_lote(resultados["inversion_inicial"], flujos, neto, horizontes)[:, 0]